@@ -1,47 +1,21 @@
 import argparse
-import csv
 import time
 import os
 import json
-import concurrent.futures
-import sys
 
-import numpy as np
-import torch
-import torch.optim as optim
-import torch.nn as nn
-import torch.nn.functional as F
-
-from torch_geometric.datasets import TUDataset
-from torch_geometric.datasets import Planetoid, KarateClub, QM7b
-from torch_geometric.data import DataLoader
-import torch_geometric.utils as pyg_utils
-
-import torch_geometric.nn as pyg_nn
-from matplotlib import cm
-
-from common import data
-from common import models
-from common import utils
-from subgraph_mining import decoder
-
-from tqdm import tqdm
-import matplotlib.pyplot as plt
+from common import edgelist
+from common import graph_store
 
 from multiprocessing import Pool
 import random
-from sklearn.manifold import TSNE
-from sklearn.cluster import KMeans
-from collections import defaultdict, Counter
-from itertools import permutations
-from queue import PriorityQueue
-import matplotlib.colors as mcolors
+from collections import defaultdict
 import networkx as nx
 import networkx.algorithms.isomorphism as iso
 import pickle
-import torch.multiprocessing as mp
-from sklearn.decomposition import PCA
-from itertools import combinations
+
+# torch_geometric and the decoder (for the plant datasets) are imported by
+# the code that converts and loads those datasets, so that worker processes
+# and --help start without torch
 
 # Increase timeout for large graphs
 MAX_SEARCH_TIME = 1800  # 30 minutes for large graph processing
@@ -86,7 +60,7 @@ def can_be_isomorphic(query_stats, target_stats):
     
     return True
 
-def arg_parse():
+def arg_parse(argv=None):
     parser = argparse.ArgumentParser(description='count graphlets in a graph')
     parser.add_argument('--dataset', type=str)
     parser.add_argument('--queries_path', type=str)
@@ -99,6 +73,7 @@ def arg_parse():
     parser.add_argument('--max_query_size', type=int, default=20, help='Maximum query size to process')
     parser.add_argument('--sample_anchors', type=int, default=DEFAULT_SAMPLE_ANCHORS, help='Number of anchor nodes to sample for large graphs')
     parser.add_argument('--checkpoint_file', type=str, default="checkpoint.json", help='File to save/load progress')
+    parser.add_argument('--problematic_tasks_file', type=str, default="problematic_tasks.json", help='File to save/load tasks skipped after timing out')
     parser.add_argument('--batch_size', type=int, default=500, help='Batch size for processing')
     parser.add_argument('--timeout', type=int, default=MAX_SEARCH_TIME, help='Timeout per task in seconds')
     parser.add_argument('--use_sampling', action="store_true", help='Use node sampling for very large graphs')
@@ -109,10 +84,12 @@ def arg_parse():
                        count_method="bin",
                        baseline="none",
                        preserve_labels=False)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 def load_networkx_graph(filepath):
     """Load a Networkx graph from pickle format with proper attributes handling."""
+    if filepath.endswith(graph_store.GRAPH_STORE_EXT):
+        return graph_store.CompactGraph.load(filepath).to_networkx("undirected")
     with open(filepath, 'rb') as f:
         data = pickle.load(f)
         graph = nx.Graph()
@@ -298,7 +275,7 @@ def count_graphlets(queries, targets, args):
     n_matches = load_checkpoint(args.checkpoint_file)
     
     # Load or create problematic tasks list
-    problematic_tasks_file = "problematic_tasks.json"
+    problematic_tasks_file = args.problematic_tasks_file
     if os.path.exists(problematic_tasks_file):
         with open(problematic_tasks_file, 'r') as f:
             try:
@@ -467,6 +444,7 @@ def generate_one_baseline(args):
 def convert_to_networkx(graph):
     if isinstance(graph, nx.Graph):
         return graph
+    import torch_geometric.utils as pyg_utils
     return pyg_utils.to_networkx(graph).to_undirected()
     
 def gen_baseline_queries(queries, targets, method="radial", node_anchored=False):
@@ -488,7 +466,9 @@ def main():
     print(f"Timeout per task: {args.timeout} seconds")
 
     # Load dataset based on type
-    if args.dataset.endswith('.pkl'):
+    if args.dataset in ("enzymes", "cox2", "reddit-binary", "coil", "analyze"):
+        from torch_geometric.datasets import TUDataset
+    if args.dataset.endswith('.pkl') or args.dataset.endswith(graph_store.GRAPH_STORE_EXT):
         print(f"Loading Networkx graph from {args.dataset}")
         try:
             graph = load_networkx_graph(args.dataset)
@@ -506,25 +486,19 @@ def main():
     elif args.dataset == 'coil':
         dataset = TUDataset(root='/tmp/coil', name='COIL-DEL')
     elif args.dataset == 'ppi-pathways':
-        graph = nx.Graph()
-        with open("data/ppi-pathways.csv", "r") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                graph.add_edge(int(row[0]), int(row[1]))
+        graph = edgelist.load_edgelist("data/ppi-pathways.csv",
+            fmt="csv").to_networkx("undirected")
         dataset = [graph]
     elif args.dataset in ['diseasome', 'usroads', 'mn-roads', 'infect']:
         fn = {"diseasome": "bio-diseasome.mtx",
             "usroads": "road-usroads.mtx",
             "mn-roads": "mn-roads.mtx",
             "infect": "infect-dublin.edges"}
-        graph = nx.Graph()
-        with open("data/{}".format(fn[args.dataset]), "r") as f:
-            for line in f:
-                if not line.strip(): continue
-                a, b = line.strip().split(" ")
-                graph.add_edge(int(a), int(b))
+        graph = edgelist.load_edgelist("data/{}".format(
+            fn[args.dataset])).to_networkx("undirected")
         dataset = [graph]
     elif args.dataset.startswith('plant-'):
+        from subgraph_mining import decoder
         size = int(args.dataset.split("-")[-1])
         dataset = decoder.make_plant_dataset(size)
     elif args.dataset == "analyze":
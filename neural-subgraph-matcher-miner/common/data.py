@@ -1,10 +1,11 @@
+import hashlib
+import json
 import os
 import pickle
 import random
 
 from deepsnap.graph import Graph as DSGraph
 from deepsnap.batch import Batch
-from deepsnap.batch import Batch as DSBatch
 from deepsnap.dataset import GraphDataset
 import networkx as nx
 import numpy as np
@@ -16,9 +17,9 @@ from tqdm import tqdm
 import scipy.stats as stats
 from common import combined_syn
 from common import feature_preprocess
+from common import graph_store
 from common import utils
-
-from torch.utils.data import Dataset, DataLoader, DistributedSampler
+from common.neigh_sampler import TreeNeighborhoodSampler
 
 def load_dataset(name):
     """ Load real-world datasets, available in PyTorch Geometric.
@@ -124,6 +125,10 @@ class CustomGraphDataset:
             self.graph = self.full_graph.G
 
     def _load_graph(self):
+        if self.graph_pkl_path.endswith(graph_store.GRAPH_STORE_EXT):
+            G = graph_store.CompactGraph.load(self.graph_pkl_path).to_networkx(
+                "undirected")
+            return {'nodes': list(G.nodes), 'edges': list(G.edges(data=True))}
         with open(self.graph_pkl_path, 'rb') as f:
             return pickle.load(f)
 
@@ -470,6 +475,15 @@ class DiskDataSource(DataSource):
         self.dataset = load_dataset(dataset_name)
         self.min_size = min_size
         self.max_size = max_size
+        self.neigh_samplers = {}
+
+    def neigh_sampler(self, train):
+        """TreeNeighborhoodSampler of the train or test graphs, built once."""
+        if train not in self.neigh_samplers:
+            train_set, test_set, _ = self.dataset
+            self.neigh_samplers[train] = TreeNeighborhoodSampler(train_set if
+                train else test_set, min_size=self.min_size)
+        return self.neigh_samplers[train]
 
     def gen_data_loaders(self, size, batch_size, train=True,
         use_distributed_sampling=False):
@@ -483,13 +497,17 @@ class DiskDataSource(DataSource):
         graphs = train_set if train else test_set
         if seed is not None:
             random.seed(seed)
+        rng = np.random.RandomState(seed) if seed is not None else np.random
+        sampler = self.neigh_sampler(train)
 
         pos_a, pos_b = [], []
         pos_a_anchors, pos_b_anchors = [], []
+        if sample_method == "tree-pair":
+            pos_neighs = sampler.sample_neighs([random.randint(min_size+1,
+                max_size) for i in range(batch_size // 2)], rng)
         for i in range(batch_size // 2):
             if sample_method == "tree-pair":
-                size = random.randint(min_size+1, max_size)
-                graph, a = utils.sample_neigh(graphs, size)
+                graph, a = pos_neighs[i]
                 b = a[:random.randint(min_size, len(a) - 1)]
             elif sample_method == "subgraph-tree":
                 graph = None
@@ -511,16 +529,15 @@ class DiskDataSource(DataSource):
         while len(neg_a) < batch_size // 2:
             if sample_method == "tree-pair":
                 size = random.randint(min_size+1, max_size)
-                graph_a, a = utils.sample_neigh(graphs, size)
-                graph_b, b = utils.sample_neigh(graphs, random.randint(min_size,
-                    size - 1))
+                (graph_a, a), (graph_b, b) = sampler.sample_neighs([size,
+                    random.randint(min_size, size - 1)], rng)
             elif sample_method == "subgraph-tree":
                 graph_a = None
                 while graph_a is None or len(graph_a) < min_size + 1:
                     graph_a = random.choice(graphs)
                 a = graph_a.nodes
-                graph_b, b = utils.sample_neigh(graphs, random.randint(min_size,
-                    len(graph_a) - 1))
+                graph_b, b = sampler.sample_neighs([random.randint(min_size,
+                    len(graph_a) - 1)], rng)[0]
             if self.node_anchored:
                 neg_a_anchors.append(list(graph_a.nodes)[0])
                 neg_b_anchors.append(list(graph_b.nodes)[0])
@@ -559,16 +576,25 @@ class DiskImbalancedDataSource(OTFSynDataSource):
         self.dataset = load_dataset(dataset_name)
         self.train_set, self.test_set, _ = self.dataset
         self.dataset_name = dataset_name
+        self.neigh_samplers = {}
+
+    def neigh_sampler(self, train):
+        """TreeNeighborhoodSampler of the train or test graphs, built once."""
+        if train not in self.neigh_samplers:
+            self.neigh_samplers[train] = TreeNeighborhoodSampler(
+                self.train_set if train else self.test_set,
+                min_size=self.min_size)
+        return self.neigh_samplers[train]
 
     def gen_data_loaders(self, size, batch_size, train=True,
         use_distributed_sampling=False):
+        sampler = self.neigh_sampler(train)
         loaders = []
         for i in range(2):
-            neighs = []
-            for j in range(size // 2):
-                graph, neigh = utils.sample_neigh(self.train_set if train else
-                    self.test_set, random.randint(self.min_size, self.max_size))
-                neighs.append(graph.subgraph(neigh))
+            sizes = [random.randint(self.min_size, self.max_size) for j in
+                range(size // 2)]
+            neighs = [graph.subgraph(neigh) for graph, neigh in
+                sampler.sample_neighs(sizes)]
             dataset = GraphDataset(neighs)
             loaders.append(TorchDataLoader(dataset,
                 collate_fn=Batch.collate([]), batch_size=batch_size // 2 if i
@@ -617,7 +643,63 @@ class DiskImbalancedDataSource(OTFSynDataSource):
         neg_b = utils.batch_nx_graphs(neg_b)
         self.batch_idx += 1
         return pos_a, pos_b, neg_a, neg_b
-    
+
+VALIDATION_SET_VERSION = 1   # bump when the file layout or sampling changes
+
+def validation_set_params(data_source, val_size, batch_size, graph_path=None):
+    """Parameters a validation set of data_source is generated from: the
+    data source class and its scalar settings, the set size, the feature
+    augmentation and, if given, the SHA-1 of the graph file."""
+    params = {"version": VALIDATION_SET_VERSION,
+        "source": type(data_source).__name__,
+        "settings": {k: v for k, v in sorted(vars(data_source).items())
+            if isinstance(v, (bool, int, float, str))},
+        "val_size": val_size, "batch_size": batch_size,
+        "feature_augment": list(zip(feature_preprocess.FEATURE_AUGMENT,
+            feature_preprocess.FEATURE_AUGMENT_DIMS))}
+    if graph_path and os.path.isfile(graph_path):
+        h = hashlib.sha1()
+        with open(graph_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                h.update(block)
+        params["graph_sha1"] = h.hexdigest()
+    return params
+
+def load_validation_set(data_source, params, cache_dir):
+    """ Validation batches of data_source as a list of utils.FusedBatch
+    (pos_a, pos_b, neg_a, neg_b each), on the CPU.
+
+    The set is generated once, seeded by the hash of params (see
+    validation_set_params), and saved as tensors to
+    cache_dir/val-<hash>.pt; later runs with the same params load it, so
+    checkpoints are compared on the same pairs.
+    """
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()
+        ).hexdigest()[:16]
+    path = os.path.join(cache_dir, "val-{}.pt".format(key))
+    if os.path.exists(path):
+        print("Loading validation set {}".format(path))
+        return [utils.FusedBatch(**batch) for batch in torch.load(path)]
+
+    print("Generating validation set {}".format(path))
+    seed = int(key[:8], 16)
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    loaders = data_source.gen_data_loaders(params["val_size"],
+        params["batch_size"], train=False, use_distributed_sampling=False)
+    batches = []
+    for batch_target, batch_neg_target, batch_neg_query in zip(*loaders):
+        batch = data_source.gen_batch(batch_target, batch_neg_target,
+            batch_neg_query, False)
+        batches.append(utils.fuse_batches(batch).to(torch.device("cpu")))
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = path + ".tmp"
+    torch.save([vars(batch) for batch in batches], tmp_path)
+    os.replace(tmp_path, path)
+    return batches
+
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
@@ -626,7 +708,7 @@ if __name__ == "__main__":
         data_source = DiskDataSource(name)
         train, test, _ = data_source.dataset
         i = 11
-        neighs = [utils.sample_neigh(train, i) for j in range(10000)]
+        neighs = data_source.neigh_sampler(True).sample_neighs([i] * 10000)
         clustering = [nx.average_clustering(graph.subgraph(nodes)) for graph,
             nodes in neighs]
         path_length = [nx.average_shortest_path_length(graph.subgraph(nodes))
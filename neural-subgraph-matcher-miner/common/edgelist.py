@@ -0,0 +1,160 @@
+"""Chunked, vectorized reader for text edge lists.
+
+Handles whitespace/tab separated files (roadnet-*.txt, *.edges, *.edgelist),
+CSV files (ppi-pathways.csv) and MatrixMarket coordinate files (*.mtx). Lines
+are parsed a chunk at a time with numpy instead of one `row.split()` and one
+`graph.add_edge` per line, and the result is a graph_store.CompactGraph built
+straight from the edge arrays.
+"""
+import numpy as np
+
+from common import graph_store
+
+DEFAULT_CHUNK_SIZE = 1 << 20   # lines parsed per numpy call
+
+# format name -> column delimiter (None splits on any whitespace)
+EDGE_FORMATS = {
+    "whitespace": None,
+    "tab": "\t",
+    "csv": ",",
+    "mtx": None,
+}
+
+
+def detect_format(path):
+    if path.endswith(".mtx"):
+        return "mtx"
+    elif path.endswith(".csv"):
+        return "csv"
+    elif path.endswith(".tsv"):
+        return "tab"
+    return "whitespace"
+
+
+def _read_mtx_header(f, comments):
+    """Consumes the MatrixMarket banner, comments and size line.
+    Returns (symmetric, has_values), or None (with f back at its start) if
+    the first non-empty line is not a banner: such files (bio-diseasome,
+    road-usroads) are plain whitespace edge lists."""
+    banner = ""
+    while not banner.strip():
+        banner = f.readline()
+        if not banner:
+            break
+    toks = banner.lower().split()
+    if not toks or toks[0] != "%%matrixmarket":
+        f.seek(0)
+        return None
+    if len(toks) > 2 and toks[2] != "coordinate":
+        raise ValueError("Only coordinate MatrixMarket files are supported")
+    has_values = len(toks) > 3 and toks[3] != "pattern"
+    symmetric = len(toks) > 4 and toks[4] in ("symmetric", "skew-symmetric",
+        "hermitian")
+    for line in f:
+        stripped = line.strip()
+        if stripped and not stripped.startswith(comments):
+            break   # size line: rows cols nnz
+    return symmetric, has_values
+
+
+def _iter_chunks(f, chunk_size):
+    while True:
+        lines = f.readlines(chunk_size * 32)
+        if not lines:
+            return
+        yield lines
+
+
+def read_edge_arrays(path, fmt=None, weight_col=None, comments=("#", "%"),
+    node_type=int, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Parses an edge list into flat arrays.
+
+    Args:
+        path: text file with one edge per line.
+        fmt: "whitespace", "tab", "csv" or "mtx"; detected from the file
+            extension when None.
+        weight_col: index of the column holding edge weights, or None for an
+            unweighted graph. MatrixMarket files with values default to their
+            value column.
+        comments: line prefixes to skip.
+        node_type: int for numeric node ids, str to keep node names as strings.
+        chunk_size: approximate number of lines parsed at once.
+
+    Returns:
+        (src, dst, weight, info): node key arrays, float32 weights (or None)
+        and a dict with format details ("symmetric" for MatrixMarket;
+        "format" is "whitespace" for a .mtx file without a banner).
+    """
+    fmt = fmt or detect_format(path)
+    delimiter = EDGE_FORMATS[fmt]
+    comments = tuple(comments)
+    info = {"format": fmt, "symmetric": False}
+    srcs, dsts, weights = [], [], []
+    with open(path, "r") as f:
+        if fmt == "mtx":
+            header = _read_mtx_header(f, comments)
+            if header is None:
+                info["format"] = "whitespace"
+            else:
+                info["symmetric"], has_values = header
+                if weight_col is None and has_values:
+                    weight_col = 2
+        usecols = (0, 1) if weight_col is None else (0, 1, weight_col)
+        dtype = [("src", np.int64), ("dst", np.int64), ("weight",
+            np.float64)][:len(usecols)]
+        for lines in _iter_chunks(f, chunk_size):
+            if node_type is str:
+                cols = np.loadtxt(lines, dtype=str, delimiter=delimiter,
+                    comments=list(comments), usecols=usecols, ndmin=2)
+                if len(cols) == 0:
+                    continue
+                srcs.append(cols[:, 0])
+                dsts.append(cols[:, 1])
+                if weight_col is not None:
+                    weights.append(cols[:, 2].astype(np.float32))
+            else:
+                # ids are parsed as integers: going through float64 would
+                # round those above 2**53
+                cols = np.loadtxt(lines, dtype=dtype, delimiter=delimiter,
+                    comments=list(comments), usecols=usecols, ndmin=1)
+                if len(cols) == 0:
+                    continue
+                srcs.append(cols["src"])
+                dsts.append(cols["dst"])
+                if weight_col is not None:
+                    weights.append(cols["weight"].astype(np.float32))
+    empty = np.zeros(0, dtype=str if node_type is str else np.int64)
+    src = np.concatenate(srcs) if srcs else empty
+    dst = np.concatenate(dsts) if dsts else empty
+    weight = (np.concatenate(weights) if weights else
+        np.zeros(0, dtype=np.float32)) if weight_col is not None else None
+    return src, dst, weight, info
+
+
+def load_edgelist(path, directed=None, fmt=None, weight_col=None,
+    comments=("#", "%"), node_type=int, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Reads an edge list straight into a graph_store.CompactGraph.
+
+    Node keys are compacted to dense indices with a single np.unique; repeated
+    edges are dropped. `directed` defaults to False, except that symmetric
+    MatrixMarket files are always read as undirected.
+    """
+    src, dst, weight, info = read_edge_arrays(path, fmt=fmt,
+        weight_col=weight_col, comments=comments, node_type=node_type,
+        chunk_size=chunk_size)
+    if directed is None or info["symmetric"]:
+        directed = False
+    keys, inverse = np.unique(np.concatenate((src, dst)), return_inverse=True)
+    inverse = inverse.astype(np.int32)
+    n_edges = len(src)
+    if node_type is str:
+        table = graph_store.StringTable(keys.tolist())
+        node_key = np.arange(len(keys), dtype=np.int64)
+        node_keys = "str"
+    else:
+        table = None
+        node_key = keys
+        node_keys = "int"
+    return graph_store.CompactGraph.from_edges(len(keys), inverse[:n_edges],
+        inverse[n_edges:], directed, weight=weight, node_key=node_key,
+        strings=table, node_keys=node_keys, dedupe=True)
@@ -0,0 +1,683 @@
+"""Compact, memory-mappable on-disk graph format.
+
+A graph is stored as flat numpy arrays: int32 edge endpoints, CSR offsets for
+outgoing (and, for directed graphs, incoming) adjacency, float32 edge weights
+and an interned string table holding node keys, node labels/ids and edge types.
+Other numeric edge attributes (such as the "edge_weight" that
+scripts/label_pickle.py adds) are kept as float64 sections named
+"edge_attr/<name>".
+Loading maps the arrays straight from disk, so load time and memory no longer
+depend on Python object overhead; NetworkX graphs are only built on request.
+
+File layout (version 1):
+    8 bytes   magic b"NSLGRAPH"
+    4 bytes   format version (uint32, little endian)
+    4 bytes   header length (uint32, little endian)
+    header    JSON describing graph metadata and array sections
+    arrays    raw little-endian arrays, each aligned to ALIGNMENT bytes
+
+Convert existing inputs with
+    python -m common.graph_store data/aura_tool_graph_attr_weighted.pkl \
+        data/aura_tool_graph_attr_weighted.gstore
+"""
+import argparse
+import json
+import os
+import pickle
+import struct
+
+import networkx as nx
+import numpy as np
+
+FORMAT_MAGIC = b"NSLGRAPH"
+FORMAT_VERSION = 1
+GRAPH_STORE_EXT = ".gstore"
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct("<8sII")
+
+EDGE_ATTR_PREFIX = "edge_attr/"
+EDGE_ATTR_DTYPE = "<f8"
+
+# name -> dtype of every array section a store may contain
+_SECTIONS = {
+    "src": "<i4",
+    "dst": "<i4",
+    "weight": "<f4",
+    "edge_type": "<i4",
+    "indptr": "<i8",
+    "indices": "<i4",
+    "eids": "<i4",
+    "in_indptr": "<i8",
+    "in_indices": "<i4",
+    "in_eids": "<i4",
+    "node_key": "<i8",
+    "node_label": "<i4",
+    "node_id": "<i4",
+    "string_offsets": "<i8",
+    "string_data": "u1",
+}
+
+
+def _build_csr(n_nodes, rows, cols):
+    """Returns (indptr, indices, eids) sorting the (rows, cols) pairs by row.
+    eids[k] is the position in the input arrays of the k-th adjacency entry."""
+    order = np.argsort(rows, kind="stable").astype(np.int32)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_nodes), out=indptr[1:])
+    return indptr, cols[order].astype(np.int32), order
+
+
+class StringTable:
+    """Interns strings to dense int32 ids."""
+    def __init__(self, strings=None):
+        self.strings = list(strings) if strings is not None else []
+        self.index = {s: i for i, s in enumerate(self.strings)}
+
+    def intern(self, s):
+        if s is None:
+            return -1
+        s = str(s)
+        idx = self.index.get(s)
+        if idx is None:
+            idx = len(self.strings)
+            self.index[s] = idx
+            self.strings.append(s)
+        return idx
+
+    def intern_many(self, values):
+        return np.array([self.intern(v) for v in values], dtype=np.int32)
+
+    def encode(self):
+        """Returns (offsets, data) arrays holding the utf-8 encoded table."""
+        encoded = [s.encode("utf-8") for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return offsets, data
+
+
+class CompactGraph:
+    """ Read-only graph held as flat (optionally memory-mapped) numpy arrays.
+
+    Nodes are the dense indices 0..n_nodes-1; the original node keys are kept in
+    `node_key` and restored by `to_networkx`. Undirected edges are stored once in
+    src/dst and in both directions in the CSR arrays. Directed graphs
+    additionally keep an incoming CSR so that undirected views need no copy.
+
+    Attributes:
+        src, dst: int32 endpoints of every edge.
+        weight: float32 edge weights (1.0 when the source had none).
+        edge_type: int32 string ids of the edge "type" attribute (-1 if unset).
+        indptr, indices, eids: outgoing adjacency in CSR form, with the edge id
+            of every adjacency entry.
+        in_indptr, in_indices, in_eids: incoming adjacency (directed only).
+        node_key: int64 node keys, or string ids when `meta["node_keys"]` is
+            "str".
+        node_label, node_id: int32 string ids of the node "label"/"id"
+            attributes (-1 if unset).
+        edge_attrs: name -> float64 values of the other numeric edge
+            attributes (NaN where an edge has none).
+    """
+    def __init__(self, arrays, meta):
+        self.meta = meta
+        self.directed = bool(meta["directed"])
+        self.n_nodes = int(meta["n_nodes"])
+        self.n_edges = int(meta["n_edges"])
+        for name in _SECTIONS:
+            setattr(self, name, arrays.get(name))
+        self.edge_attrs = {name: arrays[EDGE_ATTR_PREFIX + name] for name in
+            meta.get("edge_attrs", [])}
+        self._strings = None
+
+    @classmethod
+    def from_edges(cls, n_nodes, src, dst, directed, weight=None,
+        edge_type=None, node_key=None, node_label=None, node_id=None,
+        strings=None, node_keys="int", has_weight=None, dedupe=False,
+        edge_attrs=None):
+        """Builds a graph from integer edge arrays over nodes 0..n_nodes-1.
+
+        Args:
+            node_key: optional int64 array of original node keys; defaults
+                to the node indices themselves.
+            strings: optional StringTable (or list of strings) that the
+                edge_type/node_label/node_id ids and string node keys refer to.
+            node_keys: "int" if node_key holds the keys themselves, "str" if
+                it holds string ids.
+            dedupe: drop repeated edges (and reversed duplicates for
+                undirected graphs), keeping the first occurrence.
+            edge_attrs: optional dict of other numeric edge attributes, name
+                -> per-edge values (NaN where unset).
+        """
+        src = np.asarray(src, dtype=np.int32)
+        dst = np.asarray(dst, dtype=np.int32)
+        if weight is not None:
+            weight = np.asarray(weight, dtype=np.float32)
+        if edge_type is not None:
+            edge_type = np.asarray(edge_type, dtype=np.int32)
+        edge_attrs = {name: np.asarray(values, dtype=EDGE_ATTR_DTYPE) for
+            name, values in (edge_attrs or {}).items()}
+        if dedupe and len(src) > 0:
+            a, b = src.astype(np.int64), dst.astype(np.int64)
+            if not directed:
+                a, b = np.minimum(a, b), np.maximum(a, b)
+            _, keep = np.unique(a * n_nodes + b, return_index=True)
+            keep.sort()
+            src, dst = src[keep], dst[keep]
+            if weight is not None:
+                weight = weight[keep]
+            if edge_type is not None:
+                edge_type = edge_type[keep]
+            edge_attrs = {name: values[keep] for name, values in
+                edge_attrs.items()}
+        n_edges = len(src)
+        if has_weight is None:
+            has_weight = weight is not None
+        if weight is None:
+            weight = np.ones(n_edges, dtype=np.float32)
+        if edge_type is None:
+            edge_type = np.full(n_edges, -1, dtype=np.int32)
+
+        eid = np.arange(n_edges, dtype=np.int32)
+        arrays = {"src": src, "dst": dst, "weight": weight,
+            "edge_type": edge_type}
+        for name, values in edge_attrs.items():
+            arrays[EDGE_ATTR_PREFIX + name] = values
+        if directed:
+            arrays["indptr"], arrays["indices"], arrays["eids"] = _build_csr(
+                n_nodes, src, dst)
+            (arrays["in_indptr"], arrays["in_indices"],
+                arrays["in_eids"]) = _build_csr(n_nodes, dst, src)
+        else:
+            # self loops appear once in the adjacency, as in nx.Graph
+            back = src != dst
+            rows = np.concatenate((src, dst[back]))
+            cols = np.concatenate((dst, src[back]))
+            indptr, indices, order = _build_csr(n_nodes, rows, cols)
+            arrays["indptr"], arrays["indices"] = indptr, indices
+            arrays["eids"] = np.concatenate((eid, eid[back]))[order]
+
+        if isinstance(strings, StringTable):
+            strings = strings.strings
+        strings = list(strings) if strings is not None else []
+        if node_key is None:
+            node_key = np.arange(n_nodes, dtype=np.int64)
+        arrays["node_key"] = np.asarray(node_key, dtype=np.int64)
+        arrays["node_label"] = (np.asarray(node_label, dtype=np.int32)
+            if node_label is not None else np.full(n_nodes, -1, np.int32))
+        arrays["node_id"] = (np.asarray(node_id, dtype=np.int32)
+            if node_id is not None else np.full(n_nodes, -1, np.int32))
+        table = StringTable(strings)
+        arrays["string_offsets"], arrays["string_data"] = table.encode()
+
+        meta = {"directed": bool(directed), "n_nodes": int(n_nodes),
+            "n_edges": int(n_edges), "node_keys": node_keys,
+            "has_weight": bool(has_weight)}
+        if edge_attrs:
+            meta["edge_attrs"] = list(edge_attrs)
+        graph = cls(arrays, meta)
+        graph._strings = strings
+        return graph
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """Converts a NetworkX Graph/DiGraph, keeping node keys, the node
+        "label"/"id" attributes, the edge "weight"/"type" attributes and
+        other numeric edge attributes. Other attributes are dropped, with a
+        warning."""
+        nodes = list(graph.nodes)
+        index = {v: i for i, v in enumerate(nodes)}
+        table = StringTable()
+        str_keys = not all(isinstance(v, (int, np.integer)) and not
+            isinstance(v, bool) for v in nodes)
+        if str_keys:
+            node_key = table.intern_many(nodes).astype(np.int64)
+        else:
+            node_key = np.array(nodes, dtype=np.int64)
+        node_label = table.intern_many(graph.nodes[v].get("label")
+            for v in nodes)
+        node_id = table.intern_many(graph.nodes[v].get("id") for v in nodes)
+        dropped = set()
+        for v in nodes:
+            dropped.update("node " + name for name in graph.nodes[v] if name
+                not in ("label", "id", "anchor"))
+
+        n_edges = graph.number_of_edges()
+        src = np.empty(n_edges, dtype=np.int32)
+        dst = np.empty(n_edges, dtype=np.int32)
+        weight = np.ones(n_edges, dtype=np.float32)
+        edge_type = np.full(n_edges, -1, dtype=np.int32)
+        has_weight = False
+        edge_attrs = {}
+        for i, (u, v, attrs) in enumerate(graph.edges(data=True)):
+            src[i], dst[i] = index[u], index[v]
+            for name, value in attrs.items():
+                if name == "weight":
+                    weight[i] = float(value)
+                    has_weight = True
+                elif name == "type":
+                    edge_type[i] = table.intern(value)
+                elif (isinstance(value, (int, float, np.number)) and not
+                    isinstance(value, bool)):
+                    if name not in edge_attrs:
+                        edge_attrs[name] = np.full(n_edges, np.nan,
+                            dtype=EDGE_ATTR_DTYPE)
+                    edge_attrs[name][i] = value
+                else:
+                    dropped.add("edge " + name)
+        # an attribute that is not numeric on every edge is not kept at all
+        for name in [n for n in edge_attrs if "edge " + n in dropped]:
+            del edge_attrs[name]
+        if dropped:
+            print("WARNING: graph store drops the attributes {}".format(
+                ", ".join(sorted(dropped))))
+
+        out = cls.from_edges(len(nodes), src, dst, graph.is_directed(),
+            weight=weight, edge_type=edge_type, node_key=node_key,
+            node_label=node_label, node_id=node_id, strings=table,
+            node_keys="str" if str_keys else "int", has_weight=has_weight,
+            edge_attrs=edge_attrs)
+        return out
+
+    @property
+    def strings(self):
+        """The decoded string table (decoded on first access)."""
+        if self._strings is None:
+            offsets = np.asarray(self.string_offsets)
+            data = np.asarray(self.string_data).tobytes()
+            self._strings = [data[offsets[i]:offsets[i+1]].decode("utf-8")
+                for i in range(len(offsets) - 1)]
+        return self._strings
+
+    def string(self, idx):
+        return self.strings[idx] if idx >= 0 else None
+
+    def node_keys(self):
+        """List of the original node keys, in index order."""
+        if self.meta["node_keys"] == "str":
+            strings = self.strings
+            return [strings[i] for i in self.node_key]
+        return self.node_key.tolist()
+
+    def number_of_nodes(self):
+        return self.n_nodes
+
+    def number_of_edges(self):
+        return self.n_edges
+
+    def successors(self, u):
+        """Outgoing neighbors of node index u (all neighbors if undirected)."""
+        return self.indices[self.indptr[u]:self.indptr[u+1]]
+
+    def predecessors(self, u):
+        """Incoming neighbors of node index u (all neighbors if undirected)."""
+        if not self.directed:
+            return self.successors(u)
+        return self.in_indices[self.in_indptr[u]:self.in_indptr[u+1]]
+
+    def neighbors(self, u, graph_type=None):
+        """Neighbors of node index u under the given "directed"/"undirected"
+        interpretation (defaults to the stored orientation)."""
+        if graph_type == "undirected" and self.directed:
+            return np.union1d(self.successors(u), self.predecessors(u))
+        return self.successors(u)
+
+    def degree(self):
+        """Out-degree (degree if undirected) of every node."""
+        return np.diff(self.indptr)
+
+    def edge_attributes(self, eid):
+        """The NetworkX attribute dict of edge eid."""
+        attrs = {}
+        if self.meta.get("has_weight", True):
+            attrs["weight"] = float(self.weight[eid])
+        if self.edge_type[eid] >= 0:
+            attrs["type"] = self.string(int(self.edge_type[eid]))
+        for name, values in self.edge_attrs.items():
+            if not np.isnan(values[eid]):
+                attrs[name] = float(values[eid])
+        return attrs
+
+    def to_networkx(self, graph_type=None):
+        """Materializes a NetworkX graph.
+
+        Args:
+            graph_type: "directed" or "undirected"; defaults to the stored
+                orientation. Directed stores are collapsed to an undirected
+                graph directly, undirected stores get edges in both
+                directions, matching nx to_undirected/to_directed.
+        """
+        directed = self.directed if graph_type is None else \
+            graph_type == "directed"
+        graph = nx.DiGraph() if directed else nx.Graph()
+        keys = self.node_keys()
+        strings = self.strings
+        node_label, node_id = self.node_label.tolist(), self.node_id.tolist()
+        node_attrs = []
+        for key, label, id_ in zip(keys, node_label, node_id):
+            attrs = {}
+            if label >= 0:
+                attrs["label"] = strings[label]
+            if id_ >= 0:
+                attrs["id"] = strings[id_]
+            node_attrs.append((key, attrs))
+        graph.add_nodes_from(node_attrs)
+
+        has_weight = self.meta.get("has_weight", True)
+        has_type = bool((np.asarray(self.edge_type) >= 0).any())
+        us = [keys[u] for u in self.src.tolist()]
+        vs = [keys[v] for v in self.dst.tolist()]
+        if has_weight or has_type or self.edge_attrs:
+            extra = [(name, values.tolist()) for name, values in
+                self.edge_attrs.items()]
+            edge_attrs = []
+            for i, (w, t) in enumerate(zip(self.weight.tolist(),
+                self.edge_type.tolist())):
+                attrs = {}
+                if has_weight:
+                    attrs["weight"] = w
+                if t >= 0:
+                    attrs["type"] = strings[t]
+                for name, values in extra:
+                    if values[i] == values[i]:   # not NaN
+                        attrs[name] = values[i]
+                edge_attrs.append(attrs)
+            edges = list(zip(us, vs, edge_attrs))
+        else:
+            edges = list(zip(us, vs))
+        graph.add_edges_from(edges)
+        if directed and not self.directed:
+            graph.add_edges_from((e[1], e[0]) + e[2:] for e in edges)
+        return graph
+
+    def save(self, path):
+        """Writes the graph in the versioned binary format."""
+        sections = {}
+        offset = 0
+        payload = []
+        arrays = [(name, getattr(self, name), dtype) for name, dtype in
+            _SECTIONS.items()]
+        arrays += [(EDGE_ATTR_PREFIX + name, values, EDGE_ATTR_DTYPE) for
+            name, values in self.edge_attrs.items()]
+        for name, arr, dtype in arrays:
+            if arr is None:
+                continue
+            arr = np.ascontiguousarray(arr, dtype=np.dtype(dtype))
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            sections[name] = {"dtype": dtype, "offset": offset,
+                "count": int(arr.size)}
+            payload.append((offset, arr))
+            offset += arr.nbytes
+        header = json.dumps({"meta": self.meta, "sections": sections}).encode(
+            "utf-8")
+        base = -(-(_PREAMBLE.size + len(header)) // ALIGNMENT) * ALIGNMENT
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_PREAMBLE.pack(FORMAT_MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            for rel_offset, arr in payload:
+                f.seek(base + rel_offset)
+                f.write(arr.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Opens a graph store. With mmap=True the arrays are read-only views
+        of the file and pages are only read when touched."""
+        with open(path, "rb") as f:
+            magic, version, header_len = _PREAMBLE.unpack(
+                f.read(_PREAMBLE.size))
+            if magic != FORMAT_MAGIC:
+                raise ValueError("{} is not a graph store file".format(path))
+            if version > FORMAT_VERSION:
+                raise ValueError("Graph store {} has version {}, newer than "
+                    "the supported version {}".format(path, version,
+                    FORMAT_VERSION))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        base = -(-(_PREAMBLE.size + header_len) // ALIGNMENT) * ALIGNMENT
+        arrays = {}
+        for name, sec in header["sections"].items():
+            dtype = np.dtype(sec["dtype"])
+            if sec["count"] == 0:
+                arrays[name] = np.zeros(0, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r",
+                    offset=base + sec["offset"], shape=(sec["count"],))
+            else:
+                arrays[name] = np.fromfile(path, dtype=dtype,
+                    count=sec["count"], offset=base + sec["offset"])
+        return cls(arrays, header["meta"])
+
+
+class LazyGraph:
+    """ Read-only, NetworkX-like view of a CompactGraph for search agents
+    that only walk neighborhoods.
+
+    Nodes are the store's node indices. Adjacency is read from the (memory
+    mapped) CSR arrays when a node is visited, and only pattern-sized
+    subgraphs are materialized, as NetworkX graphs carrying the "label" and
+    "id" node attributes and the stored edge attributes.
+
+    Args:
+        store: the CompactGraph.
+        graph_type: "directed" or "undirected" interpretation of the edges;
+            defaults to the stored orientation.
+    """
+    def __init__(self, store, graph_type=None):
+        self.store = store
+        self.directed = store.directed if graph_type is None else \
+            graph_type == "directed"
+
+    def __len__(self):
+        return self.store.n_nodes
+
+    @property
+    def nodes(self):
+        return range(self.store.n_nodes)
+
+    def is_directed(self):
+        return self.directed
+
+    def number_of_nodes(self):
+        return self.store.n_nodes
+
+    def number_of_edges(self):
+        return self.store.n_edges
+
+    def successors(self, u):
+        if not self.directed:
+            return self.neighbors(u)
+        return self.store.successors(u).tolist()
+
+    def predecessors(self, u):
+        if not self.directed:
+            return self.neighbors(u)
+        return self.store.predecessors(u).tolist()
+
+    def neighbors(self, u):
+        return self.store.neighbors(u, "directed" if self.directed else
+            "undirected").tolist()
+
+    def subgraph(self, nodes):
+        """graph.subgraph(nodes) materialized as a new NetworkX graph."""
+        nodes = list(nodes)
+        members = set(nodes)
+        graph = nx.DiGraph() if self.directed else nx.Graph()
+        node_label, node_id = self.store.node_label, self.store.node_id
+        for v in nodes:
+            attrs = {}
+            if node_label[v] >= 0:
+                attrs["label"] = self.store.string(int(node_label[v]))
+            if node_id[v] >= 0:
+                attrs["id"] = self.store.string(int(node_id[v]))
+            graph.add_node(v, **attrs)
+        # every stored edge is an outgoing CSR entry of its source (of both
+        # endpoints if undirected)
+        store = self.store
+        for u in nodes:
+            lo, hi = int(store.indptr[u]), int(store.indptr[u+1])
+            for v, eid in zip(store.indices[lo:hi].tolist(),
+                store.eids[lo:hi].tolist()):
+                if v in members:
+                    graph.add_edge(u, v, **store.edge_attributes(eid))
+        return graph
+
+
+def from_pickle(path):
+    """Reads a pickled NetworkX graph or a {'nodes': ..., 'edges': ...} dict
+    (the formats accepted by decoder.main and count_patterns)."""
+    with open(path, "rb") as f:
+        data = pickle.load(f)
+    if isinstance(data, (nx.Graph, nx.DiGraph)):
+        return CompactGraph.from_networkx(data)
+    if isinstance(data, dict) and "nodes" in data and "edges" in data:
+        graph = nx.DiGraph() if data.get("directed") else nx.Graph()
+        for node in data["nodes"]:
+            if isinstance(node, tuple):
+                graph.add_node(node[0], **node[1])
+            else:
+                graph.add_node(node)
+        for edge in data["edges"]:
+            if len(edge) == 3:
+                graph.add_edge(edge[0], edge[1], **edge[2])
+            else:
+                graph.add_edge(edge[0], edge[1])
+        return CompactGraph.from_networkx(graph)
+    raise ValueError("Unknown pickle format. Expected NetworkX graph or dict "
+        "with 'nodes'/'edges' keys, got {}".format(type(data)))
+
+
+def from_edgelist(path, directed=True, weight_col=2):
+    """Reads a "u v weight" edge list such as data/tool_graph.edgelist.
+    Node names are kept as strings, as nx.read_weighted_edgelist does."""
+    from common import edgelist
+    return edgelist.load_edgelist(path, directed=directed,
+        weight_col=weight_col, node_type=str)
+
+
+def _default_index_path(path):
+    # data/aura_tool_graph.pt is accompanied by data/aura_tool_index.json
+    if path.endswith("graph.pt"):
+        index_path = path[:-len("graph.pt")] + "index.json"
+        if os.path.exists(index_path):
+            return index_path
+    return None
+
+
+def from_pyg(path, index_path=None, directed=True):
+    """Reads a torch-saved PyG Data object (edge_index, optional edge_weight),
+    as written by scripts/generate_tool_cooc.py. Node names are restored from
+    the accompanying "idx2tool" index json if there is one."""
+    import torch
+    data = torch.load(path, weights_only=False)
+    edge_index = data.edge_index.cpu().numpy()
+    n_nodes = int(data.num_nodes)
+    edge_weight = getattr(data, "edge_weight", None)
+    weight = edge_weight.cpu().numpy() if edge_weight is not None else None
+
+    index_path = index_path or _default_index_path(path)
+    if index_path is None:
+        return CompactGraph.from_edges(n_nodes, edge_index[0], edge_index[1],
+            directed, weight=weight)
+    with open(index_path, "r") as f:
+        idx2tool = json.load(f)["idx2tool"]
+    table = StringTable()
+    names = table.intern_many(idx2tool[str(i)] for i in range(n_nodes))
+    return CompactGraph.from_edges(n_nodes, edge_index[0], edge_index[1],
+        directed, weight=weight, node_key=names.astype(np.int64),
+        node_label=names, node_id=names, strings=table, node_keys="str")
+
+
+def to_pickle(graph, path, graph_type=None):
+    with open(path, "wb") as f:
+        pickle.dump(graph.to_networkx(graph_type), f,
+            protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def to_edgelist(graph, path):
+    """Writes "u<TAB>v<TAB>weight" lines, the format of data/*.edgelist."""
+    keys = graph.node_keys()
+    with open(path, "w") as f:
+        for u, v, w in zip(graph.src.tolist(), graph.dst.tolist(),
+            graph.weight.tolist()):
+            f.write("{}\t{}\t{:g}\n".format(keys[u], keys[v], w))
+
+
+def to_pyg(graph, path):
+    """Writes a PyG Data object with 1-d node features, like data/*.pt."""
+    import torch
+    from torch_geometric.data import Data
+    edge_index = torch.from_numpy(np.stack((np.asarray(graph.src),
+        np.asarray(graph.dst))).astype(np.int64))
+    if not graph.directed:
+        edge_index = torch.cat((edge_index, edge_index.flip(0)), dim=1)
+    edge_weight = torch.from_numpy(np.asarray(graph.weight, dtype=np.float32))
+    if not graph.directed:
+        edge_weight = torch.cat((edge_weight, edge_weight))
+    data = Data(x=torch.ones((graph.n_nodes, 1), dtype=torch.float),
+        edge_index=edge_index, edge_weight=edge_weight)
+    torch.save(data, path)
+
+
+def load_compact(path, directed=None):
+    """Loads any supported graph file (.gstore, .pkl, .edgelist, .pt, or a
+    numeric .txt/.mtx/.edges/.csv edge list) as a CompactGraph. `directed`
+    only applies to formats without orientation."""
+    if path.endswith(GRAPH_STORE_EXT):
+        return CompactGraph.load(path)
+    elif path.endswith(".pkl") or path.endswith(".p"):
+        return from_pickle(path)
+    elif path.endswith(".edgelist"):
+        return from_edgelist(path, directed=True if directed is None
+            else directed)
+    elif path.endswith(".pt"):
+        return from_pyg(path, directed=True if directed is None
+            else directed)
+    elif path.endswith((".txt", ".mtx", ".edges", ".csv", ".tsv")):
+        from common import edgelist
+        return edgelist.load_edgelist(path, directed=directed)
+    raise ValueError("Unsupported graph file {}".format(path))
+
+
+def load_networkx(path, graph_type=None):
+    """Loads a graph file as NetworkX, in the requested orientation."""
+    if path.endswith(GRAPH_STORE_EXT):
+        return CompactGraph.load(path).to_networkx(graph_type)
+    return load_compact(path).to_networkx(graph_type)
+
+
+def convert(src_path, dst_path, graph_type=None):
+    graph = load_compact(src_path)
+    if graph_type is not None and (graph_type == "directed") != graph.directed:
+        graph = CompactGraph.from_networkx(graph.to_networkx(graph_type))
+    if dst_path.endswith(GRAPH_STORE_EXT):
+        graph.save(dst_path)
+    elif dst_path.endswith(".pkl") or dst_path.endswith(".p"):
+        to_pickle(graph, dst_path)
+    elif dst_path.endswith(".edgelist"):
+        to_edgelist(graph, dst_path)
+    elif dst_path.endswith(".pt"):
+        to_pyg(graph, dst_path)
+    else:
+        raise ValueError("Unsupported graph file {}".format(dst_path))
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert graph files to and "
+        "from the memory-mapped graph store format")
+    parser.add_argument("src", type=str, help="input .pkl/.edgelist/.pt/"
+        ".gstore file")
+    parser.add_argument("dst", type=str, help="output .pkl/.edgelist/.pt/"
+        ".gstore file")
+    parser.add_argument("--graph_type", type=str, default=None,
+        help='"directed" or "undirected"; defaults to the input orientation')
+    args = parser.parse_args()
+    graph = convert(args.src, args.dst, graph_type=args.graph_type)
+    print("Wrote {} ({} nodes, {} edges, {})".format(args.dst,
+        graph.number_of_nodes(), graph.number_of_edges(),
+        "directed" if graph.directed else "undirected"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""Inference engines for the graph embedding model used in mining.
+
+An engine wraps `model.emb_model` and turns DeepSNAP batches (or lists of
+NetworkX graphs) into embeddings without building autograd graphs. Backends:
+
+    eager        the model itself under torch.inference_mode
+    torchscript  node-level layers scripted with torch.jit.script
+    compile      node-level layers compiled with torch.compile
+    onnx         node-level layers exported to ONNX, run on ONNX Runtime (CPU)
+
+The non-eager backends run a tensor-only rewrite of SkipLastGNN (learnable
+skip + SAGE convolutions); sum pooling and post_mp stay in eager PyTorch.
+`build_engine` checks every non-eager backend against eager on held-out
+graphs and falls back to eager if it is unavailable or does not match.
+
+`reduce_precision` derives an int8 (dynamic quantization) or bf16 (autocast)
+CPU copy of a model; callers are expected to check it with
+subgraph_matching.test.precision_guard before using it.
+"""
+import copy
+import os
+import tempfile
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from common import utils
+
+INFERENCE_BACKENDS = ["eager", "torchscript", "compile", "onnx"]
+PRECISIONS = ["fp32", "int8", "bf16"]
+PARITY_ATOL = 1e-4
+PARITY_RTOL = 1e-3
+
+
+class InferenceEngine:
+    """ Base class: maps batches of graphs to embeddings with model.emb_model.
+    """
+    name = None
+    incremental = None   # common.incremental.IncrementalEmbedder, if enabled
+
+    def __init__(self, model):
+        self.model = model
+        self.emb_model = model.emb_model
+
+    def embed(self, batch):
+        """Embeds a DeepSNAP batch, returning a (num_graphs, dim) tensor."""
+        raise NotImplementedError
+
+    def embed_graphs(self, graphs, anchors=None):
+        """Embeds a list of NetworkX graphs (see utils.batch_nx_graphs)."""
+        return self.embed(utils.batch_nx_graphs(graphs, anchors=anchors))
+
+    def enable_incremental(self, anchored, check_graphs=None):
+        """Embeds one-node pattern extensions incrementally from now on.
+
+        The incremental path is first compared with full recomputation on
+        `check_graphs`; it stays disabled if the model is not supported or
+        the embeddings do not match. Returns whether it was enabled.
+        """
+        from common import incremental
+        try:
+            embedder = incremental.IncrementalEmbedder(self.model, anchored)
+        except (ValueError, AttributeError) as e:
+            print("WARNING: incremental embedding unavailable ({})".format(e))
+            return False
+        if check_graphs:
+            ok, max_diff = incremental.check_incremental(embedder, self,
+                check_graphs)
+            print("Incremental embedding: max abs difference to full "
+                "recomputation {:.2e}".format(max_diff))
+            if not ok:
+                print("WARNING: incremental embedding does not match full "
+                    "recomputation, disabled")
+                return False
+        self.incremental = embedder
+        return True
+
+    def begin_pattern(self, graph, neigh):
+        """Cached state of graph.subgraph(neigh) for embed_extensions, or None
+        if incremental embedding is disabled."""
+        if self.incremental is None:
+            return None
+        return self.incremental.begin(graph, neigh)
+
+    def embed_extensions(self, graph, neigh, cands, anchored, state=None):
+        """Embeds graph.subgraph(neigh + [c]) for every c in cands, anchored at
+        neigh[0] if `anchored`. Uses `state` (see begin_pattern) if given."""
+        if state is not None:
+            return self.incremental.embed_extensions(state, graph, cands)
+        return self.embed_graphs([graph.subgraph(neigh + [c]) for c in cands],
+            anchors=[neigh[0]]*len(cands) if anchored else None)
+
+    def extend_pattern(self, state, graph, node):
+        """State after adding `node` to the pattern held by `state`."""
+        if state is None:
+            return None
+        return self.incremental.extend(state, graph, node)
+
+
+class EagerEngine(InferenceEngine):
+    name = "eager"
+
+    def embed(self, batch):
+        with torch.inference_mode():
+            return self.emb_model(batch)
+
+
+class _SAGELayer(nn.Module):
+    def __init__(self, conv):
+        super(_SAGELayer, self).__init__()
+        self.lin = conv.lin
+        self.lin_update = conv.lin_update
+
+    def forward(self, x, src, dst):
+        # common.models.SAGEConv with aggr="add": sum lin(x_j) over incoming
+        # edges, then lin_update([aggr, x])
+        msg = self.lin(x)[src]
+        aggr = x.new_zeros(x.size(0), msg.size(1)).scatter_add_(0,
+            dst.unsqueeze(1).expand(-1, msg.size(1)), msg)
+        return self.lin_update(torch.cat([aggr, x], dim=-1))
+
+
+class SkipLastNodeStack(nn.Module):
+    """ Node-level part of SkipLastGNN (pre_mp and the learnable-skip SAGE
+    layers) written with plain tensor ops, so that it can be scripted,
+    compiled or exported. Shares parameters with the wrapped model.
+
+    Returns the concatenated per-layer node embeddings that SkipLastGNN sums
+    per graph before post_mp.
+    """
+    def __init__(self, emb_model):
+        super(SkipLastNodeStack, self).__init__()
+        if emb_model.conv_type != "SAGE" or emb_model.skip != "learnable":
+            raise ValueError("Only SAGE convolutions with learnable skip "
+                "connections are supported, got conv_type={} skip={}".format(
+                emb_model.conv_type, emb_model.skip))
+        self.pre_mp = emb_model.pre_mp
+        self.layers = nn.ModuleList([_SAGELayer(conv) for conv in
+            emb_model.convs])
+        self.learnable_skip = emb_model.learnable_skip
+
+    def forward(self, x, edge_index):
+        keep = edge_index[0] != edge_index[1]
+        src, dst = edge_index[0][keep], edge_index[1][keep]
+        x = self.pre_mp(x)
+        all_emb = x.unsqueeze(1)
+        emb = x
+        for i, layer in enumerate(self.layers):
+            skip_vals = self.learnable_skip[i, :i+1].unsqueeze(0).unsqueeze(-1)
+            curr_emb = (all_emb * torch.sigmoid(skip_vals)).reshape(
+                x.size(0), -1)
+            x = F.relu(layer(curr_emb, src, dst))
+            emb = torch.cat((emb, x), 1)
+            all_emb = torch.cat((all_emb, x.unsqueeze(1)), 1)
+        return emb
+
+
+class _NodeStackEngine(InferenceEngine):
+    """ Shared logic of the backends that run SkipLastNodeStack. The backend
+    artefact is built lazily and dropped when pickled, so engines can be sent
+    to worker processes and rebuilt there.
+    """
+    def __init__(self, model):
+        super(_NodeStackEngine, self).__init__(model)
+        self.stack = SkipLastNodeStack(self.emb_model).eval()
+        self._runner = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_runner"] = None
+        return state
+
+    def _build(self):
+        raise NotImplementedError
+
+    def _node_embed(self, x, edge_index):
+        if self._runner is None:
+            self._runner = self._build()
+        return self._runner(x, edge_index)
+
+    def embed(self, batch):
+        with torch.inference_mode():
+            if self.emb_model.feat_preprocess is not None and \
+                not hasattr(batch, "preprocessed"):
+                batch = self.emb_model.feat_preprocess(batch)
+                batch.preprocessed = True
+            node_emb = self._node_embed(batch.node_feature, batch.edge_index)
+            pooled = node_emb.new_zeros(batch.num_graphs,
+                node_emb.size(1)).index_add_(0, batch.batch, node_emb)
+            return self.emb_model.post_mp(pooled)
+
+
+class TorchScriptEngine(_NodeStackEngine):
+    name = "torchscript"
+
+    def _build(self):
+        return torch.jit.script(self.stack)
+
+
+class CompileEngine(_NodeStackEngine):
+    name = "compile"
+
+    def _build(self):
+        return torch.compile(self.stack, dynamic=True)
+
+
+class OnnxEngine(_NodeStackEngine):
+    """ Exports the node stack to ONNX once (in the process that builds the
+    engine first) and runs it with ONNX Runtime on CPU in every process.
+    Without onnx_path the model (and the external weight file the exporter
+    may write next to it) goes to a temporary directory owned by the
+    engine, removed when the engine is garbage collected.
+    """
+    name = "onnx"
+
+    def __init__(self, model, onnx_path=None, n_threads=None):
+        super(OnnxEngine, self).__init__(model)
+        self.onnx_path = onnx_path
+        self.n_threads = n_threads
+        self._tmp_dir = None
+
+    def __getstate__(self):
+        # workers use the exporting process's file and never remove it
+        state = super(OnnxEngine, self).__getstate__()
+        state["_tmp_dir"] = None
+        return state
+
+    def export(self):
+        if self.onnx_path is None:
+            self._tmp_dir = tempfile.TemporaryDirectory()
+            self.onnx_path = os.path.join(self._tmp_dir.name,
+                "node_stack.onnx")
+        input_dim = self.stack.pre_mp[0].in_features
+        x = torch.ones(3, input_dim)
+        edge_index = torch.tensor([[0, 1, 1, 2], [1, 0, 2, 1]])
+        with torch.no_grad():
+            torch.onnx.export(self.stack, (x, edge_index), self.onnx_path,
+                input_names=["x", "edge_index"], output_names=["emb"],
+                dynamic_axes={"x": {0: "n_nodes"},
+                    "edge_index": {1: "n_edges"}, "emb": {0: "n_nodes"}},
+                opset_version=17)
+        return self.onnx_path
+
+    def _build(self):
+        import onnxruntime as ort
+        if self.onnx_path is None or not os.path.exists(self.onnx_path):
+            self.export()
+        options = ort.SessionOptions()
+        if self.n_threads is not None:
+            options.intra_op_num_threads = self.n_threads
+        session = ort.InferenceSession(self.onnx_path, options,
+            providers=["CPUExecutionProvider"])
+
+        def run(x, edge_index):
+            out = session.run(["emb"], {
+                "x": x.detach().cpu().numpy(),
+                "edge_index": edge_index.detach().cpu().numpy()})[0]
+            return torch.from_numpy(out).to(x.device)
+        return run
+
+
+class AutocastEmbedder(nn.Module):
+    """ Runs an embedding model under CPU autocast (bf16 by default) and
+    returns float32 embeddings, so downstream order-embedding scores are
+    computed in full precision.
+    """
+    def __init__(self, emb_model, dtype=torch.bfloat16):
+        super(AutocastEmbedder, self).__init__()
+        self.emb_model = emb_model
+        self.dtype = dtype
+
+    def forward(self, data):
+        with torch.autocast("cpu", dtype=self.dtype):
+            emb = self.emb_model(data)
+        return emb.float()
+
+
+def reduce_precision(model, precision):
+    """Returns a CPU copy of `model` whose emb_model runs in reduced precision.
+
+    "int8" applies dynamic int8 quantization to every nn.Linear of the
+    embedding GNN (pre_mp, the SAGE lin/lin_update layers and post_mp);
+    "bf16" runs the embedding GNN under bf16 autocast. The order/MLP heads are
+    left in float32. "fp32" returns the model unchanged.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError("Unknown precision {}; expected one of {}".format(
+            precision, PRECISIONS))
+    if precision == "fp32":
+        return model
+    reduced = copy.deepcopy(model).cpu().eval()
+    if precision == "int8":
+        reduced.emb_model = torch.ao.quantization.quantize_dynamic(
+            reduced.emb_model, {nn.Linear}, dtype=torch.qint8)
+    elif precision == "bf16":
+        reduced.emb_model = AutocastEmbedder(reduced.emb_model)
+    return reduced
+
+
+ENGINES = {"eager": EagerEngine, "torchscript": TorchScriptEngine,
+    "compile": CompileEngine, "onnx": OnnxEngine}
+
+
+def check_parity(engine, batches, atol=PARITY_ATOL, rtol=PARITY_RTOL):
+    """Compares engine embeddings with eager ones on held-out batches.
+
+    Returns (ok, max_abs_diff).
+    """
+    reference = EagerEngine(engine.model)
+    max_diff = 0.0
+    ok = True
+    for batch in batches:
+        expected = reference.embed(batch)
+        actual = engine.embed(batch)
+        max_diff = max(max_diff, (actual - expected).abs().max().item())
+        ok = ok and torch.allclose(actual, expected, atol=atol, rtol=rtol)
+    return ok, max_diff
+
+
+def build_engine(model, backend="eager", parity_batches=None, **kwargs):
+    """Builds the requested inference engine for a model in eval mode.
+
+    Non-eager backends are checked against eager on `parity_batches` (a list
+    of DeepSNAP batches held out from mining); if the backend cannot be built
+    or its embeddings differ beyond PARITY_ATOL/PARITY_RTOL, a warning is
+    printed and the eager engine is returned instead.
+    """
+    if backend not in ENGINES:
+        raise ValueError("Unknown inference backend {}; expected one of "
+            "{}".format(backend, INFERENCE_BACKENDS))
+    if backend == "eager":
+        return EagerEngine(model)
+    try:
+        engine = ENGINES[backend](model, **kwargs)
+        if parity_batches:
+            ok, max_diff = check_parity(engine, parity_batches)
+            print("Inference backend {}: max abs difference to eager "
+                "{:.2e}".format(backend, max_diff))
+            if not ok:
+                print("WARNING: inference backend {} does not match eager "
+                    "embeddings, falling back to eager".format(backend))
+                return EagerEngine(model)
+        return engine
+    except Exception as e:
+        print("WARNING: inference backend {} unavailable ({}), falling back "
+            "to eager".format(backend, e))
+        return EagerEngine(model)
@@ -1,9 +1,4 @@
 """Defines all graph embedding models"""
-from functools import reduce
-import random
-
-import networkx as nx
-import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
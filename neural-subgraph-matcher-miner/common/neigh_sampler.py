@@ -0,0 +1,189 @@
+"""Batched sampling of random BFS-tree neighborhoods.
+
+utils.sample_neigh grows a neighborhood from a start node by repeatedly adding
+a node drawn uniformly from the frontier list, in which a node appears once
+per edge from the neighborhood to it. That is the same as following a random
+edge out of the neighborhood that leads to a new node, which is what
+TreeNeighborhoodSampler does for many neighborhoods at once: the CSR
+adjacency of all graphs is concatenated (that of a single graph is used as
+is), every row of the batch keeps the cumulative out-degrees of its nodes,
+and each step draws one edge per row with numpy, redrawing the rows whose
+edge stays inside their neighborhood.
+Edges are followed as utils.sample_neigh does: successors in directed graphs,
+neighbors in undirected ones.
+"""
+import numpy as np
+
+from common.seed_sampler import SeedSampler, adjacency
+
+# consecutive edges drawn inside a neighborhood before its frontier is
+# enumerated exactly
+MAX_MISSES = 16
+
+
+def csr_arrays(graph):
+    """(indptr, indices, node ids) of the adjacency that tree neighborhoods of
+    graph follow. The (memory mapped) arrays of a graph_store.LazyGraph are
+    used as they are when they hold that adjacency."""
+    store = getattr(graph, "store", None)
+    if store is not None and (graph.is_directed() or not store.directed):
+        return store.indptr, store.indices, graph.nodes
+    adj, nodes = adjacency(graph, False)
+    adj.sort_indices()
+    return adj.indptr, adj.indices, nodes
+
+
+class TreeNeighborhoodSampler:
+    """ Samples tree neighborhoods of a fixed dataset in batches.
+
+    Args:
+        graphs: NetworkX graphs or graph_store.LazyGraph views.
+        min_size: start nodes must reach at least this many nodes; rows whose
+            frontier runs out before their size is reached are restarted.
+        seed_sampler: optional SeedSampler over graphs the start nodes are
+            drawn from (by default, uniformly among the nodes reaching
+            min_size nodes).
+    """
+    def __init__(self, graphs, min_size=1, seed_sampler=None):
+        self.graphs = graphs
+        self.seeds = seed_sampler if seed_sampler is not None else \
+            SeedSampler(graphs, min_reachable=min_size)
+        self.nodes = []   # per graph: node ids by index
+        if len(graphs) == 1:
+            # no offsets to add: use the CSR arrays as they are
+            self.indptr, self.indices, nodes = csr_arrays(graphs[0])
+            self.nodes.append(nodes)
+            offsets = [0, len(nodes)]
+        else:
+            indptrs, indices, offsets = [], [], [0]
+            for graph in graphs:
+                indptr, adj_indices, nodes = csr_arrays(graph)
+                self.nodes.append(nodes)
+                indptrs.append(indptr[1:] + (indptrs[-1][-1] if indptrs else
+                    0))
+                indices.append(adj_indices.astype(np.int64) + offsets[-1])
+                offsets.append(offsets[-1] + len(nodes))
+            self.indptr = np.concatenate([[0]] + indptrs).astype(np.int64)
+            self.indices = np.concatenate(indices) if indices else \
+                np.zeros(0, dtype=np.int64)
+        assert np.array_equal(offsets, self.seeds.offsets)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.degree = np.diff(self.indptr)
+
+    def sample(self, sizes, rng=np.random):
+        """Grows len(sizes) neighborhoods, the i-th with sizes[i] nodes.
+
+        Args:
+            sizes: number of nodes of each neighborhood.
+            rng: anything with a random(size) method (the np.random module,
+                a np.random.Generator or RandomState).
+
+        Returns:
+            (graph_idx, nodes): the graph of each neighborhood, and an int64
+            array with one row per neighborhood holding its node indices in
+            the graph, start node first, padded with -1 after sizes[i].
+        """
+        sizes = np.asarray(sizes, dtype=np.int64)
+        n = len(sizes)
+        width = int(sizes.max(initial=1))
+        nodes = np.full((n, width), -1, dtype=np.int64)   # global positions
+        # cum_deg[i, j]: out-degree of the first j+1 nodes of row i
+        cum_deg = np.full((n, width), np.iinfo(np.int64).max, dtype=np.int64)
+        length = np.zeros(n, dtype=np.int64)
+        misses = np.zeros(n, dtype=np.int64)
+        pending = np.arange(n)
+        while len(pending):
+            start = self.seeds.sample_positions(len(pending), rng)
+            nodes[pending] = -1
+            cum_deg[pending] = np.iinfo(np.int64).max
+            nodes[pending, 0] = start
+            cum_deg[pending, 0] = self.degree[start]
+            length[pending] = 1
+            misses[pending] = 0
+            failed = []
+            active = pending[length[pending] < sizes[pending]]
+            while len(active):
+                total = cum_deg[active, length[active] - 1]
+                closed = total == 0
+                failed.extend(active[closed].tolist())
+                active = active[~closed]
+                total = total[~closed]
+                # a uniform edge out of the neighborhood: its source is the
+                # node whose cumulative degree range holds r
+                r = (rng.random(len(active)) * total).astype(np.int64)
+                r = np.minimum(r, total - 1)
+                pos = (cum_deg[active] <= r[:, None]).sum(axis=1)
+                src = nodes[active, pos]
+                first = cum_deg[active, pos] - self.degree[src]
+                dst = self.indices[self.indptr[src] + r - first]
+                inside = (nodes[active] == dst[:, None]).any(axis=1)
+                misses[active[inside]] += 1
+                self._add(nodes, cum_deg, length, misses, active[~inside],
+                    dst[~inside])
+                for row in active[inside & (misses[active] >= MAX_MISSES)]:
+                    if not self._add_exact(nodes, cum_deg, length, misses, row,
+                        rng):
+                        failed.append(row)
+                active = active[(length[active] < sizes[active]) &
+                    ~np.isin(active, failed)]
+            pending = np.array(sorted(failed), dtype=np.int64)
+        graph_idx = np.searchsorted(self.offsets, nodes[:, 0],
+            side="right") - 1
+        return graph_idx, np.where(nodes >= 0,
+            nodes - self.offsets[graph_idx][:, None], -1)
+
+    def _add(self, nodes, cum_deg, length, misses, rows, new):
+        cum_deg[rows, length[rows]] = (cum_deg[rows, length[rows] - 1] +
+            self.degree[new])
+        nodes[rows, length[rows]] = new
+        length[rows] += 1
+        misses[rows] = 0
+
+    def _add_exact(self, nodes, cum_deg, length, misses, row, rng):
+        """Adds a node drawn from the exact frontier list of row; False if the
+        frontier is empty."""
+        members = nodes[row, :length[row]]
+        frontier = np.concatenate([self.indices[self.indptr[u]:
+            self.indptr[u+1]] for u in members])
+        frontier = frontier[~np.isin(frontier, members)]
+        if len(frontier) == 0:
+            return False
+        new = frontier[min(int(rng.random(1)[0] * len(frontier)),
+            len(frontier) - 1)]
+        self._add(nodes, cum_deg, length, misses, np.array([row]),
+            np.array([new]))
+        return True
+
+    def sample_neighs(self, sizes, rng=np.random):
+        """Like sample, as a list of (graph, node id list) pairs, as returned
+        by utils.sample_neigh."""
+        graph_idx, nodes = self.sample(sizes, rng)
+        out = []
+        for g, row in zip(graph_idx.tolist(), nodes.tolist()):
+            ids = self.nodes[g]
+            out.append((self.graphs[g], [ids[i] for i in row if i >= 0]))
+        return out
+
+
+class SerialNeighborhoodSampler:
+    """ Grows tree neighborhoods one at a time with utils.sample_neigh, which
+    reads the adjacency of the visited nodes only: for graph_store.LazyGraph
+    views, whose edges TreeNeighborhoodSampler would index as a whole.
+
+    Args:
+        graphs: NetworkX graphs or graph_store.LazyGraph views.
+        graph_type: "directed" or "undirected", how edges are followed.
+        seed_sampler: optional SeedSampler over graphs the start nodes are
+            drawn from; neighborhoods that run out of frontier are redrawn.
+    """
+    def __init__(self, graphs, graph_type, seed_sampler=None):
+        self.graphs = graphs
+        self.graph_type = graph_type
+        self.seeds = seed_sampler
+
+    def sample_neighs(self, sizes):
+        """A list of (graph, node id list) pairs, the i-th with sizes[i] nodes,
+        drawn with the random module."""
+        from common import utils
+        return [utils.sample_neigh(self.graphs, int(size), self.graph_type,
+            sampler=self.seeds) for size in sizes]
@@ -0,0 +1,112 @@
+"""Compact representation of patterns found in a dataset graph.
+
+A CompactPattern is an induced subgraph of one dataset graph: the graph's
+index, the pattern's node ids (anchor first by default) and, per pattern
+node, a bitmask of the pattern nodes it has an edge to (a machine word for
+patterns of up to 64 nodes). Growing a pattern by one node only tests the
+new node's neighbors against the pattern, and WL hashes are computed from
+the bitmasks, so search never copies NetworkX subgraphs; to_networkx builds
+one for output.
+"""
+import networkx as nx
+
+from common import utils
+
+
+class CompactPattern:
+    """ Induced subgraph of dataset graph `graph_idx` on `nodes`.
+
+    Bit j of adj[i] is set if there is an edge nodes[i] -> nodes[j] (in
+    either direction if undirected); self loops are dropped. anchor is the
+    index of the anchor node in nodes.
+    """
+    __slots__ = ("graph_idx", "nodes", "adj", "anchor", "directed")
+
+    def __init__(self, graph_idx, nodes, adj, anchor=0, directed=False):
+        self.graph_idx = graph_idx
+        self.nodes = tuple(nodes)
+        self.adj = tuple(adj)
+        self.anchor = anchor
+        self.directed = directed
+
+    def __reduce__(self):
+        return (CompactPattern, (self.graph_idx, self.nodes, self.adj,
+            self.anchor, self.directed))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __repr__(self):
+        return (f"CompactPattern(graph_idx={self.graph_idx}, "
+            f"nodes={self.nodes}, n_edges={self.number_of_edges()})")
+
+    @classmethod
+    def from_nodes(cls, graph, graph_idx, nodes, anchor=0):
+        """The pattern induced by nodes in graph = dataset[graph_idx]."""
+        pattern = cls(graph_idx, (), (), anchor, graph.is_directed())
+        for v in nodes:
+            pattern = pattern.extend(graph, v)
+        return pattern
+
+    def extend(self, graph, node):
+        """The pattern with node added (graph is the dataset graph)."""
+        index = {v: i for i, v in enumerate(self.nodes)}
+        bit = 1 << len(self.nodes)
+        out_mask, adj = 0, list(self.adj)
+        if self.directed:
+            for u in graph.successors(node):
+                if u in index:
+                    out_mask |= 1 << index[u]
+            for u in graph.predecessors(node):
+                if u in index:
+                    adj[index[u]] |= bit
+        else:
+            for u in graph.neighbors(node):
+                if u in index:
+                    out_mask |= 1 << index[u]
+                    adj[index[u]] |= bit
+        adj.append(out_mask)
+        return CompactPattern(self.graph_idx, self.nodes + (node,), adj,
+            self.anchor, self.directed)
+
+    def neighbors(self, i):
+        """Indices j of the edges i -> j."""
+        mask, out = self.adj[i], []
+        while mask:
+            low = mask & -mask
+            out.append(low.bit_length() - 1)
+            mask ^= low
+        return out
+
+    def number_of_edges(self):
+        n = sum(bin(mask).count("1") for mask in self.adj)
+        return n if self.directed else n // 2
+
+    def edges(self):
+        """(i, j) index pairs of the edges, i < j if undirected."""
+        return [(i, j) for i in range(len(self.nodes)) for j in
+            self.neighbors(i) if self.directed or i < j]
+
+    def wl_hash(self, node_anchored=False):
+        """utils.wl_hash of the pattern as returned by to_networkx."""
+        return utils.wl_hash_neighbors([self.neighbors(i) for i in
+            range(len(self.nodes))],
+            anchor=self.anchor if node_anchored else None)
+
+    def to_networkx(self, graph=None, node_anchored=True):
+        """The pattern as a NetworkX graph with the dataset node ids and an
+        "anchor" node attribute. Node and edge attributes are copied from
+        graph (dataset[graph_idx]) if given."""
+        if graph is not None:
+            pattern = graph.subgraph(self.nodes).copy()
+            pattern.remove_edges_from(nx.selfloop_edges(pattern))
+        else:
+            pattern = nx.DiGraph() if self.directed else nx.Graph()
+            pattern.add_nodes_from(self.nodes)
+            pattern.add_edges_from((self.nodes[i], self.nodes[j]) for i, j in
+                self.edges())
+        anchor = self.nodes[self.anchor]
+        for v in pattern.nodes:
+            pattern.nodes[v]["anchor"] = 1 if node_anchored and v == anchor \
+                else 0
+        return pattern
@@ -0,0 +1,320 @@
+"""Sampling of search seeds (graph index, start node) over a dataset.
+
+A SeedSampler is built once per dataset. It computes, for every node, whether
+at least `min_reachable` nodes (itself included) can be reached from it by
+following edges (successors in directed graphs), keeps the result as a bitmap
+per graph, and puts all usable nodes of all graphs in one alias table, so a
+seed is drawn in O(1) and is never an isolated node or on a small island.
+
+graph_store.LazyGraph views are never copied into a sparse matrix: their node
+weights are summed over the store's CSR arrays in chunks, and since their
+reachability would need the whole edge set, a drawn seed is checked by a
+breadth-first search stopped at `min_reachable` nodes instead (and redrawn if
+it fails).
+
+Schemes (node weights):
+    uniform      every usable node equally likely (the dataset graph is then
+                 chosen proportionally to its number of usable nodes)
+    degree       proportional to degree (in + out degree if directed)
+    weight       proportional to the summed "weight" of incident edges
+    stratified   nodes are grouped by log2(degree + 1); every group is equally
+                 likely, and nodes within a group are uniform
+"""
+from collections import deque
+
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+SCHEMES = ("uniform", "degree", "weight", "stratified")
+
+# nodes of a graph_store.LazyGraph whose edge weights are summed at once
+CHUNK_NODES = 1 << 16
+# consecutive seeds of graph_store.LazyGraph views rejected before giving up
+MAX_REJECTS = 10000
+
+
+class AliasTable:
+    """ Walker alias table of a fixed discrete distribution.
+
+    Args:
+        weights: non-negative weights, not all zero.
+    """
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        total = weights.sum()
+        if len(weights) == 0 or total <= 0:
+            raise ValueError("alias table needs a positive weight")
+        n = len(weights)
+        scaled = (weights * (n / total)).tolist()
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # whatever is left has probability 1 up to rounding
+        self.prob = np.array(prob)
+        self.alias = np.array(alias, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.prob)
+
+    def sample(self, rng):
+        """An index drawn with rng, anything with a random() method in [0, 1)
+        (the random or np.random module, a np.random.Generator)."""
+        i = int(rng.random() * len(self.prob))
+        return i if rng.random() < self.prob[i] else int(self.alias[i])
+
+    def sample_many(self, n, rng):
+        """n indices drawn at once with rng, anything with a random(size)
+        method (the np.random module, a np.random.Generator)."""
+        i = (rng.random(n) * len(self.prob)).astype(np.int64)
+        return np.where(rng.random(n) < self.prob[i], i, self.alias[i])
+
+
+def adjacency(graph, weighted):
+    """(CSR adjacency, node ids) of a NetworkX graph or graph_store.LazyGraph;
+    row/column i is node ids[i]. Copies every edge of a LazyGraph."""
+    store = getattr(graph, "store", None)
+    if store is not None:
+        data = (store.weight[store.eids].astype(np.float64) if weighted and
+            store.weight is not None else np.ones(len(store.indices)))
+        n = store.n_nodes
+        adj = sp.csr_matrix((data, store.indices, store.indptr), shape=(n, n))
+        if store.directed and not graph.is_directed():
+            adj = (adj + adj.T).tocsr()
+        return adj, range(n)
+    nodes = list(graph.nodes)
+    adj = nx.to_scipy_sparse_array(graph, nodelist=nodes,
+        weight="weight" if weighted else None, format="csr")
+    return sp.csr_matrix(adj), nodes
+
+
+def store_weights(graph, scheme):
+    """(node weights, maybe-usable nodes) of a graph_store.LazyGraph, read from
+    its (memory mapped) store. Nodes without an edge to follow are not usable;
+    the others still have to be checked with reaches."""
+    store = graph.store
+    out_degree = np.diff(store.indptr)
+    degree = out_degree
+    if store.directed:
+        degree = out_degree + np.diff(store.in_indptr)
+    # directed views follow successors only
+    usable = (out_degree if graph.is_directed() else degree) > 0
+    if scheme == "weight":
+        csrs = [(store.indptr, store.eids)]
+        if store.directed:
+            csrs.append((store.in_indptr, store.in_eids))
+        w = np.zeros(store.n_nodes)
+        for indptr, eids in csrs:
+            for lo in range(0, store.n_nodes, CHUNK_NODES):
+                hi = min(lo + CHUNK_NODES, store.n_nodes)
+                rows = np.repeat(np.arange(hi - lo), np.diff(indptr[lo:hi+1]))
+                edges = store.weight[eids[int(indptr[lo]):int(indptr[hi])]]
+                w[lo:hi] += np.bincount(rows, weights=edges,
+                    minlength=hi - lo)
+    elif scheme in ("degree", "stratified"):
+        w = degree.astype(np.float64)
+    else:
+        w = np.ones(store.n_nodes)
+    return w, usable
+
+
+def reaches(graph, node, k):
+    """Whether node reaches at least k nodes of graph (itself included), by a
+    breadth-first search stopped at k nodes."""
+    step = graph.successors if graph.is_directed() else graph.neighbors
+    seen = {node}
+    queue = deque([node])
+    while queue and len(seen) < k:
+        for v in step(queue.popleft()):
+            if v not in seen:
+                seen.add(v)
+                queue.append(v)
+                if len(seen) >= k:
+                    break
+    return len(seen) >= k
+
+
+def can_reach(adj, directed, k):
+    """Boolean array: can node i reach at least k nodes (itself included)?"""
+    n = adj.shape[0]
+    if k <= 1:
+        return np.ones(n, dtype=bool)
+    if not directed:
+        _, labels = csgraph.connected_components(adj, directed=False)
+        return np.bincount(labels)[labels] >= k
+    # strongly connected components of size >= k are usable, and so is every
+    # component that reaches one; otherwise, reachable node sets (smaller
+    # than k) are merged over the condensation in reverse topological order
+    n_comp, labels = csgraph.connected_components(adj, directed=True,
+        connection="strong")
+    sizes = np.bincount(labels, minlength=n_comp)
+    rows, cols = adj.nonzero()
+    keep = labels[rows] != labels[cols]
+    dag = sp.csr_matrix((np.ones(int(keep.sum())), (labels[rows[keep]],
+        labels[cols[keep]])), shape=(n_comp, n_comp))
+    dag.sum_duplicates()
+    rdag = dag.T.tocsr()
+    order = np.argsort(labels, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    full = sizes >= k
+    reach = [None] * n_comp
+    out_degree = np.diff(dag.indptr)
+    queue = deque(np.flatnonzero(out_degree == 0).tolist())
+    while queue:
+        c = queue.popleft()
+        if not full[c]:
+            nodes = set(order[starts[c]:starts[c+1]].tolist())
+            for d in dag.indices[dag.indptr[c]:dag.indptr[c+1]]:
+                if full[d]:
+                    full[c] = True
+                    break
+                nodes |= reach[d]
+                if len(nodes) >= k:
+                    full[c] = True
+                    break
+            reach[c] = None if full[c] else nodes
+        for p in rdag.indices[rdag.indptr[c]:rdag.indptr[c+1]]:
+            out_degree[p] -= 1
+            if out_degree[p] == 0:
+                queue.append(p)
+    return full[labels]
+
+
+class SeedSampler:
+    """ Seeds (graph index, node) drawn from a fixed dataset.
+
+    Args:
+        graphs: NetworkX graphs or graph_store.LazyGraph views.
+        min_reachable: seeds must reach at least this many nodes.
+        scheme: one of SCHEMES.
+    """
+    def __init__(self, graphs, min_reachable=1, scheme="uniform"):
+        if scheme not in SCHEMES:
+            raise ValueError(f"unknown seed scheme {scheme!r}, expected one "
+                f"of {SCHEMES}")
+        self.min_reachable = min_reachable
+        self.scheme = scheme
+        self.nodes = []        # per graph: node ids by index
+        self.reachable = []    # per graph: packed bitmap of usable nodes
+        # per graph: the graph_store.LazyGraph whose seeds are checked when
+        # drawn (its bitmap only excludes nodes without edges), or None
+        self.views = []
+        self.checked = {}      # global position -> reaches() of lazy seeds
+        offsets, weights, usables = [0], [], []
+        for graph in graphs:
+            if getattr(graph, "store", None) is not None:
+                w, usable = store_weights(graph, scheme)
+                if min_reachable <= 1:
+                    usable = np.ones(len(usable), dtype=bool)
+                self.views.append(graph if min_reachable > 1 else None)
+                self.nodes.append(graph.nodes)
+                self.reachable.append(np.packbits(usable))
+                offsets.append(offsets[-1] + len(usable))
+                weights.append(np.where(usable, w, 0.0))
+                usables.append(usable)
+                continue
+            adj, nodes = adjacency(graph, scheme == "weight")
+            usable = can_reach(adj, graph.is_directed(), min_reachable)
+            if scheme == "weight":
+                w = np.asarray(adj.sum(axis=1)).ravel()
+                if graph.is_directed():
+                    w = w + np.asarray(adj.sum(axis=0)).ravel()
+            elif scheme in ("degree", "stratified"):
+                w = adj.getnnz(axis=1).astype(np.float64)
+                if graph.is_directed():
+                    w = w + adj.getnnz(axis=0)
+            else:
+                w = np.ones(len(nodes))
+            self.views.append(None)
+            self.nodes.append(nodes)
+            self.reachable.append(np.packbits(usable))
+            offsets.append(offsets[-1] + len(nodes))
+            weights.append(np.where(usable, w, 0.0))
+            usables.append(usable)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        weights = np.concatenate(weights) if weights else np.zeros(0)
+        if scheme == "stratified":
+            usable = np.concatenate(usables) if usables else weights > 0
+            strata = np.floor(np.log2(weights + 1)).astype(np.int64)
+            counts = np.bincount(strata[usable], minlength=strata.max(
+                initial=0) + 1)
+            weights = np.where(usable, 1.0 / np.maximum(counts[strata], 1),
+                0.0)
+        # global positions of the nodes that can be drawn
+        self.candidates = np.flatnonzero(weights > 0)
+        if len(self.candidates) == 0:
+            raise ValueError(f"no node of the dataset reaches "
+                f"{min_reachable} nodes (seed scheme {scheme!r})")
+        self.table = AliasTable(weights[self.candidates])
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def usable(self, graph_idx):
+        """Boolean array over the node indices of the graph (one bounded
+        search per node for a graph_store.LazyGraph)."""
+        n = len(self.nodes[graph_idx])
+        if self.views[graph_idx] is not None:
+            return np.array([self.can_reach(graph_idx, i) for i in range(n)],
+                dtype=bool)
+        return np.unpackbits(self.reachable[graph_idx], count=n).astype(bool)
+
+    def can_reach(self, graph_idx, node_idx):
+        """Whether the node_idx-th node of the graph can be a seed."""
+        if not self.reachable[graph_idx][node_idx >> 3] & (0x80 >>
+            (node_idx & 7)):
+            return False
+        view = self.views[graph_idx]
+        if view is None:
+            return True
+        pos = int(self.offsets[graph_idx]) + node_idx
+        if pos not in self.checked:
+            self.checked[pos] = reaches(view, node_idx, self.min_reachable)
+        return self.checked[pos]
+
+    def _usable_position(self, pos):
+        graph_idx = int(np.searchsorted(self.offsets, pos, side="right")) - 1
+        return self.views[graph_idx] is None or self.can_reach(graph_idx,
+            pos - int(self.offsets[graph_idx]))
+
+    def _rejected(self, rejects):
+        if rejects >= MAX_REJECTS:
+            raise ValueError(f"{MAX_REJECTS} seeds in a row do not reach "
+                f"{self.min_reachable} nodes (seed scheme {self.scheme!r})")
+
+    def sample(self, rng=np.random):
+        """(graph index, node) drawn with rng (see AliasTable.sample)."""
+        rejects = 0
+        while True:
+            pos = int(self.candidates[self.table.sample(rng)])
+            if self._usable_position(pos):
+                break
+            rejects += 1
+            self._rejected(rejects)
+        graph_idx = int(np.searchsorted(self.offsets, pos, side="right")) - 1
+        return graph_idx, self.nodes[graph_idx][pos - self.offsets[graph_idx]]
+
+    def sample_positions(self, n, rng=np.random):
+        """n seeds as positions in the concatenated node indices of all graphs
+        (node i of graph g is at offsets[g] + i)."""
+        pos = self.candidates[self.table.sample_many(n, rng)]
+        if all(view is None for view in self.views):
+            return pos
+        rejects = 0
+        redraw = np.flatnonzero([not self._usable_position(p) for p in
+            pos.tolist()])
+        while len(redraw):
+            rejects += 1
+            self._rejected(rejects)
+            pos[redraw] = self.candidates[self.table.sample_many(len(redraw),
+                rng)]
+            redraw = redraw[[not self._usable_position(p) for p in
+                pos[redraw].tolist()]]
+        return pos
@@ -2,30 +2,41 @@ from collections import defaultdict, Counter
 
 from deepsnap.graph import Graph as DSGraph
 from deepsnap.batch import Batch
-from deepsnap.dataset import GraphDataset
 import torch
 import torch.optim as optim
-import torch_geometric.utils as pyg_utils
-from torch_geometric.data import DataLoader
 import networkx as nx
 import numpy as np
 import random
-import scipy.stats as stats
 from tqdm import tqdm
 import warnings
 
 from common import feature_preprocess
-
-
-def sample_neigh(graphs, size, graph_type):
-    ps = np.array([len(g) for g in graphs], dtype=float)
-    ps /= np.sum(ps)
-    dist = stats.rv_discrete(values=(np.arange(len(graphs)), ps))
+from common.neigh_sampler import TreeNeighborhoodSampler
+
+
+def sample_neigh(graphs, size, graph_type, sampler=None):
+    """Samples a connected neighborhood of `size` nodes from one of graphs.
+    sampler is an optional common.seed_sampler.SeedSampler over graphs; its
+    start nodes all reach at least sampler.min_reachable nodes, so fewer
+    draws are rejected. To sample many neighborhoods, use
+    common.neigh_sampler.TreeNeighborhoodSampler."""
+    if sampler is None:
+        import scipy.stats as stats
+        ps = np.array([len(g) for g in graphs], dtype=float)
+        ps /= np.sum(ps)
+        dist = stats.rv_discrete(values=(np.arange(len(graphs)), ps))
     while True:
-        idx = dist.rvs()
-        #graph = random.choice(graphs)
-        graph = graphs[idx]
-        start_node = random.choice(list(graph.nodes))
+        if sampler is not None:
+            idx, start_node = sampler.sample(random)
+            graph = graphs[idx]
+        else:
+            idx = dist.rvs()
+            #graph = random.choice(graphs)
+            graph = graphs[idx]
+            nodes = graph.nodes
+            # graph_store.LazyGraph nodes are a range: no need to list them
+            start_node = random.choice(nodes if isinstance(nodes, range) else
+                list(nodes))
         neigh = [start_node]
         if graph_type == "undirected":
             frontier = list(set(graph.neighbors(start_node)) - set(neigh))
@@ -33,16 +44,23 @@ def sample_neigh(graphs, size, graph_type):
             frontier = list(set(graph.successors(start_node)) - set(neigh))
         visited = set([start_node])
         while len(neigh) < size and frontier:
-            new_node = random.choice(list(frontier))
+            # draw from the frontier list, dropping visited entries as they
+            # come up instead of filtering the whole list after every node
+            i = random.randrange(len(frontier))
+            new_node = frontier[i]
+            frontier[i] = frontier[-1]
+            frontier.pop()
             #new_node = max(sorted(frontier))
-            assert new_node not in neigh
+            if new_node in visited:
+                continue
             neigh.append(new_node)
             visited.add(new_node)
             if graph_type == "undirected":
-                frontier += list(graph.neighbors(new_node))
+                frontier += [x for x in graph.neighbors(new_node) if x not in
+                    visited]
             elif graph_type == "directed":
-                frontier += list(graph.successors(new_node))
-            frontier = [x for x in frontier if x not in visited]
+                frontier += [x for x in graph.successors(new_node) if x not in
+                    visited]
         if len(neigh) == size:
             return graph, neigh
 
@@ -59,20 +77,49 @@ def vec_hash(v):
 
 def wl_hash(g, dim=64, node_anchored=False):
     g = nx.convert_node_labels_to_integers(g)
-    vecs = np.zeros((len(g), dim), dtype=int)
+    anchor = None
     if node_anchored:
         for v in g.nodes:
             if g.nodes[v]["anchor"] == 1:
-                vecs[v] = 1
+                anchor = v
                 break
-    for i in range(len(g)):
-        newvecs = np.zeros((len(g), dim), dtype=int)
-        for n in g.nodes:
-            newvecs[n] = vec_hash(np.sum(vecs[list(g.neighbors(n)) + [n]],
-                axis=0))
+    return wl_hash_neighbors([list(g.neighbors(n)) for n in g.nodes],
+        anchor=anchor, dim=dim)
+
+def wl_hash_neighbors(neighbors, anchor=None, dim=64):
+    """wl_hash of the graph on nodes 0..n-1 with the given neighbor lists
+    (successors if directed), anchored at `anchor` if not None."""
+    vecs = np.zeros((len(neighbors), dim), dtype=int)
+    if anchor is not None:
+        vecs[anchor] = 1
+    for i in range(len(neighbors)):
+        newvecs = np.zeros((len(neighbors), dim), dtype=int)
+        for n, nbrs in enumerate(neighbors):
+            newvecs[n] = vec_hash(np.sum(vecs[nbrs + [n]], axis=0))
         vecs = newvecs
     return tuple(np.sum(vecs, axis=0))
 
+def wl_signature(graph, nodes, anchor=None):
+    """WL color refinement of graph.subgraph(nodes), without copying it.
+
+    Cheaper than wl_hash and meant for de-duplicating candidates within a
+    run: isomorphic subgraphs (with the same anchor, if given) get the same
+    signature. Values are not comparable with wl_hash. On directed graphs
+    predecessors and successors are refined separately.
+    """
+    nodes = set(nodes)
+    if graph.is_directed():
+        adjs = [graph.predecessors, graph.successors]
+    else:
+        adjs = [graph.neighbors]
+    nbrs = {v: [[u for u in adj(v) if u in nodes] for adj in adjs]
+        for v in nodes}
+    colors = {v: int(v == anchor) for v in nodes}
+    for _ in range(len(nodes)):
+        colors = {v: hash((colors[v],) + tuple(tuple(sorted(colors[u] for u
+            in side)) for side in nbrs[v])) for v in nodes}
+    return tuple(sorted(colors.values()))
+
 def gen_baseline_queries_rand_esu(queries, targets, node_anchored=False):
     sizes = Counter([len(g) for g in queries])
     max_size = max(sizes.keys())
@@ -152,11 +199,11 @@ def gen_baseline_queries_mfinder(queries, targets, n_samples=10000,
     #for i in range(5, 17):
     #    sizes[i] = 10
     out = []
+    sampler = TreeNeighborhoodSampler(targets)
     for size, count in tqdm(sizes.items()):
         print(size)
         counts = defaultdict(list)
-        for i in tqdm(range(n_samples)):
-            graph, neigh = sample_neigh(targets, size, graph_type="undirected")
+        for graph, neigh in tqdm(sampler.sample_neighs([size] * n_samples)):
             v = neigh[0]
             neigh = graph.subgraph(neigh).copy()
             nx.set_node_attributes(neigh, 0, name="anchor")
@@ -341,6 +388,56 @@ def batch_nx_graphs(graphs, anchors=None):
     
     return batch.to(get_device())
 
+class FusedBatch:
+    """ Several DeepSNAP batches as one, so the embedding model embeds them
+    in a single forward pass: node-level tensors are concatenated and edge
+    indices and graph ids shifted. sizes holds the number of graphs of each
+    batch, to split the embeddings with torch.split.
+    """
+    def __init__(self, node_feature, edge_index, batch, sizes, **node_tensors):
+        self.node_feature = node_feature
+        self.edge_index = edge_index
+        self.batch = batch
+        self.sizes = sizes
+        for key, value in node_tensors.items():
+            setattr(self, key, value)
+
+    @property
+    def num_graphs(self):
+        return sum(self.sizes)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def to(self, device):
+        for key, value in vars(self).items():
+            if torch.is_tensor(value):
+                setattr(self, key, value.to(device))
+        return self
+
+def fuse_batches(batches):
+    """FusedBatch of DeepSNAP batches; empty batches (no graphs) are kept as
+    size 0 entries."""
+    keys = ["node_feature"] + list(feature_preprocess.FEATURE_AUGMENT)
+    node_tensors = {key: [] for key in keys}
+    edge_index, graph_ids, sizes = [], [], []
+    n_nodes, n_graphs = 0, 0
+    for b in batches:
+        if not b:
+            sizes.append(0)
+            continue
+        for key in keys:
+            node_tensors[key].append(b[key])
+        edge_index.append(b.edge_index + n_nodes)
+        graph_ids.append(b.batch + n_graphs)
+        sizes.append(b.num_graphs)
+        n_nodes += b.node_feature.size(0)
+        n_graphs += b.num_graphs
+    node_tensors = {key: torch.cat(values) for key, values in
+        node_tensors.items()}
+    return FusedBatch(edge_index=torch.cat(edge_index, dim=1),
+        batch=torch.cat(graph_ids), sizes=sizes, **node_tensors)
+
 def get_device():
     """Get PyTorch device (GPU if available, otherwise CPU)"""
     return torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -1,5 +1,4 @@
 import argparse
-from common import utils
 
 def parse_encoder(parser, arg_str=None):
     enc_parser = parser.add_argument_group()
@@ -39,6 +38,15 @@ def parse_encoder(parser, arg_str=None):
                         help='whether to use node anchoring in training')
     enc_parser.add_argument('--test', action="store_true")
     enc_parser.add_argument('--n_workers', type=int)
+    enc_parser.add_argument('--n_producers', type=int,
+        help='processes generating training batches ahead of the workers '
+        '(0: each worker generates its own)')
+    enc_parser.add_argument('--prefetch_batches', type=int,
+        help='maximum number of generated batches waiting for a worker')
+    enc_parser.add_argument('--val_cache_dir', type=str,
+        help='directory validation sets are saved to and reused from')
+    enc_parser.add_argument('--eval_batch_size', type=int,
+        help='maximum number of validation pairs embedded in one pass')
     enc_parser.add_argument('--tag', type=str,
         help='tag to identify the run')
     enc_parser.add_argument("--graph_pkl_path", type=str, default=None,
@@ -62,6 +70,10 @@ def parse_encoder(parser, arg_str=None):
                         test_set='',
                         eval_interval=1000,
                         n_workers=4,
+                        n_producers=4,
+                        prefetch_batches=32,
+                        val_cache_dir="data/cache/val",
+                        eval_batch_size=1024,
                         model_path="ckpt/model.pt",
                         tag='',
                         val_size=128,
@@ -55,6 +55,15 @@ def parse_encoder(parser):
                         help='whether to use node anchoring in training')
     parser.add_argument('--test', action="store_true")
     parser.add_argument('--n_workers', type=int)
+    parser.add_argument('--n_producers', type=int,
+        help='processes generating training batches ahead of the workers '
+        '(0: each worker generates its own)')
+    parser.add_argument('--prefetch_batches', type=int,
+        help='maximum number of generated batches waiting for a worker')
+    parser.add_argument('--val_cache_dir', type=str,
+        help='directory validation sets are saved to and reused from')
+    parser.add_argument('--eval_batch_size', type=int,
+        help='maximum number of validation pairs embedded in one pass')
     parser.add_argument('--tag', type=str,
         help='tag to identify the run')
 
@@ -76,6 +85,10 @@ def parse_encoder(parser):
                         test_set='',
                         eval_interval=1000,
                         n_workers=4,
+                        n_producers=4,
+                        prefetch_batches=32,
+                        val_cache_dir="data/cache/val",
+                        eval_batch_size=1024,
                         model_path="ckpt/model.pt",
                         tag='',
                         val_size=4096,
@@ -1,3 +1,6 @@
+import argparse
+import time
+
 from common import utils
 from collections import defaultdict
 from datetime import datetime
@@ -8,33 +11,58 @@ import torch
 USE_ORCA_FEATS = False # whether to use orca motif counts along with embeddings
 MAX_MARGIN_SCORE = 1e9 # a very large margin score to given orca constraints
 
+def fuse_pairs(pts):
+    """FusedBatch of a (pos_a, pos_b, neg_a, neg_b) tuple of DeepSNAP
+    batches, keeping their NetworkX graphs in `graphs`."""
+    fused = utils.fuse_batches(pts)
+    fused.graphs = [b.G if b else [] for b in pts]
+    return fused
+
+def eval_chunks(test_pts, max_pairs):
+    """Groups consecutive validation batches into chunks of at most
+    max_pairs pairs (at least one batch each)."""
+    chunk, n_pairs = [], 0
+    for pts in test_pts:
+        pairs = pts.sizes[0] + pts.sizes[2]
+        if chunk and n_pairs + pairs > max_pairs:
+            yield chunk
+            chunk, n_pairs = [], 0
+        chunk.append(pts)
+        n_pairs += pairs
+    if chunk:
+        yield chunk
+
 def validation(args, model, test_pts, logger, batch_n, epoch, verbose=False):
+    """test_pts: validation batches, as utils.FusedBatch of (pos_a, pos_b,
+    neg_a, neg_b) (see data.load_validation_set) or as tuples of the four
+    DeepSNAP batches. Batches are embedded args.eval_batch_size pairs at a
+    time. The orca features and the verbose confusion matrix examples need
+    the NetworkX graphs, which only tuples carry (persisted sets hold
+    tensors only)."""
     # test on new motifs
     model.eval()
+    test_pts = [fuse_pairs(pts) if isinstance(pts, tuple) else pts
+        for pts in test_pts]
     all_raw_preds, all_preds, all_labels = [], [], []
-    for pos_a, pos_b, neg_a, neg_b in test_pts:
-        if pos_a:
-            pos_a = pos_a.to(utils.get_device())
-            pos_b = pos_b.to(utils.get_device())
-        neg_a = neg_a.to(utils.get_device())
-        neg_b = neg_b.to(utils.get_device())
-        labels = torch.tensor([1]*(pos_a.num_graphs if pos_a else 0) +
-            [0]*neg_a.num_graphs).to(utils.get_device())
+    start_time = time.time()
+    for chunk in eval_chunks(test_pts, args.eval_batch_size):
+        batch = utils.fuse_batches(chunk).to(utils.get_device())
+        emb_as, emb_bs, labels = [], [], []
+        with torch.no_grad():
+            embs = torch.split(model.emb_model(batch), batch.sizes)
+        for pts, emb in zip(chunk, embs):
+            emb_pos_a, emb_pos_b, emb_neg_a, emb_neg_b = torch.split(emb,
+                pts.sizes)
+            emb_as += [emb_pos_a, emb_neg_a]
+            emb_bs += [emb_pos_b, emb_neg_b]
+            labels += [1]*pts.sizes[0] + [0]*pts.sizes[2]
+        labels = torch.tensor(labels).to(utils.get_device())
         with torch.no_grad():
-            emb_neg_a, emb_neg_b = (model.emb_model(neg_a),
-                model.emb_model(neg_b))
-            if pos_a:
-                emb_pos_a, emb_pos_b = (model.emb_model(pos_a),
-                    model.emb_model(pos_b))
-                emb_as = torch.cat((emb_pos_a, emb_neg_a), dim=0)
-                emb_bs = torch.cat((emb_pos_b, emb_neg_b), dim=0)
-            else:
-                emb_as, emb_bs = emb_neg_a, emb_neg_b
-            pred = model(emb_as, emb_bs)
+            pred = model(torch.cat(emb_as, dim=0), torch.cat(emb_bs, dim=0))
             raw_pred = model.predict(pred)
             if USE_ORCA_FEATS:
                 import orca
-                import matplotlib.pyplot as plt
+                import numpy as np
                 def make_feats(g):
                     counts5 = np.array(orca.orbit_counts("node", 5, g))
                     for v, n in zip(counts5, g.nodes):
@@ -43,10 +71,17 @@ def validation(args, model, test_pts, logger, batch_n, epoch, verbose=False):
                             break
                     v5 = np.sum(counts5, axis=0)
                     return v5, anchor_v
-                for i, (ga, gb) in enumerate(zip(neg_a.G, neg_b.G)):
-                    (va, na), (vb, nb) = make_feats(ga), make_feats(gb)
-                    if (va < vb).any() or (na < nb).any():
-                        raw_pred[pos_a.num_graphs + i] = MAX_MARGIN_SCORE
+                offset = 0
+                for pts in chunk:
+                    graphs = getattr(pts, "graphs", None)
+                    if graphs is not None:
+                        for i, (ga, gb) in enumerate(zip(graphs[2],
+                            graphs[3])):
+                            (va, na), (vb, nb) = make_feats(ga), make_feats(gb)
+                            if (va < vb).any() or (na < nb).any():
+                                raw_pred[offset + pts.sizes[0] + i] = \
+                                    MAX_MARGIN_SCORE
+                    offset += pts.sizes[0] + pts.sizes[2]
 
             if args.method_type == "order":
                 pred = model.clf_model(raw_pred.unsqueeze(1)).argmax(dim=-1)
@@ -67,6 +102,7 @@ def validation(args, model, test_pts, logger, batch_n, epoch, verbose=False):
     pred = torch.cat(all_preds, dim=-1)
     labels = torch.cat(all_labels, dim=-1)
     raw_pred = torch.cat(all_raw_preds, dim=-1)
+    pairs_per_sec = len(labels) / max(time.time() - start_time, 1e-9)
     acc = torch.mean((pred == labels).type(torch.float))
     prec = (torch.sum(pred * labels).item() / torch.sum(pred).item() if
         torch.sum(pred) > 0 else float("NaN"))
@@ -90,9 +126,10 @@ def validation(args, model, test_pts, logger, batch_n, epoch, verbose=False):
 
     print("\n{}".format(str(datetime.now())))
     print("Validation. Epoch {}. Acc: {:.4f}. "
-        "P: {:.4f}. R: {:.4f}. AUROC: {:.4f}. AP: {:.4f}.\n     "
+        "P: {:.4f}. R: {:.4f}. AUROC: {:.4f}. AP: {:.4f}. "
+        "Pairs/s: {:.0f}.\n     "
         "TN: {}. FP: {}. FN: {}. TP: {}".format(epoch,
-            acc, prec, recall, auroc, avg_prec,
+            acc, prec, recall, auroc, avg_prec, pairs_per_sec,
             tn, fp, fn, tp))
 
     if not args.test:
@@ -101,6 +138,7 @@ def validation(args, model, test_pts, logger, batch_n, epoch, verbose=False):
         logger.add_scalar("Recall/test", recall, batch_n)
         logger.add_scalar("AUROC/test", auroc, batch_n)
         logger.add_scalar("AvgPrec/test", avg_prec, batch_n)
+        logger.add_scalar("PairsPerSec/test", pairs_per_sec, batch_n)
         logger.add_scalar("TP/test", tp, batch_n)
         logger.add_scalar("TN/test", tn, batch_n)
         logger.add_scalar("FP/test", fp, batch_n)
@@ -108,22 +146,40 @@ def validation(args, model, test_pts, logger, batch_n, epoch, verbose=False):
         print("Saving {}".format(args.model_path))
         torch.save(model.state_dict(), args.model_path)
 
+    metrics = {"acc": acc.item(), "prec": prec, "recall": recall,
+        "auroc": auroc, "avg_prec": avg_prec, "pairs_per_sec": pairs_per_sec}
+
     if verbose:
         conf_mat_examples = defaultdict(list)
         idx = 0
-        for pos_a, pos_b, neg_a, neg_b in test_pts:
-            if pos_a:
-                pos_a = pos_a.to(utils.get_device())
-                pos_b = pos_b.to(utils.get_device())
-            neg_a = neg_a.to(utils.get_device())
-            neg_b = neg_b.to(utils.get_device())
-            for list_a, list_b in [(pos_a, pos_b), (neg_a, neg_b)]:
-                if not list_a: continue
-                for a, b in zip(list_a.G, list_b.G):
+        for pts in test_pts:
+            graphs = getattr(pts, "graphs", None)
+            if graphs is None:
+                idx += pts.sizes[0] + pts.sizes[2]
+                continue
+            for list_a, list_b in [(graphs[0], graphs[1]),
+                (graphs[2], graphs[3])]:
+                for a, b in zip(list_a, list_b):
                     correct = pred[idx] == labels[idx]
                     conf_mat_examples[correct, pred[idx]].append((a, b))
                     idx += 1
 
+    return metrics
+
+def precision_guard(args, model, reduced_model, test_pts, tolerance):
+    """ Runs validation with the full-precision and the reduced-precision model
+    on the same pairs. Reduced precision is acceptable if AUROC drops by at
+    most `tolerance`.
+
+    Returns (ok, full_auroc, reduced_auroc).
+    """
+    eval_args = argparse.Namespace(**vars(args))
+    eval_args.test = True   # no logging, no checkpoint overwrite
+    full_auroc = validation(eval_args, model, test_pts, None, 0, 0)["auroc"]
+    reduced_auroc = validation(eval_args, reduced_model, test_pts, None, 0,
+        0)["auroc"]
+    return full_auroc - reduced_auroc <= tolerance, full_auroc, reduced_auroc
+
 if __name__ == "__main__":
     from subgraph_matching.train import main
     main(force_test=True)
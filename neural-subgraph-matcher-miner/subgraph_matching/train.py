@@ -9,6 +9,7 @@ HYPERPARAM_SEARCH_N_TRIALS = None   # how many grid search trials to run
 import argparse
 from itertools import permutations
 import pickle
+import queue
 from queue import PriorityQueue
 import os
 import random
@@ -39,6 +40,8 @@ else:
     from subgraph_matching.config import parse_encoder
 from subgraph_matching.test import validation
 
+PRODUCER_POLL_SECONDS = 1.0   # producers check for shutdown this often
+
 def build_model(args):
     # build model
     if args.method_type == "order":
@@ -81,64 +84,160 @@ def make_data_source(args):
             raise Exception("Error: unrecognized dataset")
     return data_source
 
-def train(args, model,in_queue, out_queue):
+def generate_batches(args, data_source):
+    """Yields training batches (pos_a, pos_b, neg_a, neg_b) of data_source
+    without end."""
+    while True:
+        loaders = data_source.gen_data_loaders(args.eval_interval *
+            args.batch_size, args.batch_size, train=True)
+        for batch_target, batch_neg_target, batch_neg_query in zip(*loaders):
+            yield data_source.gen_batch(batch_target, batch_neg_target,
+                batch_neg_query, True)
+
+def fused_batches(batches, device):
+    """Yields the batches as utils.FusedBatch on device."""
+    for batch in batches:
+        yield utils.fuse_batches(batch).to(device)
+
+def produce_batches(args, batch_queue, stop):
+    """Producer process: generates fused training batches on the CPU into
+    batch_queue until stop is set. The queue moves the batch tensors to
+    shared memory, so trainers receive them without copying. An exception
+    sets stop, so trainers waiting for batches fail instead of hanging."""
+    torch.set_num_threads(1)
+    # batches still buffered when stop is set are dropped, not flushed
+    batch_queue.cancel_join_thread()
+    try:
+        for batch in fused_batches(generate_batches(args,
+            make_data_source(args)), torch.device("cpu")):
+            while not stop.is_set():
+                try:
+                    batch_queue.put(batch, timeout=PRODUCER_POLL_SECONDS)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set():
+                return
+    except Exception:
+        stop.set()
+        raise
+
+def prefetched_batches(batch_queue, stop):
+    """Yields the training batches of the producer processes; raises
+    RuntimeError once the queue is empty and stop is set (the producers
+    failed or were shut down)."""
+    while True:
+        try:
+            batch = batch_queue.get(timeout=PRODUCER_POLL_SECONDS)
+        except queue.Empty:
+            if stop.is_set():
+                raise RuntimeError("batch producers stopped")
+            continue
+        yield batch.to(utils.get_device())
+
+def start_producers(args):
+    """Starts args.n_producers batch producer processes; returns the batch
+    queue, the stop event and the processes."""
+    batch_queue = mp.Queue(maxsize=args.prefetch_batches)
+    stop = mp.Event()
+    producers = []
+    for i in range(args.n_producers):
+        producer = mp.Process(target=produce_batches, args=(args,
+            batch_queue, stop), daemon=True)
+        producer.start()
+        producers.append(producer)
+    return batch_queue, stop, producers
+
+def stop_producers(stop, producers):
+    stop.set()
+    for producer in producers:
+        producer.join(timeout=10 * PRODUCER_POLL_SECONDS)
+        if producer.is_alive():   # blocked generating a batch
+            producer.terminate()
+            producer.join()
+
+def worker_message(out_queue, producers, workers, stop):
+    """The next message of the training workers. Raises RuntimeError if a
+    batch producer or a worker exits meanwhile, after setting stop so the
+    other workers do not wait for batches forever."""
+    while True:
+        try:
+            return out_queue.get(timeout=PRODUCER_POLL_SECONDS)
+        except queue.Empty:
+            pass
+        for name, procs in (("batch producer", producers),
+            ("training worker", workers)):
+            for proc in procs:
+                if proc.exitcode is not None:
+                    if stop is not None:
+                        stop.set()
+                    raise RuntimeError("{} {} exited with code {}".format(
+                        name, proc.pid, proc.exitcode))
+
+def train(args, model, in_queue, out_queue, batch_queue=None, stop=None):
     """Train the order embedding model.
 
     args: Commandline arguments
     logger: logger for logging progress
     in_queue: input queue to an intersection computation worker
     out_queue: output queue to an intersection computation worker
+    batch_queue: queue of the batch producer processes; if None, batches
+        are generated by this worker
+    stop: stop event of the batch producers
     """
-    scheduler, opt = utils.build_optimizer(args, model.parameters())
+    # the classifier has its own optimizer; opt never saw gradients of it
+    clf_params = (set(model.clf_model.parameters()) if args.method_type ==
+        "order" else set())
+    params = [p for p in model.parameters() if p not in clf_params]
+    scheduler, opt = utils.build_optimizer(args, params)
     if args.method_type == "order":
         clf_opt = optim.Adam(model.clf_model.parameters(), lr=args.lr)
-    data_source = make_data_source(args)
-    done = False
-    while not done:
-        
-        loaders = data_source.gen_data_loaders(args.eval_interval *
-            args.batch_size, args.batch_size, train=True)
-        for batch_target, batch_neg_target, batch_neg_query in zip(*loaders):
-            msg, _ = in_queue.get()
-            if msg == "done":
-                done = True
-                break
-            # train
-            model.train()
-            model.zero_grad()
-            pos_a, pos_b, neg_a, neg_b = data_source.gen_batch(batch_target,
-                batch_neg_target, batch_neg_query, True)
-            emb_pos_a, emb_pos_b = model.emb_model(pos_a), model.emb_model(pos_b)
-            emb_neg_a, emb_neg_b = model.emb_model(neg_a), model.emb_model(neg_b)
-            #print(emb_pos_a.shape, emb_neg_a.shape, emb_neg_b.shape)
-            emb_as = torch.cat((emb_pos_a, emb_neg_a), dim=0)
-            emb_bs = torch.cat((emb_pos_b, emb_neg_b), dim=0)
-            labels = torch.tensor([1]*pos_a.num_graphs + [0]*neg_a.num_graphs).to(
-                utils.get_device())
-            intersect_embs = None
-            pred = model(emb_as, emb_bs)
-            loss = model.criterion(pred, intersect_embs, labels)
+        criterion = nn.NLLLoss()
+    if batch_queue is not None:
+        batches = prefetched_batches(batch_queue, stop)
+    else:
+        batches = fused_batches(generate_batches(args,
+            make_data_source(args)), utils.get_device())
+    while True:
+        msg, _ = in_queue.get()
+        if msg == "done":
+            break
+        # train
+        model.train()
+        model.zero_grad()
+        # pos_a, pos_b, neg_a and neg_b in one forward pass
+        batch = next(batches)
+        emb_pos_a, emb_pos_b, emb_neg_a, emb_neg_b = torch.split(
+            model.emb_model(batch), batch.sizes)
+        emb_as = torch.cat((emb_pos_a, emb_neg_a), dim=0)
+        emb_bs = torch.cat((emb_pos_b, emb_neg_b), dim=0)
+        labels = torch.tensor([1]*batch.sizes[0] + [0]*batch.sizes[2]).to(
+            utils.get_device())
+        intersect_embs = None
+        pred = model(emb_as, emb_bs)
+        loss = model.criterion(pred, intersect_embs, labels)
+        if args.method_type == "order":
+            # the classifier sees detached violations, so one backward pass
+            # gives both losses their own gradients
+            with torch.no_grad():
+                violation = model.predict(pred)
+            pred = model.clf_model(violation.unsqueeze(1))
+            clf_loss = criterion(pred, labels)
+            (loss + clf_loss).backward()
+        else:
             loss.backward()
-            torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
-            opt.step()
-            if scheduler:
-                scheduler.step()
-
-            if args.method_type == "order":
-                with torch.no_grad():
-                    pred = model.predict(pred)
-                model.clf_model.zero_grad()
-                pred = model.clf_model(pred.unsqueeze(1))
-                criterion = nn.NLLLoss()
-                clf_loss = criterion(pred, labels)
-                clf_loss.backward()
-                clf_opt.step()
-            pred = pred.argmax(dim=-1)
-            acc = torch.mean((pred == labels).type(torch.float))
-            train_loss = loss.item()
-            train_acc = acc.item()
-
-            out_queue.put(("step", (loss.item(), acc)))
+        torch.nn.utils.clip_grad_norm_(params, 1.0)
+        opt.step()
+        if scheduler:
+            scheduler.step()
+        if args.method_type == "order":
+            clf_opt.step()
+        pred = pred.argmax(dim=-1)
+        acc = torch.mean((pred == labels).type(torch.float))
+        train_loss = loss.item()
+        train_acc = acc.item()
+
+        out_queue.put(("step", (loss.item(), acc)))
 
 def train_loop(args):
     if not os.path.exists(os.path.dirname(args.model_path)):
@@ -165,44 +264,52 @@ def train_loop(args):
     else:
         clf_opt = None
 
-    data_source = make_data_source(args)
-    loaders = data_source.gen_data_loaders(args.val_size, args.batch_size,
-        train=False, use_distributed_sampling=False)
-    test_pts = []
-    for batch_target, batch_neg_target, batch_neg_query in zip(*loaders):
-        pos_a, pos_b, neg_a, neg_b = data_source.gen_batch(batch_target,
-            batch_neg_target, batch_neg_query, False)
-        if pos_a:
-            pos_a = pos_a.to(torch.device("cpu"))
-            pos_b = pos_b.to(torch.device("cpu"))
-        neg_a = neg_a.to(torch.device("cpu"))
-        neg_b = neg_b.to(torch.device("cpu"))
-        test_pts.append((pos_a, pos_b, neg_a, neg_b))
+    # producers start filling the queue while the validation set is built
+    batch_queue, stop, producers = None, None, []
+    if args.n_producers > 0 and not args.test:
+        print("Starting {} batch producers".format(args.n_producers))
+        batch_queue, stop, producers = start_producers(args)
 
+    data_source = make_data_source(args)
+    test_pts = data.load_validation_set(data_source,
+        data.validation_set_params(data_source, args.val_size,
+            args.batch_size, graph_path=getattr(args, "graph_pkl_path", None)),
+        args.val_cache_dir)
 
     workers = []
     for i in range(args.n_workers):
         worker = mp.Process(target=train, args=(args, model,
-            in_queue, out_queue))
+            in_queue, out_queue, batch_queue, stop))
         worker.start()
         workers.append(worker)
 
-    if args.test:
-        validation(args, model, test_pts, logger, 0, 0, verbose=True)
-    else:
-        batch_n = 0
-        for epoch in range(args.n_batches // args.eval_interval):
-            for i in range(args.eval_interval):
-                in_queue.put(("step", None))
-            for i in range(args.eval_interval):
-                msg, params = out_queue.get()
-                train_loss, train_acc = params
-                print("Batch {}. Loss: {:.4f}. Training acc: {:.4f}".format(
-                    batch_n, train_loss, train_acc), end="               \r")
-                logger.add_scalar("Loss/train", train_loss, batch_n)
-                logger.add_scalar("Accuracy/train", train_acc, batch_n)
-                batch_n += 1
-            validation(args, model, test_pts, logger, batch_n, epoch)
+    try:
+        if args.test:
+            validation(args, model, test_pts, logger, 0, 0, verbose=True)
+        else:
+            batch_n = 0
+            for epoch in range(args.n_batches // args.eval_interval):
+                for i in range(args.eval_interval):
+                    in_queue.put(("step", None))
+                for i in range(args.eval_interval):
+                    msg, params = worker_message(out_queue, producers,
+                        workers, stop)
+                    train_loss, train_acc = params
+                    print("Batch {}. Loss: {:.4f}. Training acc: {:.4f}"
+                        .format(batch_n, train_loss, train_acc),
+                        end="               \r")
+                    logger.add_scalar("Loss/train", train_loss, batch_n)
+                    logger.add_scalar("Accuracy/train", train_acc, batch_n)
+                    batch_n += 1
+                validation(args, model, test_pts, logger, batch_n, epoch)
+    except BaseException:
+        # workers wait for steps that will not come
+        for worker in workers:
+            worker.terminate()
+        raise
+    finally:
+        if producers:
+            stop_producers(stop, producers)
 
     for i in range(args.n_workers):
         in_queue.put(("done", None))
@@ -0,0 +1,228 @@
+"""Tuning of search parallelism on the host the decoder runs on.
+
+Search throughput is dominated by embedding the one-node extensions of a
+pattern (its frontier) and scoring them against the neighborhood embeddings.
+tune() measures that rate (scored candidates per second, summed over
+processes) the way search trials do it: on frontiers sampled from the
+dataset, through the engine's embed_extensions (incremental if enabled) and
+the dominance index if there is one. It first tries every intra-op thread
+count (and batch size, for the agents that chunk frontiers by --batch_size)
+in one process, then every process count with the best batch size of each
+thread count, and returns the fastest setting. Results are cached in a JSON
+file keyed by a fingerprint of the machine and of the workload, so a host
+only tunes once per model and dataset.
+"""
+import hashlib
+import json
+import os
+import platform
+import random
+import time
+
+import torch
+import torch.multiprocessing as mp
+
+BATCH_SIZES = (16, 32, 64, 128, 256)
+N_BENCH_PATTERNS = 256   # patterns whose frontier is scored per benchmark pass
+MAX_BENCH_FRONTIER = 1024   # frontier nodes kept per benchmark pattern
+
+# settings the measured throughput depends on, besides the machine
+WORKLOAD_ARGS = ("dataset", "graph_type", "method_type", "conv_type",
+    "n_layers", "hidden_dim", "node_anchored", "min_pattern_size",
+    "max_pattern_size", "n_neighborhoods", "inference_backend", "precision",
+    "emb_index_leaf_size", "incremental_embedding", "search_strategy",
+    "memory_efficient")
+
+
+def n_cpus():
+    """Number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def machine_info():
+    cpu_model = platform.processor()
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    memory = (os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") if
+        hasattr(os, "sysconf") and "SC_PHYS_PAGES" in os.sysconf_names
+        else None)
+    return {"machine": platform.machine(), "cpu_model": cpu_model,
+        "n_cpus": n_cpus(), "memory": memory, "torch": torch.__version__,
+        "cuda": torch.cuda.is_available()}
+
+
+def cache_key(args):
+    """Fingerprint of the machine and of the workload of args."""
+    workload = {k: getattr(args, k, None) for k in WORKLOAD_ARGS}
+    blob = json.dumps([machine_info(), workload], sort_keys=True)
+    return hashlib.sha1(blob.encode()).hexdigest()[:16]
+
+
+def uses_batch_size(args, engine):
+    """Whether the search agent of args reads args.batch_size once the
+    neighborhoods are embedded: memory-efficient greedy search scores
+    frontiers in chunks of it, and beam search batches the extensions it
+    does not embed incrementally. Greedy pool trials embed whole frontiers."""
+    if args.search_strategy == "greedy":
+        return bool(args.memory_efficient)
+    if args.search_strategy == "beam":
+        return engine.incremental is None
+    return False
+
+
+def _powers_of_two(n):
+    """1, 2, 4, ... up to n, and n."""
+    out = [1]
+    while out[-1] * 2 <= n:
+        out.append(out[-1] * 2)
+    if out[-1] != n:
+        out.append(n)
+    return out
+
+
+def bench_frontier(graph, neigh, graph_type):
+    """(graph, neigh, frontier) benchmark task of a pattern: frontier holds
+    the nodes a trial growing neigh could add (at most MAX_BENCH_FRONTIER),
+    and graph is the subgraph of graph on neigh and frontier, which holds
+    every extension, so benchmark processes do not need the dataset."""
+    nbrs = graph.successors if graph_type == "directed" else graph.neighbors
+    members = set(neigh)
+    frontier = list({v for u in neigh for v in nbrs(u)} - members)
+    if len(frontier) > MAX_BENCH_FRONTIER:
+        frontier = random.sample(frontier, MAX_BENCH_FRONTIER)
+    return graph.subgraph(list(neigh) + frontier).copy(), list(neigh), \
+        frontier
+
+
+def score_frontier(agent, graph, neigh, frontier, batch_size=None):
+    """Embeds and scores the extensions of neigh by the frontier nodes as a
+    greedy trial does, batch_size at a time (all at once if None)."""
+    state = agent.engine.begin_pattern(graph, neigh)
+    step = batch_size or len(frontier)
+    use_index = agent.index_threshold is not None and not agent.use_fp16
+    best = None
+    for i in range(0, len(frontier), step):
+        embs = agent.engine.embed_extensions(graph, neigh,
+            frontier[i:i+step], agent.node_anchored, state)
+        if use_index:
+            for emb in embs:
+                count = agent.emb_index.count_below(emb, agent.index_threshold,
+                    beat=best)
+                best = count if best is None else max(best, count)
+        else:
+            agent._score_embeddings(embs)
+
+
+bench_agent = None
+bench_frontiers = None
+
+def init_bench_worker(agent, frontiers):
+    global bench_agent, bench_frontiers
+    bench_agent = agent
+    bench_frontiers = frontiers
+
+
+def run_bench(task):
+    """Scored candidates per second for (n_threads, batch_size, duration);
+    batch_size None scores whole frontiers at once."""
+    n_threads, batch_size, duration = task
+    torch.set_num_threads(n_threads)
+    n, start = 0, time.perf_counter()
+    with torch.no_grad():
+        while True:
+            for graph, neigh, frontier in bench_frontiers:
+                score_frontier(bench_agent, graph, neigh, frontier,
+                    batch_size)
+                n += len(frontier)
+            elapsed = time.perf_counter() - start
+            if elapsed >= duration:
+                return n / elapsed
+
+
+def tune(agent, frontiers, batch_sizes=BATCH_SIZES, max_workers=None,
+    duration=0.5):
+    """ Fastest (n_workers, n_threads, batch_size) for scoring frontiers.
+
+    Args:
+        agent: SearchAgent whose engine, emb_index and _score_embeddings are
+            measured.
+        frontiers: (graph, neigh, frontier) tasks (see bench_frontier).
+        batch_sizes: frontier chunk sizes tried, or (None,) if the agent
+            scores whole frontiers.
+        max_workers: largest process count tried (default: number of CPUs).
+        duration: seconds each setting is measured for.
+
+    Returns:
+        dict with n_workers, n_threads, batch_size and rate (candidates per
+        second, summed over the processes).
+    """
+    cpus = n_cpus()
+    max_workers = min(max_workers or cpus, cpus)
+    threads = _powers_of_two(cpus)
+    with mp.Pool(processes=max_workers, initializer=init_bench_worker,
+        initargs=(agent, frontiers)) as pool:
+        # warm up every worker (lazy initialization, allocator)
+        pool.map(run_bench, [(1, batch_sizes[0], duration)] * max_workers,
+            chunksize=1)
+        best_batch = {}
+        for n_threads in threads:
+            rates = {batch_size: pool.apply(run_bench, ((n_threads,
+                batch_size, duration),)) for batch_size in batch_sizes}
+            best_batch[n_threads] = max(rates, key=rates.get)
+        best = None
+        for n_workers in _powers_of_two(max_workers):
+            for n_threads in threads:
+                if n_workers * n_threads > cpus:
+                    continue
+                # one task per process: each blocks its worker for duration
+                rate = sum(pool.map(run_bench, [(n_threads,
+                    best_batch[n_threads], duration)] * n_workers,
+                    chunksize=1))
+                if best is None or rate > best["rate"]:
+                    best = {"n_workers": n_workers, "n_threads": n_threads,
+                        "batch_size": best_batch[n_threads], "rate": rate}
+    return best
+
+
+def autotune(args, agent, frontiers, cache_path=None):
+    """Sets args.n_workers, args.n_threads and, if the search agent uses it
+    (see uses_batch_size), args.batch_size to the tuned values, read from
+    the cache at cache_path if this machine and workload were tuned before,
+    and returns them."""
+    key = cache_key(args)
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    if key in cache:
+        choice, source = cache[key], "cached"
+    else:
+        start = time.time()
+        choice = tune(agent, frontiers, BATCH_SIZES if uses_batch_size(
+            args, agent.engine) else (None,))
+        choice["machine"] = machine_info()
+        choice["tuned_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        source = "measured in {:.1f}s".format(time.time() - start)
+        if cache_path:
+            cache[key] = choice
+            if os.path.dirname(cache_path):
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, cache_path)
+    args.n_workers = choice["n_workers"]
+    args.n_threads = choice["n_threads"]
+    if choice["batch_size"] is not None:
+        args.batch_size = choice["batch_size"]
+    print("Autotune ({}, {}): n_workers={} n_threads={} batch_size={} "
+        "({:.0f} candidates/s)".format(key, source, args.n_workers,
+        args.n_threads, choice["batch_size"] or "unused",
+        choice["rate"]))
+    return choice
@@ -32,15 +32,105 @@ def parse_decoder(parser):
         help='"greedy" or "mcts" search strategy')
     dec_parser.add_argument('--n_trials', type=int,
         help='number of search trials to run')
+    dec_parser.add_argument('--seed_scheme', type=str,
+        help='distribution of search seed nodes: "uniform", "degree", '
+        '"weight" (edge weight) or "stratified" (by log degree)')
     dec_parser.add_argument('--out_batch_size', type=int,
         help='number of motifs to output per graph size')
+    dec_parser.add_argument('--adaptive_trials', action='store_true',
+        help='greedy search: stop before n_trials once the top '
+        'out_batch_size patterns of every size are stable')
+    dec_parser.add_argument('--convergence_interval', type=int,
+        help='trials between checks of the ranking (with --adaptive_trials)')
+    dec_parser.add_argument('--convergence_patience', type=int,
+        help='consecutive stable checks required to stop')
+    dec_parser.add_argument('--convergence_threshold', type=float,
+        help='minimum top-k overlap and rank correlation between checks '
+        'for the ranking of a size to count as stable')
+    dec_parser.add_argument('--journal_path', type=str,
+        help='greedy search: file every completed trial is appended to '
+        '(overwritten unless --resume)')
+    dec_parser.add_argument('--resume', action='store_true',
+        help='resume the run recorded in --journal_path, skipping its '
+        'completed trials')
+    dec_parser.add_argument('--mcts_sync_interval', type=int,
+        help='simulations each MCTS worker runs between merges of the '
+        'workers\' search statistics (with --n_workers > 1)')
     
     # Memory efficiency parameters
     dec_parser.add_argument('--memory_efficient', action='store_true',
         help='Use memory efficient search for large graphs')
+    dec_parser.add_argument('--memory_limit', type=int,
+        help='byte budget of the MCTS pattern instances, or of the pattern '
+        'classes of --memory_efficient greedy search, kept in memory')
+    dec_parser.add_argument('--instance_spill_path', type=str,
+        help='file MCTS pattern instances over the budget are spilled to '
+        '(a temporary file by default)')
+    # Parallelism
+    dec_parser.add_argument('--n_threads', type=int,
+        help='torch intra-op threads of the search processes (0 keeps the '
+        'torch default)')
+    dec_parser.add_argument('--autotune', action="store_true",
+        help='benchmark frontier embedding and scoring on this host and '
+        'set n_workers, n_threads and (for memory-efficient greedy and '
+        'beam search) batch_size to the fastest setting')
+    dec_parser.add_argument('--autotune_cache', type=str,
+        help='file the tuned settings are cached in, per machine and '
+        'workload')
+    # Distributed greedy search
+    dec_parser.add_argument('--distributed', type=str,
+        help='"coordinator" to hand out greedy trials to workers over '
+        '--dist_address, or "worker" to run trials for a coordinator')
+    dec_parser.add_argument('--dist_address', type=str,
+        help='host:port the coordinator listens on and workers connect to')
+    dec_parser.add_argument('--dist_authkey', type=str,
+        help='shared key authenticating workers and the coordinator; '
+        'required unless --dist_address is a loopback address, for which '
+        'the coordinator generates and prints one')
+    dec_parser.add_argument('--dist_chunk', type=int,
+        help='number of trials leased to a worker at a time')
+    dec_parser.add_argument('--dist_timeout', type=float,
+        help='seconds without a result after which a worker\'s trials are '
+        'handed out again')
+    dec_parser.add_argument('--dist_cache_dir', type=str,
+        help='directory workers store the files fetched from the '
+        'coordinator in')
+    # Mining service
+    dec_parser.add_argument('--serve_address', type=str,
+        help='host:port, or unix:PATH for a Unix socket, the mining service '
+        'listens on')
+    dec_parser.add_argument('--serve_token', type=str,
+        help='token clients of the mining service must send; required '
+        'unless --serve_address is a Unix socket or a loopback address')
+    dec_parser.add_argument('--serve_dir', type=str,
+        help='directory the files named by mining service jobs '
+        '(patterns_path, and the paths they override) must be in')
     # Beam search parameter
     parser.add_argument('--beam_width', type=int, default=5,
                         help='Width of beam for beam search')
+    dec_parser.add_argument('--beam_seed', type=int,
+        help='base random seed of the beam search seed beams')
+    # Inference backend
+    dec_parser.add_argument('--inference_backend', type=str,
+        help='"eager", "torchscript", "compile" or "onnx" backend used to '
+        'embed neighborhoods and candidate patterns')
+    dec_parser.add_argument('--n_parity_graphs', type=int,
+        help='number of held-out neighborhoods used to check non-eager '
+        'inference backends against eager')
+    dec_parser.add_argument('--incremental_embedding', action="store_true",
+        help='embed one-node pattern extensions by updating cached layer '
+        'states of the current pattern')
+    dec_parser.add_argument('--emb_index_leaf_size', type=int,
+        help='block size of the dominance index used to score candidates '
+        'against neighborhood embeddings (0 scans every embedding)')
+    dec_parser.add_argument('--precision', type=str,
+        help='"fp32", "int8" (dynamic quantization) or "bf16" (autocast) '
+        'CPU inference precision')
+    dec_parser.add_argument('--precision_tolerance', type=float,
+        help='maximum AUROC drop on validation pairs for which reduced '
+        'precision is enabled')
+    dec_parser.add_argument('--precision_pairs_path', type=str,
+        help='cache of the validation pairs used to check reduced precision')
     # Output and analysis
     dec_parser.add_argument('--out_path', type=str,
         help='path to output candidate motifs')
@@ -76,7 +166,30 @@ def parse_decoder(parser):
         min_neighborhood_size=5,
         max_neighborhood_size=10,
         search_strategy="greedy",
+        seed_scheme="uniform",
+        convergence_interval=50,
+        convergence_patience=3,
+        convergence_threshold=0.9,
+        mcts_sync_interval=25,
+        beam_seed=0,
         out_batch_size=10,
         node_anchored=True,
-        memory_limit=1000000
+        memory_limit=1000000,
+        n_threads=0,
+        distributed="",
+        dist_address="localhost:6123",
+        dist_authkey=None,
+        dist_chunk=25,
+        dist_timeout=600,
+        dist_cache_dir="results/dist-cache",
+        serve_address="localhost:8765",
+        serve_token=None,
+        serve_dir="results",
+        autotune_cache="results/autotune.json",
+        inference_backend="eager",
+        emb_index_leaf_size=256,
+        n_parity_graphs=256,
+        precision="fp32",
+        precision_tolerance=0.01,
+        precision_pairs_path="results/precision-val-pairs.p"
     )
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""Convergence test of the per-size pattern ranking, for adaptive stopping.
+
+Every `interval` trials, the top-k pattern classes (WL hashes) of each size
+are compared with those of the previous check. The stability of a size is
+the smaller of the overlap of the two top-k sets and the Kendall rank
+correlation of the counts of their union at both checks; the ranking has
+converged once every size was at least `threshold` stable for `patience`
+consecutive checks.
+"""
+import math
+
+
+def top_k(counts, k):
+    """The k most counted keys of a {key: count} dict."""
+    return [key for key, _ in sorted(counts.items(), key=lambda x: x[1],
+        reverse=True)[:k]]
+
+
+def ranking_stability(prev_counts, counts, k):
+    """Stability in [-1, 1] of the top-k keys between two {key: count}
+    snapshots."""
+    prev_top, top = top_k(prev_counts, k), top_k(counts, k)
+    if not top and not prev_top:
+        return 1.0
+    overlap = len(set(prev_top) & set(top)) / max(len(prev_top), len(top))
+    union = list(set(prev_top) | set(top))
+    if len(union) < 2:
+        return overlap
+    import scipy.stats as stats   # only runs with --adaptive_trials
+    tau = stats.kendalltau([prev_counts.get(key, 0) for key in union],
+        [counts.get(key, 0) for key in union])[0]
+    if math.isnan(tau):   # constant counts: no order to disagree on
+        tau = 1.0
+    return min(overlap, tau)
+
+
+class RankingConvergence:
+    """ Tracks the top-k ranking of each pattern size as trials complete.
+
+    Args:
+        k: number of patterns output per size (out_batch_size).
+        interval: number of trials between checks.
+        patience: number of consecutive stable checks required.
+        threshold: minimum stability of every size.
+        min_trials: number of trials run before stopping is considered.
+    """
+    def __init__(self, k, interval=50, patience=3, threshold=0.9,
+        min_trials=0):
+        self.k = k
+        self.interval = interval
+        self.patience = patience
+        self.threshold = threshold
+        self.min_trials = min_trials
+        self.prev = None
+        self.n_stable = 0
+        self.stability = None
+
+    def update(self, n_trials, counts):
+        """Records that n_trials trials have completed, with per-size counts
+        {size: {wl_hash: count}}. Returns True once converged."""
+        if n_trials % self.interval != 0:
+            return False
+        snapshot = {size: dict(c) for size, c in counts.items()}
+        if self.prev is not None:
+            sizes = set(snapshot) | set(self.prev)
+            self.stability = min((ranking_stability(self.prev.get(size, {}),
+                snapshot.get(size, {}), self.k) for size in sizes),
+                default=1.0)
+            self.n_stable = (self.n_stable + 1 if self.stability >=
+                self.threshold else 0)
+        self.prev = snapshot
+        return n_trials >= self.min_trials and self.n_stable >= self.patience
@@ -1,50 +1,52 @@
 import argparse
-import csv
-from itertools import combinations
+import sys
 import time
 import os
 import pickle
 
-from deepsnap.batch import Batch
+from subgraph_mining.config import parse_decoder
+from subgraph_matching.config import parse_encoder
+
+def arg_parser():
+    parser = argparse.ArgumentParser(description='Decoder arguments')
+    parse_encoder(parser)
+    parse_decoder(parser)
+    return parser
+
+if __name__ == '__main__' and ('-h' in sys.argv or '--help' in sys.argv):
+    arg_parser().parse_args()   # prints the help before torch is imported
+
 import numpy as np
 import torch
-import torch.optim as optim
-import torch.nn as nn
-import torch.nn.functional as F
 from tqdm import tqdm
 
-from torch_geometric.datasets import TUDataset, PPI
-from torch_geometric.datasets import Planetoid, KarateClub, QM7b
-from torch_geometric.data import DataLoader
 import torch_geometric.utils as pyg_utils
 
-import torch_geometric.nn as pyg_nn
-from matplotlib import cm
-
-from common import data
 from common import models
 from common import utils
-from common import combined_syn
-from subgraph_mining.config import parse_decoder
-from subgraph_matching.config import parse_encoder
-from visualizer.visualizer import visualize_pattern_graph_ext
-from subgraph_mining.search_agents import GreedySearchAgent, MCTSSearchAgent, MemoryEfficientMCTSAgent, MemoryEfficientGreedyAgent, BeamSearchAgent
-
-import matplotlib.pyplot as plt
+from common import edgelist
+from common import graph_store
+from common.neigh_sampler import (SerialNeighborhoodSampler,
+    TreeNeighborhoodSampler)
+from common.seed_sampler import SeedSampler
+from common import inference
+from subgraph_mining.autotune import N_BENCH_PATTERNS, autotune, \
+    bench_frontier
+from subgraph_mining.convergence import RankingConvergence
+from subgraph_mining.distributed import Coordinator, Worker, \
+    graphs_fingerprint
+from subgraph_mining.dominance_index import DominanceIndex
+from subgraph_mining.journal import TrialJournal, run_config
+from subgraph_mining.search_agents import SearchAgent, GreedySearchAgent, MCTSSearchAgent, MemoryEfficientMCTSAgent, MemoryEfficientGreedyAgent, BeamSearchAgent
+
+# matplotlib, the PyG datasets, common.data and the visualizer are imported
+# by the code paths that use them: search worker processes import this
+# module, and most runs never need them
 
 import random
-from scipy.io import mmread
-import scipy.stats as stats
-from sklearn.manifold import TSNE
-from sklearn.cluster import KMeans, AgglomerativeClustering
 from collections import defaultdict
-from itertools import permutations
-from queue import PriorityQueue
-import matplotlib.colors as mcolors
 import networkx as nx
-import pickle
 import torch.multiprocessing as mp
-from sklearn.decomposition import PCA
 
 import warnings 
 
@@ -72,6 +74,8 @@ def process_large_graph_in_chunks(graph, chunk_size=10000):
     return graph_chunks
 
 def make_plant_dataset(size):
+    import matplotlib.pyplot as plt
+    from common import combined_syn
     generator = combined_syn.get_generator([size])
     random.seed(3001)
     np.random.seed(14853)
@@ -130,6 +134,7 @@ def pattern_growth_streaming(dataset, task, args):
     return all_discovered_patterns
 
 def visualize_pattern_graph(pattern, args, count_by_size):
+    import matplotlib.pyplot as plt
     try:
         num_nodes = len(pattern)
         num_edges = pattern.number_of_edges()
@@ -446,8 +451,77 @@ def visualize_pattern_graph(pattern, args, count_by_size):
         print(f"Error visualizing pattern graph: {e}")
         return False
 
-def pattern_growth(dataset, task, args):
-    start_time = time.time()
+def load_precision_pairs(args):
+    """ Validation pairs (synthetic, as in training) on which reduced
+    precision is checked. Generated once and cached at
+    args.precision_pairs_path.
+    """
+    from common import data
+    if os.path.exists(args.precision_pairs_path):
+        with open(args.precision_pairs_path, "rb") as f:
+            return pickle.load(f)
+    data_source = data.OTFSynDataSource(node_anchored=args.node_anchored)
+    batch_size = min(args.batch_size, args.val_size)
+    loaders = data_source.gen_data_loaders(args.val_size, batch_size,
+        train=False, use_distributed_sampling=False)
+    test_pts = []
+    for batch_target, batch_neg_target, batch_neg_query in zip(*loaders):
+        pos_a, pos_b, neg_a, neg_b = data_source.gen_batch(batch_target,
+            batch_neg_target, batch_neg_query, False)
+        if pos_a:
+            pos_a = pos_a.to(torch.device("cpu"))
+            pos_b = pos_b.to(torch.device("cpu"))
+        neg_a = neg_a.to(torch.device("cpu"))
+        neg_b = neg_b.to(torch.device("cpu"))
+        test_pts.append((pos_a, pos_b, neg_a, neg_b))
+    out_dir = os.path.dirname(args.precision_pairs_path)
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    with open(args.precision_pairs_path, "wb") as f:
+        pickle.dump(test_pts, f)
+    return test_pts
+
+def apply_precision(model, args):
+    """ Switches the model to args.precision if the AUROC guard allows it;
+    otherwise keeps the full-precision model.
+    """
+    if args.precision == "fp32":
+        return model
+    from subgraph_matching.test import precision_guard
+    if utils.get_device().type != "cpu":
+        print("WARNING: {} precision is only supported for CPU inference, "
+            "using fp32".format(args.precision))
+        return model
+    reduced = inference.reduce_precision(model, args.precision)
+    ok, auroc, reduced_auroc = precision_guard(args, model, reduced,
+        load_precision_pairs(args), args.precision_tolerance)
+    print("Precision {}: AUROC {:.4f} (fp32 {:.4f})".format(args.precision,
+        reduced_auroc, auroc))
+    if not ok:
+        print("WARNING: {} precision drops AUROC by more than {}, using "
+            "fp32".format(args.precision, args.precision_tolerance))
+        return model
+    return reduced
+
+def held_out_neighborhoods(graphs, args, sampler=None):
+    """ Samples fresh tree neighborhoods, not used for mining, on which
+    non-eager inference backends and incremental embedding are checked.
+    """
+    if sampler is None:
+        sampler = neighborhood_sampler(graphs, args)
+    neighs = []
+    sizes = np.random.randint(args.min_neighborhood_size,
+        args.max_neighborhood_size + 1, args.n_parity_graphs)
+    for graph, neigh in sampler.sample_neighs(sizes):
+        neigh = nx.convert_node_labels_to_integers(graph.subgraph(neigh))
+        neigh.add_edge(0, 0)
+        neighs.append(neigh)
+    return neighs
+
+def load_model(args):
+    """ The matching model of args.model_path, in eval mode, switched to
+    args.precision if the AUROC guard allows it.
+    """
     if args.method_type == "end2end":
         model = models.End2EndOrder(1, args.hidden_dim, args)
     elif args.method_type == "mlp":
@@ -458,21 +532,20 @@ def pattern_growth(dataset, task, args):
     model.eval()
     model.load_state_dict(torch.load(args.model_path,
         map_location=utils.get_device()))
+    return apply_precision(model, args)
 
+def dataset_graphs(dataset, task):
+    """ The graphs of a loaded dataset that are mined, as NetworkX graphs
+    (or graph_store.LazyGraph views).
+    """
     if task == "graph-labeled":
         dataset, labels = dataset
-
-    neighs_pyg, neighs = [], []
-    print(len(dataset), "graphs")
-    print("search strategy:", args.search_strategy)
-    print("graph type:", args.graph_type)
-    if task == "graph-labeled": print("using label 0")
-    
+        print("using label 0")
     graphs = []
     for i, graph in enumerate(dataset):
         if task == "graph-labeled" and labels[i] != 0: continue
         if task == "graph-truncate" and i >= 1000: break
-        if not type(graph) == nx.Graph and not type(graph) == nx.DiGraph:
+        if not isinstance(graph, (nx.Graph, graph_store.LazyGraph)):
             graph = pyg_utils.to_networkx(graph).to_undirected()
             for node in graph.nodes():
                 if 'label' not in graph.nodes[node]:
@@ -480,151 +553,348 @@ def pattern_growth(dataset, task, args):
                 if 'id' not in graph.nodes[node]:
                     graph.nodes[node]['id'] = str(node)
         graphs.append(graph)
-    
-    if args.use_whole_graphs:
-        neighs = graphs
-    else:
-        anchors = []
-        if args.sample_method == "radial":
-            for i, graph in enumerate(graphs):
-                print(i)
-                for j, node in enumerate(graph.nodes):
-                    if len(dataset) <= 10 and j % 100 == 0: print(i, j)
-                    if args.use_whole_graphs:
-                        neigh = graph.nodes
-                    else:
-                        neigh = list(nx.single_source_shortest_path_length(graph,
-                            node, cutoff=args.radius).keys())
-                        if args.subgraph_sample_size != 0:
-                            neigh = random.sample(neigh, min(len(neigh),
-                                args.subgraph_sample_size))
-                    if len(neigh) > 1:
-                        subgraph = graph.subgraph(neigh)
-                        if args.subgraph_sample_size != 0:
-                            subgraph = subgraph.subgraph(max(
-                                nx.connected_components(subgraph), key=len))
-                        
-                        orig_attrs = {n: subgraph.nodes[n].copy() for n in subgraph.nodes()}
-                        edge_attrs = {(u,v): subgraph.edges[u,v].copy() 
-                                    for u,v in subgraph.edges()}
-                        
-                        mapping = {old: new for new, old in enumerate(subgraph.nodes())}
-                        subgraph = nx.relabel_nodes(subgraph, mapping)
-                        
-                        for old, new in mapping.items():
-                            subgraph.nodes[new].update(orig_attrs[old])
-                        
-                        for (old_u, old_v), attrs in edge_attrs.items():
-                            subgraph.edges[mapping[old_u], mapping[old_v]].update(attrs)
-                        
-                        subgraph.add_edge(0, 0)
-                        neighs.append(subgraph)
-                        if args.node_anchored:
-                            anchors.append(0)
-        elif args.sample_method == "tree":
-            start_time = time.time()
-            for j in tqdm(range(args.n_neighborhoods)):
-                graph, neigh = utils.sample_neigh(graphs,
-                    random.randint(args.min_neighborhood_size,
-                        args.max_neighborhood_size), args.graph_type)
-                neigh = graph.subgraph(neigh)
-                neigh = nx.convert_node_labels_to_integers(neigh)
-                neigh.add_edge(0, 0)
-                neighs.append(neigh)
-                if args.node_anchored:
-                    anchors.append(0)
+    return graphs
 
+def neighborhood_sampler(graphs, args, seed_sampler=None):
+    """ Sampler of the tree neighborhoods of graphs, whose start nodes reach
+    args.min_neighborhood_size nodes. Datasets read lazily from a graph store
+    are not indexed as a whole: their neighborhoods are grown one at a time,
+    from seeds of seed_sampler.
+    """
+    if any(isinstance(graph, graph_store.LazyGraph) for graph in graphs):
+        return SerialNeighborhoodSampler(graphs, args.graph_type,
+            seed_sampler=seed_sampler)
+    return TreeNeighborhoodSampler(graphs,
+        min_size=args.min_neighborhood_size)
+
+def sample_neighborhoods(graphs, args, neigh_sampler):
+    """ The node neighborhoods patterns are scored against, and their anchor
+    nodes if node anchored.
+    """
+    neighs, anchors = [], []
+    if args.use_whole_graphs:
+        return graphs, anchors
+    if args.sample_method == "radial":
+        for i, graph in enumerate(graphs):
+            print(i)
+            for j, node in enumerate(graph.nodes):
+                if len(graphs) <= 10 and j % 100 == 0: print(i, j)
+                neigh = list(nx.single_source_shortest_path_length(graph,
+                    node, cutoff=args.radius).keys())
+                if args.subgraph_sample_size != 0:
+                    neigh = random.sample(neigh, min(len(neigh),
+                        args.subgraph_sample_size))
+                if len(neigh) > 1:
+                    subgraph = graph.subgraph(neigh)
+                    if args.subgraph_sample_size != 0:
+                        subgraph = subgraph.subgraph(max(
+                            nx.connected_components(subgraph), key=len))
+                    
+                    orig_attrs = {n: subgraph.nodes[n].copy() for n in subgraph.nodes()}
+                    edge_attrs = {(u,v): subgraph.edges[u,v].copy() 
+                                for u,v in subgraph.edges()}
+                    
+                    mapping = {old: new for new, old in enumerate(subgraph.nodes())}
+                    subgraph = nx.relabel_nodes(subgraph, mapping)
+                    
+                    for old, new in mapping.items():
+                        subgraph.nodes[new].update(orig_attrs[old])
+                    
+                    for (old_u, old_v), attrs in edge_attrs.items():
+                        subgraph.edges[mapping[old_u], mapping[old_v]].update(attrs)
+                    
+                    subgraph.add_edge(0, 0)
+                    neighs.append(subgraph)
+                    if args.node_anchored:
+                        anchors.append(0)
+    elif args.sample_method == "tree":
+        sizes = np.random.randint(args.min_neighborhood_size,
+            args.max_neighborhood_size + 1, args.n_neighborhoods)
+        for graph, neigh in tqdm(neigh_sampler.sample_neighs(sizes)):
+            neigh = graph.subgraph(neigh)
+            neigh = nx.convert_node_labels_to_integers(neigh)
+            neigh.add_edge(0, 0)
+            neighs.append(neigh)
+            if args.node_anchored:
+                anchors.append(0)
+    return neighs, anchors
+
+def build_engine(model, graphs, args, neigh_sampler):
+    """ Inference engine of args.inference_backend, checked against eager
+    inference on held-out neighborhoods of graphs.
+    """
+    held_out, parity_batches = None, None
+    if args.inference_backend != "eager" or args.incremental_embedding:
+        held_out = held_out_neighborhoods(graphs, args, neigh_sampler)
+    if args.inference_backend != "eager":
+        parity_batches = [utils.batch_nx_graphs(held_out[i:i+args.batch_size],
+            anchors=[0]*len(held_out[i:i+args.batch_size]) if
+            args.node_anchored else None)
+            for i in range(0, len(held_out), args.batch_size)]
+    engine = inference.build_engine(model, args.inference_backend,
+        parity_batches=parity_batches)
+    if args.incremental_embedding:
+        engine.enable_incremental(args.node_anchored,
+            check_graphs=held_out[:args.batch_size])
+    return engine
+
+def embed_neighborhoods(neighs, anchors, engine, args):
+    """ Embeddings of the neighborhoods, one CPU tensor per batch. """
     embs = []
     if len(neighs) % args.batch_size != 0:
         print("WARNING: number of graphs not multiple of batch size")
     for i in range(len(neighs) // args.batch_size):
         top = (i+1)*args.batch_size
-        with torch.no_grad():
-            batch = utils.batch_nx_graphs(neighs[i*args.batch_size:top],
-                anchors=anchors if args.node_anchored else None)
-            emb = model.emb_model(batch)
-            emb = emb.to(torch.device("cpu"))
+        batch = utils.batch_nx_graphs(neighs[i*args.batch_size:top],
+            anchors=anchors if args.node_anchored else None)
+        emb = engine.embed(batch)
+        emb = emb.to(torch.device("cpu"))
         embs.append(emb)
-
-    if args.analyze:
-        embs_np = torch.stack(embs).numpy()
-        plt.scatter(embs_np[:,0], embs_np[:,1], label="node neighborhood")
-
+    return embs
+
+def neighborhood_index(embs, args):
+    """ Dominance index over the neighborhood embeddings, or None if
+    candidates are scored by scanning them. """
+    if args.emb_index_leaf_size > 0 and args.method_type == "order" and embs:
+        return DominanceIndex(embs, leaf_size=args.emb_index_leaf_size)
+    return None
+
+def configure_parallelism(args, model, embs, engine, emb_index, seed_sampler,
+    neigh_sampler):
+    """ Tunes args.n_workers, args.n_threads and args.batch_size if
+    args.autotune, and applies args.n_threads to this process.
+    """
     if not hasattr(args, 'n_workers'):
         args.n_workers = mp.cpu_count()
-
-    # Initialize search agent
+    if args.autotune:
+        # benchmark tasks carry the subgraph they extend: keep the dataset
+        # graphs (and the seed sampler's views of them) out of the benchmark
+        # processes
+        bench_agent = SearchAgent(args.min_pattern_size,
+            args.max_pattern_size, model, [], embs,
+            node_anchored=args.node_anchored, model_type=args.method_type,
+            engine=engine, emb_index=emb_index, seed_sampler=seed_sampler)
+        bench_agent.seed_sampler = None
+        # patterns being grown: one node up to one short of the largest
+        sizes = np.random.randint(1, max(2, args.max_pattern_size),
+            N_BENCH_PATTERNS)
+        frontiers = [bench_frontier(graph, neigh, args.graph_type)
+            for graph, neigh in neigh_sampler.sample_neighs(sizes)]
+        autotune(args, bench_agent, [task for task in frontiers if task[2]],
+            cache_path=args.autotune_cache)
+    if args.n_threads > 0:
+        torch.set_num_threads(args.n_threads)
+
+def make_agent(args, model, graphs, embs, engine, emb_index, seed_sampler,
+    seed=None, journal=None, coordinator=None, pool=None):
+    """ Search agent of args.search_strategy over the neighborhood
+    embeddings. seed, journal, coordinator and pool only apply to greedy
+    search without --memory_efficient.
+    """
     if args.search_strategy == "mcts":
         assert args.method_type == "order"
         if args.memory_efficient:
             agent = MemoryEfficientMCTSAgent(args.min_pattern_size, args.max_pattern_size,
                 model, graphs, embs, node_anchored=args.node_anchored,
-                analyze=args.analyze, out_batch_size=args.out_batch_size)
+                analyze=args.analyze, out_batch_size=args.out_batch_size,
+                engine=engine, emb_index=emb_index, n_workers=args.n_workers,
+                sync_interval=args.mcts_sync_interval,
+                memory_limit=args.memory_limit,
+                spill_path=args.instance_spill_path,
+                seed_sampler=seed_sampler)
         else:
             agent = MCTSSearchAgent(args.min_pattern_size, args.max_pattern_size,
                 model, graphs, embs, node_anchored=args.node_anchored,
-                analyze=args.analyze, out_batch_size=args.out_batch_size)
+                analyze=args.analyze, out_batch_size=args.out_batch_size,
+                engine=engine, emb_index=emb_index, n_workers=args.n_workers,
+                sync_interval=args.mcts_sync_interval,
+                memory_limit=args.memory_limit,
+                spill_path=args.instance_spill_path,
+                seed_sampler=seed_sampler)
     elif args.search_strategy == "greedy":
         if args.memory_efficient:
             agent = MemoryEfficientGreedyAgent(args.min_pattern_size, args.max_pattern_size,
                 model, graphs, embs, node_anchored=args.node_anchored,
                 analyze=args.analyze, model_type=args.method_type,
-                out_batch_size=args.out_batch_size)
+                out_batch_size=args.out_batch_size,
+                batch_size=args.batch_size, engine=engine,
+                emb_index=emb_index, memory_limit=args.memory_limit,
+                seed_sampler=seed_sampler)
         else:
             agent = GreedySearchAgent(args.min_pattern_size, args.max_pattern_size,
                 model, graphs, embs, node_anchored=args.node_anchored,
                 analyze=args.analyze, model_type=args.method_type,
                 out_batch_size=args.out_batch_size, n_beams=1,
-                n_workers=args.n_workers)
+                n_workers=args.n_workers, engine=engine,
+                emb_index=emb_index, convergence=RankingConvergence(
+                    args.out_batch_size, args.convergence_interval,
+                    args.convergence_patience, args.convergence_threshold)
+                if args.adaptive_trials else None,
+                seed=seed, journal=journal, seed_sampler=seed_sampler,
+                coordinator=coordinator, pool=pool)
         agent.args = args
     elif args.search_strategy == "beam":
         agent = BeamSearchAgent(args.min_pattern_size, args.max_pattern_size,
             model, graphs, embs, node_anchored=args.node_anchored,
             analyze=args.analyze, model_type=args.method_type,
-            out_batch_size=args.out_batch_size, beam_width=args.beam_width)
+            out_batch_size=args.out_batch_size, beam_width=args.beam_width,
+            engine=engine, emb_index=emb_index, n_workers=args.n_workers,
+            seed=args.beam_seed, seed_sampler=seed_sampler)
+    else:
+        raise ValueError(f"unknown search strategy {args.search_strategy!r}")
+    return agent
+
+def save_patterns(out_graphs, args, plots=True):
+    """ Writes the patterns to args.out_path and, if plots, draws each to
+    plots/cluster. """
+    if plots:
+        from visualizer.visualizer import visualize_pattern_graph_ext
+        count_by_size = defaultdict(int)
+        warnings.filterwarnings("ignore", category=np.VisibleDeprecationWarning)
+        
+        successful_visualizations = 0
+        for pattern in out_graphs:
+            if visualize_pattern_graph_ext(pattern, args, count_by_size):
+                successful_visualizations += 1
+            count_by_size[len(pattern)] += 1
+
+        print(f"Successfully visualized {successful_visualizations}/{len(out_graphs)} patterns")
+
+    out_dir = os.path.dirname(args.out_path)
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    with open(args.out_path, "wb") as f:
+        pickle.dump(out_graphs, f)
+
+def pattern_growth(dataset, task, args, worker=None):
+    start_time = time.time()
+    model = load_model(args)
+
+    print("search strategy:", args.search_strategy)
+    print("graph type:", args.graph_type)
+    graphs = dataset_graphs(dataset, task)
+    print(len(graphs), "graphs")
+
+    # tree neighborhoods start from nodes that reach min_neighborhood_size
+    # nodes, search seeds from nodes that reach min_pattern_size nodes
+    seed_sampler = SeedSampler(graphs, min_reachable=args.min_pattern_size,
+        scheme=args.seed_scheme)
+    neigh_sampler = neighborhood_sampler(graphs, args, seed_sampler)
+
+    if args.distributed and (args.search_strategy != "greedy" or
+        args.memory_efficient):
+        raise ValueError("--distributed only applies to greedy search "
+            "without --memory_efficient")
+    if worker is not None:
+        worker.check_graphs(graphs)
+
+    journal = None
+    if args.journal_path and args.search_strategy == "greedy" and \
+        not args.memory_efficient:
+        if args.resume and os.path.exists(args.journal_path):
+            journal = TrialJournal.resume(args.journal_path, args)
+            if journal.completed:
+                print(f"{args.journal_path} is a finished run, starting a "
+                    "new one")
+                journal.close()
+                journal = None
+    elif args.journal_path or args.resume:
+        print("WARNING: --journal_path/--resume only apply to greedy search "
+            "without --memory_efficient")
+    
+    # neighborhoods and embeddings of an interrupted run, or of the
+    # coordinator of a distributed run
+    header = journal.header if journal is not None else \
+        worker.header if worker is not None else None
+    if header is not None:
+        neighs = header["neighs"] or graphs
+        anchors = header["anchors"]
+    else:
+        neighs, anchors = sample_neighborhoods(graphs, args, neigh_sampler)
+
+    engine = build_engine(model, graphs, args, neigh_sampler)
+    if header is not None:
+        embs = header["embs"]
+    else:
+        embs = embed_neighborhoods(neighs, anchors, engine, args)
+    new_journal = journal is None and args.journal_path and \
+        args.search_strategy == "greedy" and not args.memory_efficient
+    if header is None and (new_journal or args.distributed == "coordinator"):
+        header = {
+            "config": run_config(args),
+            "seed": random.getrandbits(32),
+            "neighs": None if args.use_whole_graphs else neighs,
+            "anchors": anchors,
+            "embs": embs}
+        if new_journal:
+            journal = TrialJournal.create(args.journal_path, header)
+    coordinator = None
+    if args.distributed == "coordinator":
+        # workers only need the embeddings of the neighborhoods
+        coordinator = Coordinator(args, dict(header, neighs=None,
+            graphs=graphs_fingerprint(graphs)))
+
+    if args.analyze:
+        import matplotlib.pyplot as plt
+        embs_np = torch.stack(embs).numpy()
+        plt.scatter(embs_np[:,0], embs_np[:,1], label="node neighborhood")
+
+    emb_index = neighborhood_index(embs, args)
+    configure_parallelism(args, model, embs, engine, emb_index, seed_sampler,
+        neigh_sampler)
+
+    # Initialize search agent
+    agent = make_agent(args, model, graphs, embs, engine, emb_index,
+        seed_sampler, seed=header["seed"] if header is not None else None,
+        journal=journal, coordinator=coordinator)
+    if worker is not None:
+        n_trials = worker.serve(agent)
+        print(f"Ran {n_trials} trials for the coordinator in "
+            f"{time.time() - start_time:.0f}s")
+        return []
     
     # Run search
     out_graphs = agent.run_search(args.n_trials)
+    if journal is not None:
+        journal.complete()
+        journal.close()
+    if coordinator is not None:
+        coordinator.close()
     
     print(time.time() - start_time, "TOTAL TIME")
     x = int(time.time() - start_time)
     print(x // 60, "mins", x % 60, "secs")
 
-    # Visualize discovered patterns
-    count_by_size = defaultdict(int)
-    warnings.filterwarnings("ignore", category=np.VisibleDeprecationWarning)
-    
-    successful_visualizations = 0
-    for pattern in out_graphs:
-        if visualize_pattern_graph_ext(pattern, args, count_by_size):
-            successful_visualizations += 1
-        count_by_size[len(pattern)] += 1
-
-    print(f"Successfully visualized {successful_visualizations}/{len(out_graphs)} patterns")
-
-    # Save results
-    if not os.path.exists("results"):
-        os.makedirs("results")
-    with open(args.out_path, "wb") as f:
-        pickle.dump(out_graphs, f)
+    # Visualize discovered patterns and save results
+    save_patterns(out_graphs, args)
     
     return out_graphs
 
-def main():
-    if not os.path.exists("plots/cluster"):
-        os.makedirs("plots/cluster")
-
-    parser = argparse.ArgumentParser(description='Decoder arguments')
-    parse_encoder(parser)
-    parse_decoder(parser)
-    
-    args = parser.parse_args()
-
+def load_dataset(args):
+    """ (dataset, task) of args.dataset, a file (graph store or pickle) or
+    the name of a benchmark dataset.
+    """
     print("Using dataset {}".format(args.dataset))
     print("Graph type: {}".format(args.graph_type))
 
+    if args.dataset in ("enzymes", "cox2", "reddit-binary", "dblp", "coil",
+        "ppi"):
+        from torch_geometric.datasets import TUDataset, PPI
+
     # Load dataset based on graph type preference
-    if args.dataset.endswith('.pkl'):
+    if args.dataset.endswith(graph_store.GRAPH_STORE_EXT):
+        # Memory-mapped graph store: build the requested orientation directly
+        store = graph_store.CompactGraph.load(args.dataset)
+        if (args.memory_efficient and args.search_strategy == "greedy" and
+            args.sample_method == "tree"):
+            # only neighborhoods are walked: read adjacency lazily
+            graph = graph_store.LazyGraph(store, args.graph_type)
+        else:
+            graph = store.to_networkx(args.graph_type)
+        print(f"Using graph store with {graph.number_of_nodes()} nodes and {graph.number_of_edges()} edges ({args.graph_type})")
+        dataset = [graph]
+        task = 'graph'
+    elif args.dataset.endswith('.pkl'):
         with open(args.dataset, 'rb') as f:
             data = pickle.load(f)
             
@@ -682,12 +952,8 @@ def main():
         task = 'graph'
     elif args.dataset.startswith('roadnet-'):
         # Road networks are typically undirected
-        graph = nx.Graph() if args.graph_type == "undirected" else nx.DiGraph()
-        with open("data/{}.txt".format(args.dataset), "r") as f:
-            for row in f:
-                if not row.startswith("#"):
-                    a, b = row.split("\t")
-                    graph.add_edge(int(a), int(b))
+        graph = edgelist.load_edgelist("data/{}.txt".format(args.dataset),
+            directed=args.graph_type == "directed").to_networkx(args.graph_type)
         dataset = [graph]
         task = 'graph'
     elif args.dataset == "ppi":
@@ -699,21 +965,34 @@ def main():
             "mn-roads": "mn-roads.mtx",
             "infect": "infect-dublin.edges"}
         # These are typically undirected networks
-        graph = nx.Graph() if args.graph_type == "undirected" else nx.DiGraph()
-        with open("data/{}".format(fn[args.dataset]), "r") as f:
-            for line in f:
-                if not line.strip(): continue
-                a, b = line.strip().split(" ")
-                graph.add_edge(int(a), int(b))
+        graph = edgelist.load_edgelist("data/{}".format(fn[args.dataset]),
+            directed=args.graph_type == "directed").to_networkx(args.graph_type)
         dataset = [graph]
         task = 'graph'
     elif args.dataset.startswith('plant-'):
         size = int(args.dataset.split("-")[-1])
         dataset = make_plant_dataset(size)
         task = 'graph'
+    else:
+        raise ValueError(f"unknown dataset {args.dataset!r}")
+    return dataset, task
+
+def main():
+    if not os.path.exists("plots/cluster"):
+        os.makedirs("plots/cluster")
+
+    args = arg_parser().parse_args()
+
+    worker = None
+    if args.distributed == "worker":
+        # search settings, dataset and checkpoint come from the coordinator
+        worker = Worker.connect(args)
+        args = worker.args
+
+    dataset, task = load_dataset(args)
 
     # Run pattern growth
-    pattern_growth(dataset, task, args)
+    pattern_growth(dataset, task, args, worker=worker)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,338 @@
+"""Coordinator/worker mode of greedy search across machines.
+
+The coordinator is a decoder run with `--distributed coordinator`: it loads
+the dataset, samples and embeds the neighborhoods as usual, then listens on
+`--dist_address` and hands out lists of trial indices instead of running a
+local pool. Workers are decoder runs with `--distributed worker` pointed at
+the same address; they receive the run settings, the trial seed and the
+neighborhood embeddings, check that their dataset and checkpoint match the
+coordinator's by SHA-1 (fetching the files from it if they are missing),
+and stream back the compact records of each trial as it completes.
+
+Messages are pickled over multiprocessing.connection (TCP, authenticated
+with `--dist_authkey`). Unpickling runs code, so there is no default key:
+it must be given unless the coordinator listens on a loopback address, in
+which case it generates one and prints it for the workers. A lease of trials is returned to the queue if its
+worker disconnects or reports no trial for `--dist_timeout` seconds. Trials
+are seeded by (seed, trial index), so a trial run twice gives the same
+result and the first copy to arrive is kept; the merged output does not
+depend on which worker ran what.
+"""
+import argparse
+from collections import deque
+import hashlib
+import ipaddress
+import itertools
+import json
+from multiprocessing.connection import Client, Listener
+import os
+import queue
+import secrets
+import shutil
+import socket
+import threading
+import time
+
+import torch.multiprocessing as mp
+
+from subgraph_mining.search_agents import init_greedy_worker, run_greedy_trial
+
+CHUNK_BYTES = 1 << 24   # bytes per message when a worker fetches a file
+WAIT_SECONDS = 1.0      # worker back-off while no trials are available
+
+# settings of the worker's own node, kept from its command line
+NODE_ARGS = ("n_workers", "n_threads", "autotune", "autotune_cache",
+    "distributed", "dist_address", "dist_authkey", "dist_timeout",
+    "dist_cache_dir")
+
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def is_loopback(host):
+    """Whether every address host resolves to is a loopback address."""
+    try:
+        infos = socket.getaddrinfo(host, None)
+        return bool(infos) and all(ipaddress.ip_address(
+            info[4][0].split("%")[0]).is_loopback for info in infos)
+    except (OSError, ValueError):
+        return False
+
+
+def coordinator_authkey(args):
+    """args.dist_authkey, or a new key if the coordinator only listens on a
+    loopback address."""
+    if args.dist_authkey:
+        return args.dist_authkey
+    host = parse_address(args.dist_address)[0]
+    if not is_loopback(host):
+        raise ValueError(f"--dist_address {args.dist_address} is not a "
+            "loopback address: set --dist_authkey to a secret shared with "
+            "the workers")
+    key = secrets.token_hex(16)
+    print(f"Generated --dist_authkey {key} (pass it to the workers)")
+    return key
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_BYTES), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def graphs_fingerprint(graphs):
+    """Hash of the node and edge counts of the dataset graphs, to check that
+    workers search the same dataset as the coordinator."""
+    sizes = [(g.number_of_nodes(), g.number_of_edges()) for g in graphs]
+    return hashlib.sha1(json.dumps(sizes).encode()).hexdigest()
+
+
+class Coordinator:
+    """ Hands out trials to workers and collects their results.
+
+    Args:
+        args: decoder arguments (sent to the workers).
+        header: dict with the trial "seed", neighborhood "embs" and
+            "anchors" (as in a journal header), and the dataset "graphs"
+            fingerprint.
+    """
+    def __init__(self, args, header):
+        self.address = parse_address(args.dist_address)
+        self.address_str = args.dist_address
+        self.chunk = args.dist_chunk
+        self.timeout = args.dist_timeout
+        self.artifacts = {}
+        for name in ("dataset", "model_path"):
+            path = getattr(args, name)
+            if os.path.isfile(path):
+                self.artifacts[name] = {"path": path, "sha1": file_sha1(path),
+                    "size": os.path.getsize(path)}
+        self.setup = {"args": vars(args), "header": header,
+            "artifacts": {name: dict(info) for name, info in
+                self.artifacts.items()}}
+        self.lock = threading.Lock()
+        self.pending = deque()   # lists of trial indices not leased
+        self.leases = {}         # lease id -> [trials, worker, deadline]
+        self.lease_ids = itertools.count()
+        self.done = set()
+        self.results = queue.Queue()
+        self.finished = False
+        self.listener = Listener(self.address,
+            authkey=coordinator_authkey(args).encode())
+        threading.Thread(target=self._accept, daemon=True).start()
+        print(f"Coordinator listening on {self.address_str}")
+
+    def _accept(self):
+        for worker_id in itertools.count():
+            try:
+                conn = self.listener.accept()
+            except OSError:   # listener closed
+                return
+            threading.Thread(target=self._serve, args=(conn, worker_id),
+                daemon=True).start()
+
+    def _serve(self, conn, worker_id):
+        name = worker_id
+        try:
+            while True:
+                msg = conn.recv()
+                if msg[0] == "hello":
+                    name = f"{worker_id} ({msg[1]})"
+                    print(f"Worker {name} joined")
+                    conn.send(("setup", self.setup))
+                elif msg[0] == "fetch":
+                    conn.send(("chunk", self._read(msg[1], msg[2])))
+                elif msg[0] == "lease":
+                    conn.send(self._lease(worker_id))
+                elif msg[0] == "result":
+                    self._add_result(msg[1], msg[2], msg[3])
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            n = self._release(lambda lease: lease[1] == worker_id)
+            if n and not self.finished:
+                print(f"Worker {name} lost, requeued {n} trials")
+
+    def _read(self, name, offset):
+        with open(self.artifacts[name]["path"], "rb") as f:
+            f.seek(offset)
+            return f.read(CHUNK_BYTES)
+
+    def _lease(self, worker_id):
+        with self.lock:
+            if self.finished:
+                return ("done",)
+            if not self.pending:
+                return ("wait", WAIT_SECONDS)
+            trials = self.pending.popleft()
+            lease_id = next(self.lease_ids)
+            self.leases[lease_id] = [trials, worker_id,
+                time.time() + self.timeout]
+            return ("trials", lease_id, trials)
+
+    def _add_result(self, lease_id, trial_idx, records):
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if lease is not None:
+                lease[2] = time.time() + self.timeout
+                if all(t in self.done or t == trial_idx for t in lease[0]):
+                    del self.leases[lease_id]
+            if trial_idx in self.done:
+                return
+            self.done.add(trial_idx)
+        self.results.put((trial_idx, records))
+
+    def _release(self, match):
+        """Returns the unfinished trials of the matching leases to the
+        queue; returns their number."""
+        n = 0
+        with self.lock:
+            for lease_id, lease in list(self.leases.items()):
+                if match(lease):
+                    del self.leases[lease_id]
+                    trials = [t for t in lease[0] if t not in self.done]
+                    if trials:
+                        self.pending.appendleft(trials)
+                        n += len(trials)
+        return n
+
+    def run(self, trial_idxs):
+        """Yields (trial index, records) of the given trials as workers
+        complete them. Closing the generator stops handing out trials."""
+        trial_idxs = [t for t in trial_idxs if t not in self.done]
+        with self.lock:
+            self.finished = False
+            for i in range(0, len(trial_idxs), self.chunk):
+                self.pending.append(trial_idxs[i:i+self.chunk])
+        remaining = set(trial_idxs)
+        next_check = time.time() + WAIT_SECONDS
+        try:
+            while remaining:
+                try:
+                    trial_idx, records = self.results.get(
+                        timeout=WAIT_SECONDS)
+                except queue.Empty:
+                    trial_idx = None
+                now = time.time()
+                if now >= next_check:
+                    next_check = now + WAIT_SECONDS
+                    n = self._release(lambda lease: lease[2] < now)
+                    if n:
+                        print(f"Requeued {n} trials of leases that timed out")
+                if trial_idx in remaining:
+                    remaining.discard(trial_idx)
+                    yield trial_idx, records
+        finally:
+            with self.lock:
+                self.finished = True
+                self.pending.clear()
+                self.leases.clear()
+
+    def close(self):
+        self.finished = True
+        self.listener.close()
+
+
+class Worker:
+    """ Connection of a worker node to the coordinator.
+
+    Use Worker.connect, which also resolves the dataset and checkpoint
+    files; `args` are then the coordinator's settings with this node's
+    NODE_ARGS and local file paths, and `header` the coordinator's header.
+    """
+    def __init__(self, conn, args, header):
+        self.conn = conn
+        self.args = args
+        self.header = header
+
+    @classmethod
+    def connect(cls, args):
+        if not args.dist_authkey:
+            raise ValueError("--distributed worker needs the coordinator's "
+                "--dist_authkey")
+        address = parse_address(args.dist_address)
+        deadline = time.time() + args.dist_timeout
+        while True:
+            try:
+                conn = Client(address, authkey=args.dist_authkey.encode())
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                if time.time() > deadline:
+                    raise
+                time.sleep(WAIT_SECONDS)
+        conn.send(("hello", f"{os.uname().nodename}:{os.getpid()}"))
+        _, setup = conn.recv()
+        worker_args = argparse.Namespace(**setup["args"])
+        for name in NODE_ARGS:
+            setattr(worker_args, name, getattr(args, name))
+        worker_args.journal_path, worker_args.resume = None, False
+        worker = cls(conn, worker_args, setup["header"])
+        for name, info in setup["artifacts"].items():
+            setattr(worker_args, name, worker._resolve(name, info,
+                getattr(args, name)))
+        return worker
+
+    def _resolve(self, name, info, local_path):
+        """Local path of a file of the coordinator with the same SHA-1: the
+        path given on this node, the coordinator's path (shared file
+        system), or a copy fetched into dist_cache_dir."""
+        ext = os.path.splitext(info["path"])[1]
+        cached = os.path.join(self.args.dist_cache_dir, info["sha1"] + ext)
+        for path in (local_path, info["path"], cached):
+            if path and os.path.isfile(path) and \
+                os.path.getsize(path) == info["size"] and \
+                file_sha1(path) == info["sha1"]:
+                return path
+        print(f"Fetching {name} ({info['size']} bytes) from the coordinator")
+        os.makedirs(self.args.dist_cache_dir, exist_ok=True)
+        tmp_path = cached + ".part"
+        with open(tmp_path, "wb") as f:
+            while f.tell() < info["size"]:
+                self.conn.send(("fetch", name, f.tell()))
+                _, data = self.conn.recv()
+                if not data:
+                    break
+                f.write(data)
+        if file_sha1(tmp_path) != info["sha1"]:
+            raise ValueError(f"fetched {name} does not match the "
+                "coordinator's")
+        shutil.move(tmp_path, cached)
+        return cached
+
+    def check_graphs(self, graphs):
+        if graphs_fingerprint(graphs) != self.header["graphs"]:
+            raise ValueError("the dataset loaded on this worker differs from "
+                "the coordinator's")
+
+    def serve(self, agent):
+        """Runs the trials leased from the coordinator on a pool of
+        agent.n_workers processes until the coordinator is done; returns the
+        number of trials run."""
+        n_trials = 0
+        with mp.Pool(processes=agent.n_workers,
+            initializer=init_greedy_worker,
+            initargs=agent.worker_init_args()) as pool:
+            try:
+                while True:
+                    self.conn.send(("lease",))
+                    reply = self.conn.recv()
+                    if reply[0] == "done":
+                        break
+                    if reply[0] == "wait":
+                        time.sleep(reply[1])
+                        continue
+                    _, lease_id, trials = reply
+                    for trial_idx, records in pool.imap_unordered(
+                        run_greedy_trial, trials):
+                        self.conn.send(("result", lease_id, trial_idx,
+                            records))
+                        n_trials += 1
+            except (EOFError, OSError):
+                print("Lost the connection to the coordinator")
+        self.conn.close()
+        return n_trials
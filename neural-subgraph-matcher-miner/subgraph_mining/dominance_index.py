@@ -0,0 +1,136 @@
+"""Block index over neighborhood embeddings for order-embedding scoring.
+
+A candidate pattern embedding b is scored against every neighborhood
+embedding a through the order violation
+
+    v(a, b) = sum_d max(0, b_d - a_d)^2
+
+which is non-increasing in every coordinate of a. The neighborhood
+embeddings are split into blocks by a KD partition (median split on the
+widest dimension); for a block with per-dimension bounds lo <= a <= hi,
+
+    v(hi, b) <= v(a, b) <= v(lo, b)
+
+so a whole block can be accepted (upper bound under the threshold) or
+rejected (lower bound at or over the threshold) without computing each pair.
+Only straddling blocks are evaluated row by row.
+"""
+import numpy as np
+import torch
+
+from common import utils
+
+DEFAULT_LEAF_SIZE = 256
+BLOCKS_PER_STEP = 16   # straddling blocks evaluated between early-exit checks
+
+
+def order_threshold(model):
+    """Violation below which OrderEmbedder.clf_model predicts "subgraph".
+
+    clf_model is Linear(1, 2) + LogSoftmax, so argmax == 1 iff
+    (w1 - w0) * v + (b1 - b0) > 0. Returns None if the classifier is not a
+    decreasing threshold on v (the index then cannot be used).
+    """
+    lin = model.clf_model[0]
+    w = lin.weight.detach().view(-1).cpu()
+    b = lin.bias.detach().view(-1).cpu()
+    dw = (w[1] - w[0]).item()
+    if dw >= 0:
+        return None
+    return (b[0] - b[1]).item() / dw
+
+
+def _kd_blocks(embs, leaf_size):
+    blocks = []
+    stack = [np.arange(len(embs))]
+    while stack:
+        idx = stack.pop()
+        if len(idx) <= leaf_size:
+            blocks.append(idx)
+            continue
+        sub = embs[idx]
+        dim = np.argmax(sub.max(axis=0) - sub.min(axis=0))
+        half = len(idx) // 2
+        order = np.argpartition(sub[:, dim], half)
+        stack.append(idx[order[half:]])
+        stack.append(idx[order[:half]])
+    return blocks
+
+
+class DominanceIndex:
+    """ Per-block bounding boxes over a set of neighborhood embeddings.
+
+    Args:
+        embs: list of (batch, dim) embedding tensors (as built by the decoder).
+        leaf_size: maximum number of embeddings per block.
+    """
+    def __init__(self, embs, leaf_size=DEFAULT_LEAF_SIZE):
+        embs = torch.cat([e.detach().float().cpu() for e in embs]).numpy()
+        blocks = _kd_blocks(embs, leaf_size)
+        perm = np.concatenate(blocks)
+        sizes = np.array([len(b) for b in blocks])
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        embs = embs[perm]
+        device = utils.get_device()
+        self.n = len(embs)
+        self.embs = torch.from_numpy(embs).to(device)
+        self.lo = torch.from_numpy(np.minimum.reduceat(embs, starts,
+            axis=0)).to(device)
+        self.hi = torch.from_numpy(np.maximum.reduceat(embs, starts,
+            axis=0)).to(device)
+        self.starts = starts
+        self.sizes = sizes
+        self.sizes_t = torch.from_numpy(sizes).to(device)
+
+    def __len__(self):
+        return self.n
+
+    def _violation(self, a, b):
+        return torch.sum(torch.clamp(b - a, min=0)**2, dim=-1)
+
+    def _rows(self, blocks):
+        return torch.cat([self.embs[self.starts[j]:self.starts[j] +
+            self.sizes[j]] for j in blocks])
+
+    def bounds(self, b):
+        """Per-block (lower, upper) bounds on the violation of b."""
+        b = b.float().view(1, -1)
+        return self._violation(self.hi, b), self._violation(self.lo, b)
+
+    def count_below(self, b, threshold, beat=None):
+        """Number of neighborhood embeddings a with v(a, b) < threshold.
+
+        If `beat` is given, evaluation stops as soon as the count provably
+        cannot exceed `beat`; the returned value is then an upper bound that is
+        <= beat rather than the exact count.
+        """
+        with torch.no_grad():
+            b = b.float().view(1, -1)
+            v_lo, v_hi = self.bounds(b)
+            eps = 1e-6 * max(1.0, abs(threshold))
+            accept = v_hi < threshold - eps
+            undecided = ~accept & (v_lo < threshold + eps)
+            count = int(self.sizes_t[accept].sum())
+            pending = undecided.nonzero().view(-1)
+            # most promising blocks first, so early exit triggers sooner
+            pending = pending[torch.argsort(v_lo[pending])].tolist()
+            remaining = int(self.sizes[pending].sum()) if pending else 0
+            for i in range(0, len(pending), BLOCKS_PER_STEP):
+                if beat is not None and count + remaining <= beat:
+                    return count + remaining
+                step = pending[i:i+BLOCKS_PER_STEP]
+                count += int((self._violation(self._rows(step), b) <
+                    threshold).sum())
+                remaining -= int(self.sizes[step].sum())
+            return count
+
+    def violation_sum(self, b):
+        """Sum of v(a, b) over all neighborhood embeddings; blocks that b
+        cannot violate (upper bound 0) are skipped."""
+        with torch.no_grad():
+            b = b.float().view(1, -1)
+            _, v_hi = self.bounds(b)
+            pending = (v_hi > 0).nonzero().view(-1).tolist()
+            if not pending:
+                return 0.0
+            return self._violation(self._rows(pending), b).sum().item()
@@ -0,0 +1,318 @@
+"""Bounded store of pattern instances for MCTS.
+
+The search only needs, per state (WL hash), how often it was reached and a
+few representative instances to output. PatternInstanceStore keeps the
+per-state counts exactly and a reservoir sample of `reservoir_size`
+instances per state, encoded compactly (the dataset graph index and the
+node ids, anchor first). Instances held in memory are bounded by
+a byte budget: when it is exceeded, the oldest ones are appended to an
+on-disk spill log and read back only if sampled.
+
+BoundedPatternCounts is the greedy counterpart: per pattern class a count,
+best score and one instance, with the least counted classes evicted when a
+byte budget is exceeded.
+
+TrialAggregator merges greedy trial results as they arrive: exact counts
+per pattern class, a few representative instances per class and the best
+scored classes per size, independent of the order trials complete in.
+"""
+from collections import deque
+import heapq
+import pickle
+import random
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+DEFAULT_RESERVOIR_SIZE = 8
+
+_HEADER = struct.Struct("<IIB")   # graph_idx, n_nodes, flags
+_PICKLED = 1
+
+
+def encode_instance(graph_idx, nodes):
+    """Compact bytes encoding of a pattern instance: the index of its dataset
+    graph and its node ids, anchor first.
+
+    Integer node ids are stored as an int64 array, others pickled.
+    """
+    nodes = list(nodes)
+    if all(isinstance(v, (int, np.integer)) for v in nodes):
+        flags, body = 0, np.asarray(nodes, dtype=np.int64).tobytes()
+    else:
+        flags, body = _PICKLED, pickle.dumps(nodes)
+    return _HEADER.pack(graph_idx, len(nodes), flags) + body
+
+
+def pattern_size(record):
+    return _HEADER.unpack_from(record)[1]
+
+
+def decode_instance(record):
+    """Inverse of encode_instance: (graph_idx, node ids)."""
+    graph_idx, n_nodes, flags = _HEADER.unpack_from(record)
+    if flags & _PICKLED:
+        return graph_idx, pickle.loads(record[_HEADER.size:])
+    return graph_idx, np.frombuffer(record, dtype=np.int64, count=n_nodes,
+        offset=_HEADER.size).tolist()
+
+
+class PatternInstanceStore:
+    """ Exact per-key counts plus a reservoir of representative instances.
+
+    Args:
+        byte_budget: maximum number of bytes of instances held in memory.
+        spill_path: file the spill log is written to; a temporary file
+            (removed on close) if None. Opened on the first spill.
+        reservoir_size: number of instances kept per key.
+    """
+    def __init__(self, byte_budget, spill_path=None,
+        reservoir_size=DEFAULT_RESERVOIR_SIZE):
+        self.byte_budget = byte_budget
+        self.spill_path = spill_path
+        self.reservoir_size = reservoir_size
+        self.counts = {}
+        self.sizes = {}
+        self.reservoirs = {}     # key -> list of bytes or (offset, length)
+        self.order = deque()     # in-memory instances, oldest first
+        self.n_bytes = 0
+        self.n_in_memory = 0
+        self.spill_file = None
+        self.n_spilled = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def items(self):
+        return self.counts.items()
+
+    def size(self, key):
+        """Number of nodes of the instances of key."""
+        return self.sizes[key]
+
+    def add(self, key, graph_idx, nodes):
+        """Counts the instance on nodes (anchor first) of dataset graph
+        graph_idx."""
+        self.add_record(key, encode_instance(graph_idx, nodes))
+
+    def add_record(self, key, record):
+        """Counts an encoded instance of key and keeps it with reservoir
+        sampling."""
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count == 1:
+            self.sizes[key] = pattern_size(record)
+            self.reservoirs[key] = []
+        reservoir = self.reservoirs[key]
+        if len(reservoir) < self.reservoir_size:
+            slot = len(reservoir)
+            reservoir.append(None)
+        else:
+            slot = random.randrange(count)
+            if slot >= self.reservoir_size:
+                return
+            if isinstance(reservoir[slot], bytes):
+                self.n_bytes -= sys.getsizeof(reservoir[slot])
+                self.n_in_memory -= 1
+        reservoir[slot] = record
+        self.order.append((key, slot, record))
+        self.n_bytes += sys.getsizeof(record)
+        self.n_in_memory += 1
+        while self.n_bytes > self.byte_budget and self.order:
+            self._spill(*self.order.popleft())
+        if len(self.order) > 2 * self.n_in_memory + 64:
+            # drop entries of replaced instances so they can be freed
+            self.order = deque(e for e in self.order if
+                self.reservoirs[e[0]][e[1]] is e[2])
+
+    def _spill(self, key, slot, record):
+        reservoir = self.reservoirs[key]
+        if reservoir[slot] is not record:
+            return   # already replaced in the reservoir
+        if self.spill_file is None:
+            self.spill_file = (open(self.spill_path, "w+b") if
+                self.spill_path is not None else tempfile.TemporaryFile())
+        self.spill_file.seek(0, 2)
+        reservoir[slot] = (self.spill_file.tell(), len(record))
+        self.spill_file.write(record)
+        self.n_bytes -= sys.getsizeof(record)
+        self.n_in_memory -= 1
+        self.n_spilled += 1
+
+    def _load(self, entry):
+        if isinstance(entry, bytes):
+            return entry
+        offset, length = entry
+        self.spill_file.seek(offset)
+        return self.spill_file.read(length)
+
+    def sample_record(self, key):
+        """A random kept instance of key, encoded."""
+        return self._load(random.choice(self.reservoirs[key]))
+
+    def sample(self, key):
+        """A random kept instance of key as (graph_idx, node ids)."""
+        return decode_instance(self.sample_record(key))
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+class BoundedPatternCounts:
+    """ Per-size pattern counts and best scores under a byte budget.
+
+    Every tracked pattern class (keyed by WL hash) keeps a count, its best
+    (lowest) score and one representative instance (a
+    common.pattern.CompactPattern). When the
+    budget is exceeded, the class with the lowest count is evicted and a new
+    class takes over its count (Space-Saving), so frequent classes are
+    retained and counts are overestimated by at most the evicted count.
+
+    Args:
+        byte_budget: approximate maximum number of bytes held.
+    """
+    ENTRY_BYTES = 320   # dict/heap/list/pattern overhead of one class
+    NODE_BYTES = 48     # node id and adjacency row of one pattern node
+
+    def __init__(self, byte_budget):
+        self.byte_budget = byte_budget
+        self.entries = {}      # key -> [count, best score, pattern]
+        self.heap = []         # (count, seq, key), lazily updated
+        self.n_bytes = 0
+        self.n_pushed = 0
+        self.n_evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _entry_bytes(self, pattern):
+        return self.ENTRY_BYTES + self.NODE_BYTES * len(pattern)
+
+    def _push(self, key, count):
+        self.n_pushed += 1
+        heapq.heappush(self.heap, (count, self.n_pushed, key))
+
+    def add(self, key, score, pattern):
+        """Counts one instance of the pattern class key."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[0] += 1
+            if score < entry[1]:
+                entry[1] = score
+                entry[2] = pattern
+            return
+        count = 1
+        while (self.entries and self.n_bytes + self._entry_bytes(pattern) >
+            self.byte_budget):
+            min_count, _, min_key = heapq.heappop(self.heap)
+            min_entry = self.entries.get(min_key)
+            if min_entry is None:
+                continue
+            if min_entry[0] != min_count:
+                self._push(min_key, min_entry[0])   # stale heap entry
+                continue
+            del self.entries[min_key]
+            self.n_bytes -= self._entry_bytes(min_entry[2])
+            self.n_evicted += 1
+            count = min_count + 1
+        self.entries[key] = [count, score, pattern]
+        self.n_bytes += self._entry_bytes(pattern)
+        self._push(key, count)
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(e[0], i, k) for i, (k, e) in enumerate(
+                self.entries.items())]
+            heapq.heapify(self.heap)
+
+    def max_count(self):
+        return max((e[0] for e in self.entries.values()), default=0)
+
+    def top_counts(self, k):
+        """[(count, score, pattern)] of the k most counted classes."""
+        return heapq.nlargest(k, (tuple(e) for e in self.entries.values()),
+            key=lambda e: e[0])
+
+    def top_scores(self, k):
+        """[(count, score, pattern)] of the k best scored classes."""
+        return heapq.nsmallest(k, (tuple(e) for e in self.entries.values()),
+            key=lambda e: e[1])
+
+
+class TrialAggregator:
+    """ Streaming aggregate of greedy search trials.
+
+    Trials report records (size, key, score, pattern), one per pattern size
+    they reached, with pattern a common.pattern.CompactPattern. Per size and
+    key (WL hash) this keeps the
+    exact count and a bottom-k sample of `reservoir_size` instances, with
+    priorities derived from the trial index; per size it keeps the `k` keys
+    with the best (lowest) score. The result does not depend on the order
+    trials are added in.
+
+    Args:
+        k: number of best scored keys kept per size.
+        reservoir_size: number of instances kept per key.
+        seed: salt of the sampling priorities.
+    """
+    def __init__(self, k, reservoir_size=DEFAULT_RESERVOIR_SIZE, seed=None):
+        self.k = k
+        self.reservoir_size = reservoir_size
+        self.seed = seed or 0
+        self.counts = {}       # size -> {key: count}
+        self.reservoirs = {}   # (size, key) -> max-heap [(-priority, inst)]
+        self.best = {}         # size -> {key: (score, trial_idx, pattern)}
+
+    def _priority(self, trial_idx):
+        return random.Random((self.seed << 32) + trial_idx).random()
+
+    def add(self, trial_idx, records):
+        priority = self._priority(trial_idx)
+        for size, key, score, instance in records:
+            counts = self.counts.setdefault(size, {})
+            counts[key] = counts.get(key, 0) + 1
+
+            reservoir = self.reservoirs.setdefault((size, key), [])
+            if len(reservoir) < self.reservoir_size:
+                heapq.heappush(reservoir, (-priority, trial_idx, instance))
+            elif priority < -reservoir[0][0]:
+                heapq.heapreplace(reservoir, (-priority, trial_idx, instance))
+
+            # keys with the k lowest best scores, ties broken by trial index
+            best = self.best.setdefault(size, {})
+            entry = (score, trial_idx, instance)
+            if key in best:
+                if entry < best[key]:
+                    best[key] = entry
+            elif len(best) < self.k:
+                best[key] = entry
+            else:
+                worst = max(best, key=best.get)
+                if entry < best[worst]:
+                    del best[worst]
+                    best[key] = entry
+
+    def max_count(self, size):
+        return max(self.counts.get(size, {}).values(), default=0)
+
+    def top_counts(self, size, k):
+        """The k most counted keys of the size, ties broken by key."""
+        return heapq.nsmallest(k, self.counts.get(size, {}).items(),
+            key=lambda x: (-x[1], x[0]))
+
+    def top_scores(self, size):
+        """[(key, (score, trial_idx, pattern))] of the best scored keys,
+        best first."""
+        return sorted(self.best.get(size, {}).items(), key=lambda x: x[1])
+
+    def sample(self, size, key, rng=random):
+        """A kept instance (pattern) of the key."""
+        return rng.choice(sorted(self.reservoirs[size, key]))[2]
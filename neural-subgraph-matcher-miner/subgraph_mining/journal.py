@@ -0,0 +1,131 @@
+"""Append-only journal of search trials, for resuming interrupted runs.
+
+The first record holds the run header: the settings the run depends on, the
+trial seed, and the sampled neighborhoods and their embeddings (so a resumed
+run scores against exactly the same ones). Every following record is the
+result of one trial, keyed by trial index, and is flushed to disk when the
+trial completes. A run that finishes appends a completion record. Records
+are length-prefixed and checksummed; a record cut off by a crash is dropped
+when the journal is reopened.
+
+The header also holds the size and SHA-1 of the dataset and model files, so
+a journal is not resumed after the checkpoint is retrained or the dataset
+regenerated at the same path.
+"""
+import hashlib
+import os
+import pickle
+import struct
+import zlib
+
+_RECORD = struct.Struct("<QI")   # payload length, crc32 of payload
+
+# settings that must match for a journal to be resumed
+HEADER_ARGS = ("dataset", "model_path", "method_type", "graph_type",
+    "node_anchored", "search_strategy", "min_pattern_size",
+    "max_pattern_size", "sample_method", "n_neighborhoods",
+    "min_neighborhood_size", "max_neighborhood_size", "radius",
+    "subgraph_sample_size", "use_whole_graphs", "seed_scheme", "precision",
+    "inference_backend", "incremental_embedding", "emb_index_leaf_size")
+# files whose contents must match
+HEADER_FILES = ("dataset", "model_path")
+
+COMPLETE = "complete"   # key of the completion record
+
+CHUNK_BYTES = 1 << 24
+
+
+def file_fingerprint(path):
+    """(size, SHA-1) of the file at path, or None if it is not a file (e.g.
+    a dataset name)."""
+    if not path or not os.path.isfile(path):
+        return None
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_BYTES), b""):
+            h.update(block)
+    return os.path.getsize(path), h.hexdigest()
+
+
+def run_config(args):
+    config = {k: getattr(args, k, None) for k in HEADER_ARGS}
+    config["files"] = {k: file_fingerprint(getattr(args, k, None))
+        for k in HEADER_FILES}
+    return config
+
+
+class TrialJournal:
+    """ Journal file of one search run.
+
+    Use TrialJournal.create to start a run and TrialJournal.resume to reopen
+    it; `header` is the header dict and `trials` maps the index of every
+    completed trial to its result. `completed` is set once the run finished
+    (see complete); such a journal has nothing left to resume.
+    """
+    def __init__(self, path, f, header, trials, completed=False):
+        self.path = path
+        self.f = f
+        self.header = header
+        self.trials = trials
+        self.completed = completed
+
+    @classmethod
+    def create(cls, path, header):
+        f = open(path, "wb")
+        journal = cls(path, f, header, {})
+        journal._write(header)
+        return journal
+
+    @classmethod
+    def resume(cls, path, args):
+        """Reopens the journal at path for appending, checking that it was
+        written with the same settings as args."""
+        f = open(path, "r+b")
+        records, end = [], 0
+        while True:
+            prefix = f.read(_RECORD.size)
+            if len(prefix) < _RECORD.size:
+                break
+            length, crc = _RECORD.unpack(prefix)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append(pickle.loads(payload))
+            end = f.tell()
+        if not records:
+            f.close()
+            raise ValueError(f"{path} has no header record")
+        # drop a partially written record
+        f.truncate(end)
+        f.seek(end)
+        header, trials = records[0], dict(records[1:])
+        completed = trials.pop(COMPLETE, None) is not None or \
+            len(trials) >= args.n_trials
+        config = run_config(args)
+        if header["config"] != config:
+            f.close()
+            changed = sorted(k for k in set(config) | set(header["config"])
+                if config.get(k) != header["config"].get(k))
+            raise ValueError(f"{path} was written with different settings or "
+                f"files ({', '.join(changed)}); remove it or drop --resume")
+        if not completed:
+            print(f"Resuming from {path}: {len(trials)} completed trials")
+        return cls(path, f, header, trials, completed)
+
+    def _write(self, record):
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        self.f.write(_RECORD.pack(len(payload), zlib.crc32(payload)))
+        self.f.write(payload)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def append(self, trial_idx, result):
+        self._write((trial_idx, result))
+
+    def complete(self):
+        """Records that the run finished."""
+        self._write((COMPLETE, None))
+        self.completed = True
+
+    def close(self):
+        self.f.close()
@@ -0,0 +1,200 @@
+"""Incremental statistics for MCTS pattern search.
+
+States (seed tuples and WL hashes of patterns) are interned to dense integer
+ids; per-state totals are kept in flat lists and updated on backpropagation,
+so reading the visit count or mean value of a state is O(1) instead of a sum
+over all of its outgoing actions.
+
+For parallel search, tables are exchanged between processes as deltas keyed
+by state key (ids are local to a table), and simulations in flight are
+penalized through a shared virtual loss table.
+"""
+import ctypes
+import heapq
+import math
+import multiprocessing as mp
+import zlib
+
+VIRTUAL_LOSS = 1.0          # value charged per simulation in flight
+VIRTUAL_LOSS_SLOTS = 1 << 16
+
+
+class MCTSStats:
+    """ Transposition table of MCTS statistics keyed by interned state id.
+
+    For every state:
+        out_visits: number of times an action was taken from the state
+        out_values: summed value of those actions
+        in_visits: number of times an action led to the state
+    """
+    def __init__(self):
+        self.state_ids = {}
+        self.keys = []
+        self.out_visits = []
+        self.out_values = []
+        self.in_visits = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def intern(self, key):
+        """Integer id of a state key (a seed tuple or a WL hash)."""
+        sid = self.state_ids.get(key)
+        if sid is None:
+            sid = len(self.keys)
+            self.state_ids[key] = sid
+            self.keys.append(key)
+            self.out_visits.append(0)
+            self.out_values.append(0.0)
+            self.in_visits.append(0)
+        return sid
+
+    def visits(self, sid, pending=0):
+        return self.out_visits[sid] + pending
+
+    def q_value(self, sid, pending=0):
+        """Mean action value, with `pending` simulations in flight counted as
+        visits of value -VIRTUAL_LOSS."""
+        return ((self.out_values[sid] - pending * VIRTUAL_LOSS) /
+            ((self.out_visits[sid] + pending) or 1))
+
+    def record(self, path, value):
+        """Backpropagates `value` along a path of state ids."""
+        for parent, child in zip(path, path[1:]):
+            self.out_visits[parent] += 1
+            self.out_values[parent] += value
+            self.in_visits[child] += 1
+
+    def count_visit(self, sid):
+        """Counts a visit of a state reached outside of a recorded path."""
+        self.in_visits[sid] += 1
+
+    def snapshot(self):
+        return (len(self.keys), list(self.out_visits), list(self.out_values),
+            list(self.in_visits))
+
+    def delta(self, snapshot):
+        """Changes since `snapshot` as a list of
+        (key, out_visits, out_values, in_visits)."""
+        n, out_visits, out_values, in_visits = snapshot
+        changes = []
+        for sid, key in enumerate(self.keys):
+            if sid < n:
+                d = (self.out_visits[sid] - out_visits[sid],
+                    self.out_values[sid] - out_values[sid],
+                    self.in_visits[sid] - in_visits[sid])
+            else:
+                d = (self.out_visits[sid], self.out_values[sid],
+                    self.in_visits[sid])
+            if any(d):
+                changes.append((key,) + d)
+        return changes
+
+    def merge(self, changes, sign=1):
+        """Adds (or with sign=-1, subtracts) a delta. Returns the ids of the
+        changed states."""
+        sids = []
+        for key, out_visits, out_values, in_visits in changes:
+            sid = self.intern(key)
+            self.out_visits[sid] += sign * out_visits
+            self.out_values[sid] += sign * out_values
+            self.in_visits[sid] += sign * in_visits
+            sids.append(sid)
+        return sids
+
+
+def combine(deltas):
+    """Sums several deltas into one."""
+    total = {}
+    for changes in deltas:
+        for key, out_visits, out_values, in_visits in changes:
+            t = total.setdefault(key, [0, 0.0, 0])
+            t[0] += out_visits
+            t[1] += out_values
+            t[2] += in_visits
+    return [(key,) + tuple(t) for key, t in total.items()]
+
+
+class VirtualLoss:
+    """ Number of simulations in flight through each state, shared by all
+    worker processes of a parallel search.
+
+    Keys are hashed (stably across processes) into a fixed number of slots;
+    a collision only penalizes an unrelated state while it lasts.
+    """
+    def __init__(self, n_slots=VIRTUAL_LOSS_SLOTS):
+        self.counts = mp.Array(ctypes.c_int, n_slots)
+
+    def _slot(self, key):
+        if not isinstance(key, bytes):
+            key = repr(key).encode()
+        return zlib.crc32(key) % len(self.counts)
+
+    def add(self, key, n=1):
+        with self.counts.get_lock():
+            self.counts[self._slot(key)] += n
+
+    def get(self, key):
+        return max(0, self.counts[self._slot(key)])
+
+
+class UCTSeedQueue:
+    """ Seed states ordered for UCT selection.
+
+    The UCT score of a seed, q + c_uct * sqrt(log(n) / visits), depends on the
+    simulation number n only through a factor shared by all seeds with the
+    same visit count. Seeds are therefore grouped by visit count, each group a
+    max-heap on q (with lazily discarded stale entries), and the best seed is
+    the best group head: O(#distinct visit counts) instead of O(#seeds).
+    """
+    def __init__(self, c_uct):
+        self.c_uct = c_uct
+        self.groups = {}
+        self.current = {}
+        self.n_pushed = 0
+
+    def __len__(self):
+        return len(self.current)
+
+    def update(self, seed, visits, q_value):
+        """Inserts a seed or refreshes its statistics."""
+        n = visits or 1
+        self.n_pushed += 1
+        self.current[seed] = self.n_pushed
+        heapq.heappush(self.groups.setdefault(n, []),
+            (-q_value, self.n_pushed, seed))
+
+    def best(self, log_n, pending=None):
+        """(score, seed) of the seed with the highest UCT score, or
+        (-inf, None) if there are no seeds.
+
+        `pending` optionally maps a seed to its number of simulations in
+        flight, which are scored with virtual loss. Penalized seeds are
+        popped until the first unpenalized one, which bounds the rest of
+        its group, and pushed back afterwards.
+        """
+        best_score, best_seed = -float("inf"), None
+        for n in list(self.groups):
+            heap = self.groups[n]
+            popped = []
+            while heap:
+                neg_q, seq, seed = heap[0]
+                if self.current[seed] != seq:
+                    heapq.heappop(heap)
+                    continue
+                k = pending(seed) if pending is not None else 0
+                if k:
+                    score = ((-neg_q * n - k * VIRTUAL_LOSS) / (n + k) +
+                        self.c_uct * math.sqrt(log_n / (n + k)))
+                else:
+                    score = -neg_q + self.c_uct * math.sqrt(log_n / n)
+                if score > best_score:
+                    best_score, best_seed = score, seed
+                if not k:
+                    break
+                popped.append(heapq.heappop(heap))
+            for entry in popped:
+                heapq.heappush(heap, entry)
+            if not heap:
+                del self.groups[n]
+        return best_score, best_seed
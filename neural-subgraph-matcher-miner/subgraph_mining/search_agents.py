@@ -1,47 +1,33 @@
-import argparse
-import csv
-from itertools import combinations
 import time
 import os
+import queue
+import traceback
 
-from deepsnap.batch import Batch
 import numpy as np
 import torch
-import torch.optim as optim
-import torch.nn as nn
-import torch.nn.functional as F
 from tqdm import tqdm
 
-import torch_geometric.utils as pyg_utils
-
-import torch_geometric.nn as pyg_nn
-from matplotlib import cm
-
-from common import data
-from common import models
+from common import inference
 from common import utils
-from common import combined_syn
-from subgraph_mining.config import parse_decoder
-from subgraph_matching.config import parse_encoder
-
-import matplotlib.pyplot as plt
+from common.pattern import CompactPattern
+from common.seed_sampler import SeedSampler
+from subgraph_mining import dominance_index
+from subgraph_mining import mcts_stats
+from subgraph_mining.instance_store import BoundedPatternCounts, \
+    PatternInstanceStore, TrialAggregator
 
 import random
-from scipy.io import mmread
-import scipy.stats as stats
-from sklearn.manifold import TSNE
-from sklearn.cluster import KMeans, AgglomerativeClustering
 from collections import defaultdict
-from itertools import permutations
-from queue import PriorityQueue
-import matplotlib.colors as mcolors
+from contextlib import closing
 import networkx as nx
 import pickle
 import torch.multiprocessing as mp
 mp.set_start_method('spawn', force=True)
-from sklearn.decomposition import PCA
-from functools import lru_cache
-import torch.nn as nn
+
+SCORE_CHUNK_ELEMS = 1 << 24   # elements of the batched scoring intermediate
+WARM_POOL_WINDOW = 4   # trials in flight per process of a shared pool
+WORKER_POLL_SECONDS = 1.0   # MCTS workers are checked for liveness this often
+
 class SearchAgent:
     """ Class for search strategies to identify frequent subgraphs in embedding space.
 
@@ -53,7 +39,7 @@ class SearchAgent:
     """
     def __init__(self, min_pattern_size, max_pattern_size, model, dataset,
         embs, node_anchored=False, analyze=False, model_type="order",
-        out_batch_size=20):
+        out_batch_size=20, engine=None, emb_index=None, seed_sampler=None):
         """ Subgraph pattern search by walking in embedding space.
 
         Args:
@@ -69,6 +55,13 @@ class SearchAgent:
             model_type: type of the subgraph matching model (requires to be consistent with the model parameter).
             out_batch_size: the number of frequent subgraphs output by the mining algorithm for each size.
                 They are predicted to be the out_batch_size most frequent subgraphs in the dataset.
+            engine: common.inference engine used to embed candidate patterns; defaults to
+                eager inference with model.emb_model.
+            emb_index: optional dominance_index.DominanceIndex over embs, used to score
+                candidates without scanning every neighborhood embedding.
+            seed_sampler: common.seed_sampler.SeedSampler over dataset that seed nodes are
+                drawn from; defaults to uniform sampling of the nodes that reach at least
+                min_pattern_size nodes.
         """
         self.min_pattern_size = min_pattern_size
         self.max_pattern_size = max_pattern_size
@@ -79,6 +72,62 @@ class SearchAgent:
         self.analyze = analyze
         self.model_type = model_type
         self.out_batch_size = out_batch_size
+        self.engine = engine if engine is not None else \
+            inference.EagerEngine(model)
+        self.emb_index = emb_index
+        self.index_threshold = (dominance_index.order_threshold(model) if
+            emb_index is not None and model_type == "order" else None)
+        self.use_fp16 = False
+        self.seed_sampler = seed_sampler if seed_sampler is not None else \
+            SeedSampler(dataset, min_reachable=min_pattern_size)
+
+    def _half_tensor(self, tensor):
+        """Convert tensor to half precision if use_fp16 is set."""
+        return tensor.half() if self.use_fp16 else tensor
+
+    def _score_embeddings(self, embs):
+        """Scores of a batch of pattern embeddings (one row each) against the
+        neighborhood embeddings, vectorized over the batch."""
+        with torch.no_grad():
+            if self.use_fp16:
+                embs = self._half_tensor(embs)
+                
+            if self.index_threshold is not None and not self.use_fp16:
+                return [-self.emb_index.count_below(emb, self.index_threshold)
+                    / max(1, len(self.emb_index)) for emb in embs]
+            
+            scores = torch.zeros(len(embs), dtype=torch.float64,
+                device=embs.device)
+            n_embs = 0
+            for emb_batch in self.embs:
+                n_embs += len(emb_batch)
+                if self.use_fp16:
+                    emb_batch = self._half_tensor(emb_batch)
+                emb_batch = emb_batch.to(utils.get_device())
+                # bound the (batch x candidates x dim) intermediate
+                chunk = max(1, SCORE_CHUNK_ELEMS // max(1, emb_batch.numel()))
+                for i in range(0, len(embs), chunk):
+                    cands = embs[i:i+chunk]
+                    n = len(cands)
+                    if self.model_type == "order":
+                        pred = torch.sum(torch.clamp(cands.unsqueeze(0) -
+                            emb_batch.unsqueeze(1), min=0)**2, dim=-1)
+                        pred = pred.reshape(-1, 1)
+                        if self.use_fp16:
+                            pred = pred.float()
+                        pos = torch.argmax(self.model.clf_model(pred), axis=1)
+                        scores[i:i+n] -= pos.view(-1, n).sum(dim=0).double()
+                    elif self.model_type == "mlp":
+                        pred = self.model(
+                            emb_batch.repeat_interleave(n, dim=0),
+                            cands.repeat(len(emb_batch), 1))
+                        if self.use_fp16:
+                            pred = pred.float()
+                        scores[i:i+n] += pred[:, 0].view(-1, n).sum(
+                            dim=0).double()
+            
+            # Normalize by number of embeddings
+            return (scores / max(1, n_embs)).tolist()
 
     def run_search(self, n_trials=1000): 
         self.cand_patterns = defaultdict(list)
@@ -104,178 +153,324 @@ class SearchAgent:
 class MCTSSearchAgent(SearchAgent):
     def __init__(self, min_pattern_size, max_pattern_size, model, dataset,
         embs, node_anchored=False, analyze=False, model_type="order",
-        out_batch_size=20, c_uct=0.7):
+        out_batch_size=20, c_uct=0.7, engine=None, emb_index=None,
+        n_workers=1, sync_interval=25, memory_limit=1000000,
+        spill_path=None, seed_sampler=None):
         """ MCTS implementation of the subgraph pattern search.
         Uses MCTS strategy to search for the most common pattern.
 
         Args:
             c_uct: the exploration constant used in UCT criteria (See paper).
+            n_workers: number of worker processes. With more than one, each
+                worker runs simulations on its own copy of the search tree
+                (root parallelization), using virtual loss to steer away
+                from states other workers are exploring.
+            sync_interval: number of simulations each worker runs between
+                merges of the workers' statistics.
+            memory_limit: byte budget of the pattern instances kept in memory
+                to output; older instances are spilled to disk.
+            spill_path: file for spilled instances (a temporary file if None).
         """
         super().__init__(min_pattern_size, max_pattern_size, model, dataset,
             embs, node_anchored=node_anchored, analyze=analyze,
-            model_type=model_type, out_batch_size=out_batch_size)
+            model_type=model_type, out_batch_size=out_batch_size,
+            engine=engine, emb_index=emb_index, seed_sampler=seed_sampler)
         self.c_uct = c_uct
+        self.n_workers = n_workers
+        self.sync_interval = sync_interval
+        self.memory_limit = memory_limit
+        self.spill_path = spill_path
         assert not analyze
 
+    def __getstate__(self):
+        # workers get a copy of the agent, without the process handles
+        state = self.__dict__.copy()
+        for k in ("workers", "task_queues", "result_queue", "counts",
+            "cand_patterns", "instances"):
+            state.pop(k, None)
+        return state
+
     def init_search(self):
-        self.wl_hash_to_graphs = defaultdict(list)
-        self.cum_action_values = defaultdict(lambda: defaultdict(float))
-        self.visit_counts = defaultdict(lambda: defaultdict(float))
+        self.instances = PatternInstanceStore(self.memory_limit,
+            self.spill_path)   # state id -> pattern instances
+        self.stats = mcts_stats.MCTSStats()
+        self.seed_queue = mcts_stats.UCTSeedQueue(self.c_uct)
         self.visited_seed_nodes = set()
         self.max_size = self.min_pattern_size
+        self.virtual_loss = None
+        if self.n_workers > 1:
+            self.virtual_loss = mcts_stats.VirtualLoss()
+            self.merged = []
+            self.task_queues = [mp.Queue() for _ in range(self.n_workers)]
+            self.result_queue = mp.Queue()
+            self.workers = [mp.Process(target=run_mcts_worker, args=(self,
+                worker_id, self.task_queues[worker_id], self.result_queue),
+                daemon=True) for worker_id in range(self.n_workers)]
+            print(f"Starting {self.n_workers} MCTS worker processes...")
+            for worker in self.workers:
+                worker.start()
+
+    def _state_key(self, pattern):
+        """Compact transposition key of a pattern: its WL hash as bytes."""
+        return np.asarray(utils.wl_hash(pattern,
+            node_anchored=self.node_anchored), dtype=np.int64).tobytes()
 
     def is_search_done(self):
         return self.max_size == self.max_pattern_size + 1
 
-    def has_min_reachable_nodes(self, graph, start_node, n):
-        for depth_limit in range(n+1):
-            edges = nx.bfs_edges(graph, start_node, depth_limit=depth_limit)
-            nodes = set([v for u, v in edges])
-            if len(nodes) + 1 >= n:
-                return True
-        return False
-
     def step(self):
-        ps = np.array([len(g) for g in self.dataset], dtype=float)
-        ps /= np.sum(ps)
-        graph_dist = stats.rv_discrete(values=(np.arange(len(self.dataset)), ps))
-
         print("Size", self.max_size)
         print(len(self.visited_seed_nodes), "distinct seeds")
-        for simulation_n in tqdm(range(self.n_trials //
-            (self.max_pattern_size+1-self.min_pattern_size))):
-            # pick seed node
-            best_graph_idx, best_start_node, best_score = None, None, -float("inf")
-            for cand_graph_idx, cand_start_node in self.visited_seed_nodes:
-                state = cand_graph_idx, cand_start_node
-                my_visit_counts = sum(self.visit_counts[state].values())
-                q_score = (sum(self.cum_action_values[state].values()) /
-                    (my_visit_counts or 1))
-                uct_score = self.c_uct * np.sqrt(np.log(simulation_n or 1) /
-                    (my_visit_counts or 1))
-                node_score = q_score + uct_score
-                if node_score > best_score:
-                    best_score = node_score
-                    best_graph_idx = cand_graph_idx
-                    best_start_node = cand_start_node
-            # if existing seed beats choosing a new seed
-            if best_score >= self.c_uct * np.sqrt(np.log(simulation_n or 1)):
-                graph_idx, start_node = best_graph_idx, best_start_node
-                assert best_start_node in self.dataset[graph_idx].nodes
-                graph = self.dataset[graph_idx]
-            else:
-                found = False
-                while not found:
-                    graph_idx = np.arange(len(self.dataset))[graph_dist.rvs()]
-                    graph = self.dataset[graph_idx]
-                    start_node = random.choice(list(graph.nodes))
-                    # don't pick isolated nodes or small islands
-                    if self.has_min_reachable_nodes(graph, start_node,
-                        self.min_pattern_size):
-                        found = True
-                self.visited_seed_nodes.add((graph_idx, start_node))
-            neigh = [start_node]
-            frontier = list(set(graph.neighbors(start_node)) - set(neigh))
-            visited = set([start_node])
-            neigh_g = nx.Graph()
-            neigh_g.add_node(start_node, anchor=1)
-            cur_state = graph_idx, start_node
-            state_list = [cur_state]
-            while frontier and len(neigh) < self.max_size:
-                cand_neighs, anchors = [], []
-                for cand_node in frontier:
-                    cand_neigh = graph.subgraph(neigh + [cand_node])
-                    cand_neighs.append(cand_neigh)
-                    if self.node_anchored:
-                        anchors.append(neigh[0])
-                cand_embs = self.model.emb_model(utils.batch_nx_graphs(
-                    cand_neighs, anchors=anchors if self.node_anchored else None))
-                best_v_score, best_node_score, best_node = 0, -float("inf"), None
-                for cand_node, cand_emb in zip(frontier, cand_embs):
-                    score, n_embs = 0, 0
+        n_simulations = self.n_trials // (self.max_pattern_size + 1 -
+            self.min_pattern_size)
+        if self.n_workers > 1:
+            self._parallel_step(n_simulations)
+        else:
+            for simulation_n in tqdm(range(n_simulations)):
+                self._simulate(simulation_n)
+        self.max_size += 1
+
+    def _parallel_step(self, n_simulations):
+        """Runs the simulations of one pattern size on the worker processes,
+        in rounds of sync_interval simulations per worker. After each round
+        the workers' statistics are merged here and sent to every worker
+        with the next round."""
+        n_done = 0
+        with tqdm(total=n_simulations) as progress:
+            while n_done < n_simulations:
+                n_round = min(self.n_workers * self.sync_interval,
+                    n_simulations - n_done)
+                for worker_id, tasks in enumerate(self.task_queues):
+                    n_worker = (n_round // self.n_workers +
+                        (worker_id < n_round % self.n_workers))
+                    tasks.put((self.max_size, n_done, n_worker, self.merged))
+                deltas = []
+                for _ in range(self.n_workers):
+                    delta, examples = self._worker_result()
+                    deltas.append(delta)
+                    for key, record in examples.items():
+                        self.instances.add_record(self.stats.intern(key),
+                            record)
+                self.merged = mcts_stats.combine(deltas)
+                self._apply_delta(self.merged)
+                n_done += n_round
+                progress.update(n_round)
+
+    def _worker_result(self):
+        """The next result of the worker processes. Raises RuntimeError,
+        after terminating the workers, if a worker failed or exited."""
+        while True:
+            try:
+                result = self.result_queue.get(timeout=WORKER_POLL_SECONDS)
+            except queue.Empty:
+                dead = [w for w in self.workers if w.exitcode is not None]
+                if not dead:
+                    continue
+                result = RuntimeError("MCTS worker {} exited with code "
+                    "{}".format(dead[0].pid, dead[0].exitcode))
+            if isinstance(result, Exception):
+                for worker in self.workers:
+                    worker.terminate()
+                raise result
+            return result
+
+    def _apply_delta(self, delta, own=()):
+        """Merges statistics of other workers (delta minus this worker's own
+        share) into the local tree."""
+        self.stats.merge(own, sign=-1)
+        for sid in self.stats.merge(delta):
+            seed = self.stats.keys[sid]
+            # seed states are keyed by (graph_idx, start_node)
+            if isinstance(seed, tuple):
+                self.visited_seed_nodes.add(seed)
+                self.seed_queue.update(seed, self.stats.visits(sid),
+                    self.stats.q_value(sid))
+
+    def _simulate(self, simulation_n):
+        """Runs one simulation: picks a seed, grows a pattern from it and
+        backpropagates its value."""
+        pending = (self.virtual_loss.get if self.virtual_loss is not None else
+            None)
+        # pick seed node
+        log_n = np.log(simulation_n or 1)
+        best_score, best_seed = self.seed_queue.best(log_n, pending)
+        # if existing seed beats choosing a new seed
+        if best_score >= self.c_uct * np.sqrt(log_n):
+            graph_idx, start_node = best_seed
+            assert start_node in self.dataset[graph_idx].nodes
+            graph = self.dataset[graph_idx]
+        else:
+            # the sampler never picks isolated nodes or small islands
+            graph_idx, start_node = self.seed_sampler.sample(np.random)
+            graph = self.dataset[graph_idx]
+            self.visited_seed_nodes.add((graph_idx, start_node))
+        neigh = [start_node]
+        frontier = list(set(graph.neighbors(start_node)) - set(neigh))
+        visited = set([start_node])
+        neigh_g = nx.Graph()
+        neigh_g.add_node(start_node, anchor=1)
+        seed_state = self.stats.intern((graph_idx, start_node))
+        cur_state = seed_state
+        state_list = [cur_state]
+        in_flight = [(graph_idx, start_node)]
+        if pending is not None:
+            self.virtual_loss.add(in_flight[0])
+        pattern_state = self.engine.begin_pattern(graph, neigh)
+        while frontier and len(neigh) < self.max_size:
+            cand_embs = self.engine.embed_extensions(graph, neigh,
+                frontier, self.node_anchored, pattern_state)
+            best_v_score, best_node_score, best_node = 0, -float("inf"), None
+            for cand_node, cand_emb in zip(frontier, cand_embs):
+                score, n_embs = 0, 0
+                if self.emb_index is not None:
+                    score = self.emb_index.violation_sum(cand_emb)
+                    n_embs = len(self.emb_index)
+                else:
                     for emb_batch in self.embs:
                         score += torch.sum(self.model.predict((
                             emb_batch.to(utils.get_device()), cand_emb))).item()
                         n_embs += len(emb_batch)
-                    EPS = 1e-10  
-                    if n_embs > 0:
-                        v_score = -np.log(score/n_embs + 1) + 1
-                    else:
-                        v_score = 0  
-                    neigh_g = graph.subgraph(neigh + [cand_node]).copy()
-                    neigh_g.remove_edges_from(nx.selfloop_edges(neigh_g))
-                    for v in neigh_g.nodes:
-                        neigh_g.nodes[v]["anchor"] = 1 if v == neigh[0] else 0
-                    next_state = utils.wl_hash(neigh_g,
-                        node_anchored=self.node_anchored)
-                    # compute node score
-                    parent_visit_counts = sum(self.visit_counts[cur_state].values())
-                    my_visit_counts = sum(self.visit_counts[next_state].values())
-                    q_score = (sum(self.cum_action_values[next_state].values()) /
-                        (my_visit_counts or 1))
-                    uct_score = self.c_uct * np.sqrt(np.log(parent_visit_counts or
-                        1) / (my_visit_counts or 1))
-                    node_score = q_score + uct_score
-                    if node_score > best_node_score:
-                        best_node_score = node_score
-                        best_v_score = v_score
-                        best_node = cand_node
-                frontier = list(((set(frontier) |
-                    set(graph.neighbors(best_node))) - visited) -
-                    set([best_node]))
-                visited.add(best_node)
-                neigh.append(best_node)
-
-                # update visit counts, wl cache
-                neigh_g = graph.subgraph(neigh).copy()
+                EPS = 1e-10  
+                if n_embs > 0:
+                    v_score = -np.log(score/n_embs + 1) + 1
+                else:
+                    v_score = 0  
+                neigh_g = graph.subgraph(neigh + [cand_node]).copy()
                 neigh_g.remove_edges_from(nx.selfloop_edges(neigh_g))
                 for v in neigh_g.nodes:
                     neigh_g.nodes[v]["anchor"] = 1 if v == neigh[0] else 0
-                prev_state = cur_state
-                cur_state = utils.wl_hash(neigh_g, node_anchored=self.node_anchored)
-                state_list.append(cur_state)
-                self.wl_hash_to_graphs[cur_state].append(neigh_g)
-
-            # backprop value
-            for i in range(0, len(state_list) - 1):
-                self.cum_action_values[state_list[i]][
-                    state_list[i+1]] += best_v_score
-                self.visit_counts[state_list[i]][state_list[i+1]] += 1
-        self.max_size += 1
+                next_key = self._state_key(neigh_g)
+                next_state = self.stats.intern(next_key)
+                n_pending = pending(next_key) if pending is not None else 0
+                # compute node score
+                parent_visit_counts = self.stats.visits(cur_state)
+                my_visit_counts = self.stats.visits(next_state, n_pending)
+                q_score = self.stats.q_value(next_state, n_pending)
+                uct_score = self.c_uct * np.sqrt(np.log(parent_visit_counts or
+                    1) / (my_visit_counts or 1))
+                node_score = q_score + uct_score
+                if node_score > best_node_score:
+                    best_node_score = node_score
+                    best_v_score = v_score
+                    best_node = cand_node
+            frontier = list(((set(frontier) |
+                set(graph.neighbors(best_node))) - visited) -
+                set([best_node]))
+            pattern_state = self.engine.extend_pattern(pattern_state,
+                graph, best_node)
+            visited.add(best_node)
+            neigh.append(best_node)
+
+            # update visit counts, wl cache
+            neigh_g = graph.subgraph(neigh).copy()
+            neigh_g.remove_edges_from(nx.selfloop_edges(neigh_g))
+            for v in neigh_g.nodes:
+                neigh_g.nodes[v]["anchor"] = 1 if v == neigh[0] else 0
+            prev_state = cur_state
+            cur_key = self._state_key(neigh_g)
+            cur_state = self.stats.intern(cur_key)
+            state_list.append(cur_state)
+            self.instances.add(cur_state, graph_idx, neigh)
+            in_flight.append(cur_key)
+            if pending is not None:
+                self.virtual_loss.add(cur_key)
+
+        # backprop value
+        self.stats.record(state_list, best_v_score)
+        self.seed_queue.update((graph_idx, start_node),
+            self.stats.visits(seed_state), self.stats.q_value(seed_state))
+        if pending is not None:
+            for key in in_flight:
+                self.virtual_loss.add(key, -1)
 
     def finish_search(self):
+        if self.n_workers > 1:
+            for tasks in self.task_queues:
+                tasks.put(None)
+            for worker in self.workers:
+                worker.join()
         counts = defaultdict(lambda: defaultdict(int))
-        for _, v in self.visit_counts.items():
-            for s2, count in v.items():
-                counts[len(random.choice(self.wl_hash_to_graphs[s2]))][s2] += count
+        for s2 in self.instances:
+            if self.stats.in_visits[s2]:
+                counts[self.instances.size(s2)][s2] += self.stats.in_visits[s2]
 
         cand_patterns_uniq = []
         for pattern_size in range(self.min_pattern_size, self.max_pattern_size+1):
             for wl_hash, count in sorted(counts[pattern_size].items(), key=lambda
                 x: x[1], reverse=True)[:self.out_batch_size]:
-                cand_patterns_uniq.append(random.choice(
-                    self.wl_hash_to_graphs[wl_hash]))
+                graph_idx, nodes = self.instances.sample(wl_hash)
+                graph = self.dataset[graph_idx]
+                cand_patterns_uniq.append(CompactPattern.from_nodes(graph,
+                    graph_idx, nodes).to_networkx(graph))
                 print("- outputting", count, "motifs of size", pattern_size)
+        if self.instances.n_spilled:
+            print(self.instances.n_spilled, "pattern instances spilled to disk")
+        self.instances.close()
         return cand_patterns_uniq
-def default_dd_list():
-    return defaultdict(list)
+
+def run_mcts_worker(agent, worker_id, tasks, results):
+    """
+    Worker process of a parallel MCTS search. Each task is a round of
+    simulations on the worker's own copy of the search tree; the statistics
+    merged from all workers in the previous round are applied first, and the
+    worker's own changes plus one encoded instance per state are sent back.
+    An exception is sent back as a RuntimeError carrying its traceback.
+    """
+    seed = int.from_bytes(os.urandom(4), 'little') + worker_id
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.set_num_threads(max(1, mp.cpu_count() // agent.n_workers))
+    own = []
+    try:
+        for max_size, n_done, n_simulations, merged in iter(tasks.get, None):
+            agent.max_size = max_size
+            agent._apply_delta(merged, own)
+            snapshot = agent.stats.snapshot()
+            agent.instances = PatternInstanceStore(agent.memory_limit)
+            for i in range(n_simulations):
+                agent._simulate(n_done + i * agent.n_workers + worker_id)
+            own = agent.stats.delta(snapshot)
+            examples = {agent.stats.keys[sid]:
+                agent.instances.sample_record(sid) for sid in agent.instances}
+            agent.instances.close()
+            results.put((own, examples))
+    except Exception:
+        results.put(RuntimeError("MCTS worker {} failed:\n{}".format(
+            worker_id, traceback.format_exc())))
 
 worker_model = None
 worker_graphs = None
 worker_embs = None
 worker_args = None
+worker_engine = None
+worker_emb_index = None
+worker_threshold = None
+worker_seed = None
+worker_sampler = None
 
-def init_greedy_worker(model, graphs, embs, args):
+def init_greedy_worker(model, graphs, embs, args, engine=None,
+    emb_index=None, seed=None, seed_sampler=None):
     """
     Initializer function for each worker process in the pool.
     This runs ONCE per worker and loads the large data into its global scope.
     """
-    global worker_model, worker_graphs, worker_embs, worker_args
+    global worker_model, worker_graphs, worker_embs, worker_args, worker_engine
+    global worker_emb_index, worker_threshold, worker_seed, worker_sampler
     print(f"[{time.strftime('%H:%M:%S')}] Worker PID {os.getpid()} initializing...", flush=True)
     worker_model = model
     worker_graphs = graphs
     worker_embs = embs
     worker_args = args
+    worker_engine = engine if engine is not None else \
+        inference.EagerEngine(model)
+    worker_emb_index = emb_index
+    worker_threshold = (dominance_index.order_threshold(model) if
+        emb_index is not None and args.method_type == "order" else None)
+    worker_seed = seed
+    if getattr(args, "n_threads", 0) > 0:
+        torch.set_num_threads(args.n_threads)
+    worker_sampler = seed_sampler if seed_sampler is not None else \
+        SeedSampler(graphs, min_reachable=args.min_pattern_size)
     print(f"[{time.strftime('%H:%M:%S')}] Worker PID {os.getpid()} initialization complete.", flush=True)
 
 
@@ -284,18 +479,19 @@ def run_greedy_trial(trial_idx):
     Executes a single greedy search trial.
     It now accesses the large data from global variables, avoiding data transfer.
     """
-    global worker_model, worker_graphs, worker_embs, worker_args
+    global worker_model, worker_graphs, worker_embs, worker_args, worker_engine
+    global worker_emb_index, worker_threshold, worker_seed, worker_sampler
     
-    random.seed(int.from_bytes(os.urandom(4), 'little') + trial_idx)
-    np.random.seed(int.from_bytes(os.urandom(4), 'little') + trial_idx)
-
-    ps = np.array([len(g) for g in worker_graphs], dtype=np.float32)
-    ps /= np.sum(ps)
-    graph_dist = stats.rv_discrete(values=(np.arange(len(worker_graphs)), ps))
+    if worker_seed is None:
+        random.seed(int.from_bytes(os.urandom(4), 'little') + trial_idx)
+        np.random.seed(int.from_bytes(os.urandom(4), 'little') + trial_idx)
+    else:
+        # reproducible per trial index, e.g. for resumed runs
+        random.seed((worker_seed << 32) + trial_idx)
+        np.random.seed([worker_seed, trial_idx])
 
-    graph_idx = np.arange(len(worker_graphs))[graph_dist.rvs()]
+    graph_idx, start_node = worker_sampler.sample(np.random)
     graph = worker_graphs[graph_idx]
-    start_node = random.choice(list(graph.nodes))
 
     neigh = [start_node]
     if worker_args.graph_type == "undirected":
@@ -304,37 +500,33 @@ def run_greedy_trial(trial_idx):
         frontier = list(set(graph.successors(start_node)) - set(neigh))
     visited = {start_node}
 
-    trial_patterns = defaultdict(list)
-    trial_counts = defaultdict(default_dd_list)
+    records = []
+    pattern = CompactPattern.from_nodes(graph, int(graph_idx), neigh)
+    pattern_state = worker_engine.begin_pattern(graph, neigh)
 
     while len(neigh) < worker_args.max_pattern_size and frontier:
-        cand_neighs, anchors = [], []
-        for cand_node in frontier:
-            cand_neigh = graph.subgraph(neigh + [cand_node])
-            cand_neighs.append(cand_neigh)
-            if worker_args.node_anchored:
-                anchors.append(neigh[0])
-
-        if not cand_neighs:
-            break
-
-        with torch.no_grad():
-            cand_embs = worker_model.emb_model(utils.batch_nx_graphs(
-                cand_neighs, anchors=anchors if worker_args.node_anchored else None))
+        cand_embs = worker_engine.embed_extensions(graph, neigh, frontier,
+            worker_args.node_anchored, pattern_state)
 
         best_score = float("inf")
         best_node = None
 
         for cand_node, cand_emb in zip(frontier, cand_embs):
             score = 0
-            for emb_batch in worker_embs:
-                with torch.no_grad():
-                    if worker_args.method_type == "order":
-                        pred = worker_model.predict((emb_batch.to(utils.get_device()), cand_emb)).unsqueeze(1)
-                        score -= torch.sum(torch.argmax(worker_model.clf_model(pred), axis=1)).item()
-                    elif worker_args.method_type == "mlp":
-                        pred = worker_model(emb_batch.to(utils.get_device()), cand_emb.unsqueeze(0).expand(len(emb_batch), -1))
-                        score += torch.sum(pred[:,0]).item()
+            if worker_threshold is not None:
+                # only the count matters, and only if it beats the best so far
+                score = -worker_emb_index.count_below(cand_emb,
+                    worker_threshold, beat=None if best_node is None else
+                    -best_score)
+            else:
+                for emb_batch in worker_embs:
+                    with torch.no_grad():
+                        if worker_args.method_type == "order":
+                            pred = worker_model.predict((emb_batch.to(utils.get_device()), cand_emb)).unsqueeze(1)
+                            score -= torch.sum(torch.argmax(worker_model.clf_model(pred), axis=1)).item()
+                        elif worker_args.method_type == "mlp":
+                            pred = worker_model(emb_batch.to(utils.get_device()), cand_emb.unsqueeze(0).expand(len(emb_batch), -1))
+                            score += torch.sum(pred[:,0]).item()
 
             if score < best_score:
                 best_score = score
@@ -348,32 +540,54 @@ def run_greedy_trial(trial_idx):
         elif worker_args.graph_type == "directed":
             frontier = list(((set(frontier) | set(graph.successors(best_node))) - visited) - {best_node})      
               
+        pattern_state = worker_engine.extend_pattern(pattern_state, graph,
+            best_node)
         visited.add(best_node)
         neigh.append(best_node)
+        pattern = pattern.extend(graph, best_node)
 
         if len(neigh) >= worker_args.min_pattern_size:
-            neigh_g = graph.subgraph(neigh).copy()
-            neigh_g.remove_edges_from(nx.selfloop_edges(neigh_g))
-            for v_idx, v in enumerate(neigh_g.nodes):
-                neigh_g.nodes[v]["anchor"] = 1 if worker_args.node_anchored and v == neigh[0] else 0
-
-            trial_patterns[len(neigh_g)].append((best_score, neigh_g))
-            trial_counts[len(neigh_g)][utils.wl_hash(neigh_g, node_anchored=worker_args.node_anchored)].append(neigh_g)
+            # compact record instead of the graph: (size, key, score,
+            # pattern)
+            key = hash(pattern.wl_hash(worker_args.node_anchored))
+            records.append((len(pattern), key, best_score, pattern))
             
-    return trial_patterns, trial_counts
+    return trial_idx, records
 
 
+def run_configured_greedy_trial(task):
+    """run_greedy_trial on a pool shared by searches with different settings:
+    task is (args, seed, trial index)."""
+    global worker_args, worker_seed
+    worker_args, worker_seed, trial_idx = task
+    return run_greedy_trial(trial_idx)
+
 
 class GreedySearchAgent(SearchAgent):
     def __init__(self, min_pattern_size, max_pattern_size, model, dataset,
         embs, node_anchored=False, analyze=False, rank_method="counts",
-        model_type="order", out_batch_size=20, n_beams=1, n_workers=4):
+        model_type="order", out_batch_size=20, n_beams=1, n_workers=4,
+        engine=None, emb_index=None, convergence=None, seed=None,
+        journal=None, seed_sampler=None, coordinator=None, pool=None):
         super().__init__(min_pattern_size, max_pattern_size, model, dataset,
             embs, node_anchored=node_anchored, analyze=analyze,
-            model_type=model_type, out_batch_size=out_batch_size)
+            model_type=model_type, out_batch_size=out_batch_size,
+            engine=engine, emb_index=emb_index, seed_sampler=seed_sampler)
         self.rank_method = rank_method
         self.n_beams = n_beams
         self.n_workers = n_workers
+        # convergence.RankingConvergence: stop once the ranking is stable
+        self.convergence = convergence
+        # trial i is seeded with (seed, i) if set, so runs are reproducible
+        self.seed = seed
+        # journal.TrialJournal: completed trials are skipped, new ones added
+        self.journal = journal
+        # distributed.Coordinator: trials run on remote workers instead
+        self.coordinator = coordinator
+        # pool of n_workers processes already set up by init_greedy_worker
+        # with this model, dataset, embeddings and seed sampler (kept warm by
+        # the mining service); trials run on it with this search's args
+        self.pool = pool
         print("Rank Method:", rank_method)
         if self.n_workers > 1:
             print(f"Using {self.n_workers} worker processes for parallel search.")
@@ -381,219 +595,260 @@ class GreedySearchAgent(SearchAgent):
     def run_search(self, n_trials=1000):
         """
         Overridden run_search that uses an initializer to avoid repetitive data transfer.
+        Trial results are aggregated as they arrive, so the parent holds
+        counts and a few instances per pattern class rather than every
+        pattern found.
         """
-        self.cand_patterns = defaultdict(list)
-        self.counts = defaultdict(lambda: defaultdict(list))
+        self.aggregate = TrialAggregator(self.out_batch_size, seed=self.seed)
         self.n_trials = n_trials
 
-        init_args = (self.model, self.dataset, self.embs, self.args)
-        
-        args_for_pool = range(n_trials)
+        done = set()
+        self.n_trials_run = 0
+        converged = False
+
+        def add_result(trial_idx, records):
+            self.aggregate.add(trial_idx, records)
+            done.add(trial_idx)
+            self.n_trials_run += 1
+            return (self.convergence is not None and
+                self.convergence.update(self.n_trials_run,
+                    self.aggregate.counts))
+
+        if self.journal is not None:
+            for trial_idx in sorted(self.journal.trials):
+                if trial_idx < n_trials and not converged:
+                    converged = add_result(trial_idx,
+                        self.journal.trials[trial_idx])
+        args_for_pool = [i for i in range(n_trials) if i not in done]
 
-        print(f"Starting {n_trials} search trials on {self.n_workers} cores...")
-        with mp.Pool(processes=self.n_workers, initializer=init_greedy_worker, initargs=init_args) as pool:
-            results = list(tqdm(pool.imap_unordered(run_greedy_trial, args_for_pool), total=n_trials))
+        if args_for_pool and not converged:
+            # aggregate as trials complete; closing the results early stops
+            # the trials still running
+            with closing(self.trial_results(args_for_pool)) as results:
+                for trial_idx, records in tqdm(results,
+                    total=len(args_for_pool)):
+                    if self.journal is not None:
+                        self.journal.append(trial_idx, records)
+                    converged = add_result(trial_idx, records)
+                    if converged:
+                        break
 
-        print("Aggregating results from all worker processes...")
-        for trial_patterns, trial_counts in results:
-            for size, scored_patterns in trial_patterns.items():
-                self.cand_patterns[size].extend(scored_patterns)
-            for size, hashed_patterns in trial_counts.items():
-                for h, graphs in hashed_patterns.items():
-                    self.counts[size][h].extend(graphs)
+        if self.convergence is not None:
+            print(f"Ran {self.n_trials_run} of {n_trials} trials ("
+                f"{'ranking converged' if converged else 'not converged'}, "
+                f"stability {self.convergence.stability})")
 
         return self.finish_search()
 
+    def worker_init_args(self):
+        """Arguments of init_greedy_worker for this search."""
+        return (self.model, self.dataset, self.embs, self.args, self.engine,
+            self.emb_index, self.seed, self.seed_sampler)
+
+    def trial_results(self, trial_idxs):
+        """Yields (trial index, records) of the given trials as they
+        complete, from the coordinator's workers if distributed, else from
+        the warm pool if set, else from a new pool of n_workers
+        processes."""
+        if self.coordinator is not None:
+            print(f"Distributing {len(trial_idxs)} search trials to workers "
+                f"of {self.coordinator.address_str}...")
+            yield from self.coordinator.run(trial_idxs)
+            return
+        if self.pool is not None:
+            # a few trials in flight per process, so that closing the
+            # results early leaves little work behind on the shared pool
+            print(f"Starting {len(trial_idxs)} search trials on a warm pool "
+                f"of {self.n_workers} processes...")
+            window = WARM_POOL_WINDOW * self.n_workers
+            for i in range(0, len(trial_idxs), window):
+                yield from self.pool.imap_unordered(
+                    run_configured_greedy_trial, [(self.args, self.seed, t)
+                        for t in trial_idxs[i:i+window]])
+            return
+        print(f"Starting {len(trial_idxs)} search trials on {self.n_workers} cores...")
+        with mp.Pool(processes=self.n_workers, initializer=init_greedy_worker,
+            initargs=self.worker_init_args()) as pool:
+            yield from pool.imap_unordered(run_greedy_trial, trial_idxs)
+
     def finish_search(self):
         """
         Processes the aggregated results from all trials to find the most frequent patterns.
-        This method remains unchanged.
         """
         if self.analyze:
             pass
 
+        rng = random.Random(self.seed)
         cand_patterns_uniq = []
         for pattern_size in range(self.min_pattern_size, self.max_pattern_size + 1):
             if self.rank_method == "hybrid":
-                if self.counts[pattern_size]:
-                    cur_rank_method = "margin" if len(max(
-                        self.counts[pattern_size].values(), key=len, default=[])) < 3 else "counts"
-                else:
-                    cur_rank_method = "margin"
+                cur_rank_method = "margin" if self.aggregate.max_count(
+                    pattern_size) < 3 else "counts"
             else:
                 cur_rank_method = self.rank_method
 
             print(f"Ranking patterns of size {pattern_size} using method: '{cur_rank_method}'")
 
             if cur_rank_method == "margin":
-                wl_hashes = set()
-                cands = self.cand_patterns[pattern_size]
-                cand_patterns_uniq_size = []
-                for score, pattern in sorted(cands, key=lambda x: x[0]):
-                    wl_hash = utils.wl_hash(pattern, node_anchored=self.node_anchored)
-                    if wl_hash not in wl_hashes:
-                        wl_hashes.add(wl_hash)
-                        cand_patterns_uniq_size.append(pattern)
-                        if len(cand_patterns_uniq_size) >= self.out_batch_size:
-                            break
-                cand_patterns_uniq.extend(cand_patterns_uniq_size)
-                
+                # best scored instance of each of the best scored classes
+                instances = [pattern for _, (_, _, pattern) in
+                    self.aggregate.top_scores(pattern_size)]
             elif cur_rank_method == "counts":
-                sorted_counts = sorted(self.counts[pattern_size].items(), key=lambda x: len(x[1]), reverse=True)
-                for _, neighs in sorted_counts[:self.out_batch_size]:
-                    cand_patterns_uniq.append(random.choice(neighs))
+                instances = [self.aggregate.sample(pattern_size, key, rng)
+                    for key, _ in self.aggregate.top_counts(pattern_size,
+                        self.out_batch_size)]
             else:
                 print("Unrecognized rank method")
+                continue
+            for pattern in instances:
+                cand_patterns_uniq.append(pattern.to_networkx(
+                    self.dataset[pattern.graph_idx], self.node_anchored))
                 
         return cand_patterns_uniq
 
 class MemoryEfficientGreedyAgent(GreedySearchAgent):
+    """ Greedy search with peak memory bounded independently of n_trials.
+
+    Trials run serially in this process. Each frontier is scored in chunks
+    of batch_size candidates, and found patterns are not kept: every size
+    only keeps a count, best score and one instance (a CompactPattern) per
+    pattern class, for the most frequent classes that fit in memory_limit
+    bytes (instance_store.BoundedPatternCounts). The
+    dataset may hold graph_store.LazyGraph views, whose adjacency is read
+    from the memory-mapped store as nodes are visited.
+    """
     def __init__(self, min_pattern_size, max_pattern_size, model, dataset,
         embs, node_anchored=False, analyze=False, rank_method="counts",
-        model_type="order", out_batch_size=20, batch_size=64):
+        model_type="order", out_batch_size=20, batch_size=64, engine=None,
+        emb_index=None, memory_limit=1000000, seed_sampler=None):
         super().__init__(min_pattern_size, max_pattern_size, model, dataset,
             embs, node_anchored=node_anchored, analyze=analyze,
             rank_method=rank_method, model_type=model_type,
-            out_batch_size=out_batch_size)
+            out_batch_size=out_batch_size, n_workers=1, engine=engine,
+            emb_index=emb_index, seed_sampler=seed_sampler)
         self.batch_size = batch_size
+        self.memory_limit = memory_limit
         self.use_fp16 = torch.cuda.is_available()
-        
-    def _grow_pattern(self, graph, start_node):
+
+    def run_search(self, n_trials=1000):
+        n_sizes = self.max_pattern_size - self.min_pattern_size + 1
+        self.pattern_counts = {size: BoundedPatternCounts(
+            self.memory_limit // max(1, n_sizes)) for size in
+            range(self.min_pattern_size, self.max_pattern_size + 1)}
+        self.n_trials = n_trials
+
+        for _ in tqdm(range(n_trials)):
+            graph_idx, start_node = self.seed_sampler.sample(np.random)
+            self._grow_pattern(graph_idx, start_node)
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        return self.finish_search()
+
+    def _score_frontier(self, graph, neigh, frontier, pattern_state):
+        """Best (score, node) of the frontier, scored batch_size candidates
+        at a time."""
+        best_score, best_node = float("inf"), None
+        use_index = self.index_threshold is not None and not self.use_fp16
+        for i in range(0, len(frontier), self.batch_size):
+            batch_nodes = frontier[i:i+self.batch_size]
+            with torch.no_grad():
+                cand_embs = self.engine.embed_extensions(graph, neigh,
+                    batch_nodes, self.node_anchored, pattern_state)
+            if use_index:
+                # only the count matters, and only if it beats the best
+                for node, emb in zip(batch_nodes, cand_embs):
+                    score = -self.emb_index.count_below(emb,
+                        self.index_threshold, beat=None if best_node is None
+                        else -best_score)
+                    if score < best_score:
+                        best_score, best_node = score, node
+            else:
+                scores = self._score_embeddings(cand_embs)
+                for node, score in zip(batch_nodes, scores):
+                    if score < best_score:
+                        best_score, best_node = score, node
+        return best_score, best_node
+
+    def _grow_pattern(self, graph_idx, start_node):
+        graph = self.dataset[graph_idx]
+        nbrs = graph.successors if graph.is_directed() else graph.neighbors
         neigh = [start_node]
         visited = {start_node}
-        frontier = set(graph.neighbors(start_node))
-    
+        # insertion-ordered, so chunks are reproducible
+        frontier = dict.fromkeys(v for v in nbrs(start_node) if v not in
+            visited)
+        pattern = CompactPattern.from_nodes(graph, graph_idx, neigh)
+        pattern_state = self.engine.begin_pattern(graph, neigh)
+
         while frontier and len(neigh) < self.max_pattern_size:
-            best_score = float('inf')
-            best_node = None
-        
-            for i in range(0, len(frontier), self.batch_size):
-                batch_nodes = list(frontier)[i:i+self.batch_size]
-                cand_neighs = [graph.subgraph(neigh + [n]) for n in batch_nodes]
-                anchors = [neigh[0]] * len(cand_neighs) if self.node_anchored else None
-            
-                with torch.no_grad():
-                    cand_embs = self.model.emb_model(utils.batch_nx_graphs(
-                        cand_neighs, anchors=anchors))
-                
-                    if self.use_fp16:
-                        cand_embs = self._half_tensor(cand_embs)
-                
-                    for node, emb in zip(batch_nodes, cand_embs):
-                        score = 0
-                        for emb_batch in self.embs:
-                            if self.use_fp16:
-                                emb_batch = self._half_tensor(emb_batch)
-                            
-                            if self.model_type == "order":
-                                pred = self.model.predict((
-                                    emb_batch.to(utils.get_device()),
-                                    emb)).unsqueeze(1)
-                                if self.use_fp16:
-                                    pred = pred.float()
-                                score -= torch.sum(torch.argmax(
-                                    self.model.clf_model(pred), axis=1)).item()
-                            elif self.model_type == "mlp":
-                                pred = self.model(
-                                    emb_batch.to(utils.get_device()),
-                                    emb.unsqueeze(0).expand(len(emb_batch), -1)
-                                    )
-                                if self.use_fp16:
-                                    pred = pred.float()
-                                score += torch.sum(pred[:,0]).item()
-                                
-                        if score < best_score:
-                            best_score = score
-                            best_node = node
-        
+            best_score, best_node = self._score_frontier(graph, neigh,
+                list(frontier), pattern_state)
             if best_node is None:
                 break
-            
+
+            pattern_state = self.engine.extend_pattern(pattern_state, graph,
+                best_node)
             neigh.append(best_node)
             visited.add(best_node)
-            frontier = set((frontier | set(graph.neighbors(best_node))) - 
-                     visited - {best_node})
-            
-        if len(neigh) >= self.min_pattern_size:
-            pattern = graph.subgraph(neigh).copy()
-            pattern.remove_edges_from(nx.selfloop_edges(pattern))
-            for v in pattern.nodes:
-                pattern.nodes[v]["anchor"] = 1 if v == neigh[0] else 0
-            
-            if self.analyze:
-                emb = self.model.emb_model(utils.batch_nx_graphs(
-                    [pattern], anchors=[neigh[0]] if self.node_anchored else None)).squeeze(0)
-                self.analyze_embs.append([emb.detach().cpu().numpy()])
-            
-            self.cand_patterns[len(pattern)].append((best_score, pattern))
-            if self.rank_method in ["counts", "hybrid"]:
-                self.counts[len(pattern)][utils.wl_hash(pattern,
-                    node_anchored=self.node_anchored)].append(pattern)
-            
-            return pattern
-        return None
+            del frontier[best_node]
+            frontier.update(dict.fromkeys(v for v in nbrs(best_node) if v
+                not in visited))
+            pattern = pattern.extend(graph, best_node)
 
-    def step(self):
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-    
-        new_beam_sets = []
-        processed_graphs = set()
-        
-        for beam_set in tqdm(self.beam_sets):
-            if isinstance(beam_set, (list, tuple)) and len(beam_set) > 0:
-                if isinstance(beam_set[0], (list, tuple)):
-                    graph_idx = beam_set[0][-1]
-                else:
-                    graph_idx = beam_set[-1]
-                processed_graphs.add(graph_idx)
-            
-            patterns = []
-            try:
-                states = [beam_set] if not isinstance(beam_set[0], (list, tuple)) else beam_set
-                for state in states:
-                    if len(state) >= 5:
-                        _, neigh, frontier, visited, graph_idx = state
-                        graph = self.dataset[graph_idx]
-                        
-                        for node in list(frontier)[:self.batch_size]:
-                            pattern = self._grow_pattern(graph, node)
-                            if pattern is not None:
-                                patterns.append(pattern)
-                
-                if patterns:
-                    patterns.sort(key=len, reverse=True)
-                    new_beam_sets.append(patterns[:self.n_beams])
-                    
-            except Exception as e:
-                print(f"Error processing beam: {e}")
+            if len(neigh) >= self.min_pattern_size:
+                key = hash(pattern.wl_hash(self.node_anchored))
+                self.pattern_counts[len(neigh)].add(key, best_score, pattern)
+
+    def finish_search(self):
+        n_evicted = sum(c.n_evicted for c in self.pattern_counts.values())
+        if n_evicted:
+            print(f"{n_evicted} pattern classes evicted to stay within "
+                f"{self.memory_limit} bytes; counts are upper bounds")
+
+        cand_patterns_uniq = []
+        for pattern_size in range(self.min_pattern_size,
+            self.max_pattern_size + 1):
+            counts = self.pattern_counts[pattern_size]
+            if self.rank_method == "hybrid":
+                cur_rank_method = ("margin" if counts.max_count() < 3 else
+                    "counts")
+            else:
+                cur_rank_method = self.rank_method
+
+            print(f"Ranking patterns of size {pattern_size} using method: '{cur_rank_method}'")
+
+            if cur_rank_method == "margin":
+                top = counts.top_scores(self.out_batch_size)
+            elif cur_rank_method == "counts":
+                top = counts.top_counts(self.out_batch_size)
+            else:
+                print("Unrecognized rank method")
                 continue
+            cand_patterns_uniq.extend(pattern.to_networkx(
+                self.dataset[pattern.graph_idx]) for _, _, pattern in top)
 
-        print(f"Processing beams from {len(processed_graphs)} distinct graphs")
-        self.beam_sets = [b for b in new_beam_sets if b]
+        return cand_patterns_uniq
 
 class MemoryEfficientMCTSAgent(MCTSSearchAgent):
     """Memory-efficient MCTS implementation with legacy AMP support"""
     
     def __init__(self, min_pattern_size, max_pattern_size, model, dataset,
         embs, node_anchored=False, analyze=False, model_type="order",
-        out_batch_size=20, c_uct=0.7, memory_limit=1000000):
+        out_batch_size=20, c_uct=0.7, memory_limit=1000000, engine=None,
+        emb_index=None, n_workers=1, sync_interval=25, spill_path=None,
+        seed_sampler=None):
         super().__init__(min_pattern_size, max_pattern_size, model, dataset,
             embs, node_anchored=node_anchored, analyze=analyze,
-            model_type=model_type, out_batch_size=out_batch_size, c_uct=c_uct)
-        self.memory_limit = memory_limit
-        self.wl_hash_to_graphs = self._create_lru_cache(maxsize=10000)
+            model_type=model_type, out_batch_size=out_batch_size, c_uct=c_uct,
+            engine=engine, emb_index=emb_index, n_workers=n_workers,
+            sync_interval=sync_interval, memory_limit=memory_limit,
+            spill_path=spill_path, seed_sampler=seed_sampler)
         self.use_fp16 = torch.cuda.is_available()
         
     def _half_tensor(self, tensor):
         """Helper to convert tensor to FP16 if CUDA is available"""
         return tensor.half() if self.use_fp16 else tensor
         
-    def _create_lru_cache(self, maxsize):
-        """Create a size-limited LRU cache for storing graph patterns"""
-        from functools import lru_cache
-        return lru_cache(maxsize=maxsize)
-        
     def _stream_neighborhood(self, graph, start_node, max_nodes=1000):
         """Stream neighborhoods instead of loading all at once"""
         visited = {start_node}
@@ -622,8 +877,8 @@ class MemoryEfficientMCTSAgent(MCTSSearchAgent):
                 anchors = [list(g.nodes)[0] for g in valid_batch]
         
             with torch.no_grad():
-                embs = self.model.emb_model(utils.batch_nx_graphs(
-                    valid_batch, anchors=anchors))
+                embs = self.engine.embed_graphs(
+                    valid_batch, anchors=anchors)
                 if self.use_fp16:
                     embs = self._half_tensor(embs)
                 for emb in embs:
@@ -632,74 +887,72 @@ class MemoryEfficientMCTSAgent(MCTSSearchAgent):
         """Memory-efficient implementation of the MCTS step with FP16 support"""
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
-            
-        ps = np.array([len(g) for g in self.dataset], dtype=np.float32)
-        ps /= np.sum(ps)
-        graph_dist = stats.rv_discrete(values=(np.arange(len(self.dataset)), ps))
+        super().step()
 
-        print("Size", self.max_size)
-        print(len(self.visited_seed_nodes), "distinct seeds")
-        
-        for simulation_n in tqdm(range(self.n_trials // 
-            (self.max_pattern_size+1-self.min_pattern_size))):
-            
-            if simulation_n % 100 == 0 and torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            
-            graph_idx = np.arange(len(self.dataset))[graph_dist.rvs()]
-            graph = self.dataset[graph_idx] 
-            
-            seed_scores = []
-            for _ in range(min(10, graph.number_of_nodes())):
-                start_node = random.choice(list(graph.nodes))
-                n_reachable = sum(1 for _ in self._stream_neighborhood(
-                    graph, start_node, max_nodes=self.min_pattern_size))
-                seed_scores.append((start_node, n_reachable))
-            start_node = max(seed_scores, key=lambda x: x[1])[0]
-            
-            neigh = [start_node]
-            visited = {start_node}
-            frontier = set()
-            
-            for next_node in self._stream_neighborhood(graph, start_node):
-                if len(neigh) >= self.max_size:
-                    break
-                    
-                cand_neigh = graph.subgraph(neigh + [next_node])
-                if self.node_anchored:
-                    for v in cand_neigh.nodes:
-                        cand_neigh.nodes[v]["anchor"] = 1 if v == neigh[0] else 0
-
-                if cand_neigh.number_of_edges() > 0:
-                    try:
-                        cand_emb = next(self._batch_embeddings([cand_neigh]))
-        
-                        score = 0
-                        n_embs = 0
-                        for emb_batch in self.embs:
-                            if self.use_fp16:
-                                emb_batch = self._half_tensor(emb_batch)
-                            pred = self.model.predict((
-                                emb_batch.to(utils.get_device()), cand_emb))
-                            if self.use_fp16:
-                                pred = pred.float()
-                            score += torch.sum(pred).item()
-                            n_embs += len(emb_batch)
-            
-                        if n_embs > 0 and score/n_embs > 0.5:  
-                            neigh.append(next_node)
-                            visited.add(next_node)
-                            frontier.update(n for n in graph.neighbors(next_node) 
-                                if n not in visited)
-                    except StopIteration:
-                        pass
-                if len(neigh) >= self.min_pattern_size:
-                    pattern = graph.subgraph(neigh).copy()
-                    pattern_hash = utils.wl_hash(pattern,
-                        node_anchored=self.node_anchored)
-                    self.visit_counts[len(pattern)][pattern_hash] += 1
-                    
-            self.max_size += 1
+    def _simulate(self, simulation_n):
+        if simulation_n % 100 == 0 and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+        graph_idx, start_node = self.seed_sampler.sample(np.random)
+        graph = self.dataset[graph_idx]
+
+        neigh = [start_node]
+        visited = {start_node}
+        frontier = set()
+
+        for next_node in self._stream_neighborhood(graph, start_node):
+            if len(neigh) >= self.max_size:
+                break
+
+            cand_neigh = graph.subgraph(neigh + [next_node])
+            if self.node_anchored:
+                for v in cand_neigh.nodes:
+                    cand_neigh.nodes[v]["anchor"] = 1 if v == neigh[0] else 0
+
+            if cand_neigh.number_of_edges() > 0:
+                try:
+                    cand_emb = next(self._batch_embeddings([cand_neigh]))
+
+                    score = 0
+                    n_embs = 0
+                    for emb_batch in self.embs:
+                        if self.use_fp16:
+                            emb_batch = self._half_tensor(emb_batch)
+                        pred = self.model.predict((
+                            emb_batch.to(utils.get_device()), cand_emb))
+                        if self.use_fp16:
+                            pred = pred.float()
+                        score += torch.sum(pred).item()
+                        n_embs += len(emb_batch)
+
+                    if n_embs > 0 and score/n_embs > 0.5:  
+                        neigh.append(next_node)
+                        visited.add(next_node)
+                        frontier.update(n for n in graph.neighbors(next_node) 
+                            if n not in visited)
+                except StopIteration:
+                    pass
+            if len(neigh) >= self.min_pattern_size:
+                pattern = graph.subgraph(neigh).copy()
+                for v in pattern.nodes:
+                    pattern.nodes[v]["anchor"] = 1 if v == neigh[0] else 0
+                pattern_state = self.stats.intern(self._state_key(pattern))
+                self.stats.count_visit(pattern_state)
+                self.instances.add(pattern_state, graph_idx, neigh)
+
+
+BEAM_THREADS = 1   # fixed torch threads per beam, so results are reproducible
+
+worker_beam_agent = None
+
+def init_beam_worker(agent):
+    """Initializer of the beam search worker processes."""
+    global worker_beam_agent
+    torch.set_num_threads(BEAM_THREADS)
+    worker_beam_agent = agent
+
+def run_beam_trial(trial_idx):
+    return worker_beam_agent.run_seed_beam(trial_idx)
 
 class BeamSearchAgent(SearchAgent):
     """Beam Search implementation for subgraph pattern mining.
@@ -710,7 +963,8 @@ class BeamSearchAgent(SearchAgent):
     
     def __init__(self, min_pattern_size, max_pattern_size, model, dataset,
         embs, node_anchored=False, analyze=False, model_type="order",
-        out_batch_size=20, beam_width=5, batch_size=64):
+        out_batch_size=20, beam_width=5, batch_size=64, engine=None,
+        emb_index=None, n_workers=1, seed=0, seed_sampler=None):
         """Initialize the beam search agent.
         
         Args:
@@ -725,225 +979,228 @@ class BeamSearchAgent(SearchAgent):
             out_batch_size: Number of patterns to output for each size.
             beam_width: Number of candidates to maintain at each step.
             batch_size: Size of batches for processing embeddings.
+            engine: Inference engine used to embed patterns.
+            emb_index: Optional DominanceIndex over embs used for scoring.
+            n_workers: Number of worker processes the seed beams are
+                distributed over.
+            seed: Base random seed. Each trial (seed beam) draws from its own
+                generator seeded by (seed, trial index), so its result does
+                not depend on the number of workers.
+            seed_sampler: SeedSampler the seed nodes are drawn from.
         """
         super().__init__(min_pattern_size, max_pattern_size, model, dataset,
             embs, node_anchored=node_anchored, analyze=analyze,
-            model_type=model_type, out_batch_size=out_batch_size)
+            model_type=model_type, out_batch_size=out_batch_size,
+            engine=engine, emb_index=emb_index, seed_sampler=seed_sampler)
         self.beam_width = beam_width
         self.batch_size = batch_size
+        self.n_workers = n_workers
+        self.seed = seed
         self.use_fp16 = torch.cuda.is_available()
     
-    def _half_tensor(self, tensor):
-        """Convert tensor to half precision if CUDA is available."""
-        return tensor.half() if self.use_fp16 else tensor
-    
     def init_search(self):
         """Initialize search data structures."""
-        self.pattern_beams = {size: [] for size in range(
-            self.min_pattern_size, self.max_pattern_size + 1)}
         self.cand_patterns = defaultdict(list)
         self.pattern_counts = defaultdict(lambda: defaultdict(list))
-        self.trials_completed = 0
-        self.current_size = self.min_pattern_size
         self.analyze_embs = [] if self.analyze else None
     
-    def is_search_done(self):
-        """Check if search is complete."""
-        return self.trials_completed >= self.n_trials
+    def run_search(self, n_trials=1000):
+        """Runs n_trials independent seed beams, on worker processes if
+        n_workers > 1, and merges their patterns in trial order."""
+        self.n_trials = n_trials
+        self.init_search()
+        
+        if self.n_workers > 1:
+            print(f"Starting {n_trials} seed beams on {self.n_workers} cores...")
+            with mp.Pool(processes=self.n_workers,
+                initializer=init_beam_worker, initargs=(self,)) as pool:
+                results = list(tqdm(pool.imap(run_beam_trial, range(n_trials),
+                    chunksize=max(1, n_trials // (4 * self.n_workers))),
+                    total=n_trials))
+        else:
+            n_threads = torch.get_num_threads()
+            torch.set_num_threads(BEAM_THREADS)
+            try:
+                results = [self.run_seed_beam(trial_idx)
+                    for trial_idx in tqdm(range(n_trials))]
+            finally:
+                torch.set_num_threads(n_threads)
+        
+        for trial_beams in results:
+            for size, beam in trial_beams.items():
+                for score, pattern, pattern_hash in beam:
+                    self.cand_patterns[size].append((score, pattern))
+                    self.pattern_counts[size][pattern_hash].append(pattern)
+                    
+                    # Save embedding for analysis if needed
+                    if self.analyze:
+                        with torch.no_grad():
+                            anchors = ([[v for v in pattern.nodes if
+                                pattern.nodes[v]["anchor"] == 1][0]] if
+                                self.node_anchored else None)
+                            emb = self.engine.embed_graphs(
+                                [pattern], anchors=anchors).squeeze(0)
+                            self.analyze_embs.append(emb.detach().cpu().numpy())
+        
+        return self.finish_search()
+    
+    def __getstate__(self):
+        # workers only need the search inputs, not the aggregated results
+        state = self.__dict__.copy()
+        for k in ("cand_patterns", "pattern_counts", "counts", "analyze_embs"):
+            state.pop(k, None)
+        return state
     
     def _compute_pattern_score(self, pattern, anchor=None):
         """Compute score for a pattern using the trained model."""
         if pattern.number_of_edges() == 0:
             return float('inf')  # Invalid pattern
             
-        with torch.no_grad():
-            anchors = [anchor] if self.node_anchored and anchor else None
-            emb = self.model.emb_model(utils.batch_nx_graphs([pattern], anchors=anchors)).squeeze(0)
-            
-            if self.use_fp16:
-                emb = self._half_tensor(emb)
-                
-            score = 0
-            n_embs = 0
-            
-            for emb_batch in self.embs:
-                n_embs += len(emb_batch)
-                if self.use_fp16:
-                    emb_batch = self._half_tensor(emb_batch)
-                    
-                if self.model_type == "order":
-                    pred = self.model.predict((emb_batch.to(utils.get_device()), emb)).unsqueeze(1)
-                    if self.use_fp16:
-                        pred = pred.float()
-                    score -= torch.sum(torch.argmax(self.model.clf_model(pred), axis=1)).item()
-                elif self.model_type == "mlp":
-                    pred = self.model(
-                        emb_batch.to(utils.get_device()),
-                        emb.unsqueeze(0).expand(len(emb_batch), -1))
-                    if self.use_fp16:
-                        pred = pred.float()
-                    score += torch.sum(pred[:,0]).item()
-            
-            return score / max(1, n_embs)  # Normalize by number of embeddings
+        anchors = [anchor] if self.node_anchored and anchor is not None else None
+        emb = self.engine.embed_graphs([pattern], anchors=anchors).squeeze(0)
+        return self._score_embedding(emb)
+
+    def _score_embedding(self, emb):
+        """Score of a pattern embedding against the neighborhood embeddings."""
+        return self._score_embeddings(emb.unsqueeze(0))[0]
+
+    def _sample_seed_node(self, rng):
+        """Sample a seed node from the dataset using the generator rng."""
+        return self.seed_sampler.sample(rng)
     
-    def _sample_seed_node(self):
-        """Sample a seed node from the dataset."""
-        # Weight sampling by graph size
-        ps = np.array([len(g) for g in self.dataset], dtype=np.float32)
-        ps /= np.sum(ps)
-        graph_dist = stats.rv_discrete(values=(np.arange(len(self.dataset)), ps))
-        
-        # Sample a graph
-        graph_idx = graph_dist.rvs()
-        graph = self.dataset[graph_idx]
-        
-        # Sample node with enough neighbors
+    def _grow_patterns(self, beam):
+        """Grow patterns in the current beam by one node.
+
+        The extensions of all beam entries are collected first; isomorphic
+        extensions (same anchored WL signature) are embedded and scored only
+        once, in batches, and their score is shared by all duplicates.
+        """
         candidates = []
-        for _ in range(min(10, graph.number_of_nodes())):
-            node = random.choice(list(graph.nodes))
-            subgraph = graph.subgraph(list(nx.ego_graph(graph, node, radius=2)))
-            if subgraph.number_of_nodes() >= self.min_pattern_size:
-                candidates.append((node, subgraph.number_of_nodes()))
+        unique = {}
+        for entry_idx, (score, pattern, graph_idx, seed_node) in enumerate(
+            beam):
+            graph = self.dataset[graph_idx]
+            
+            # Find nodes that can be added to the pattern; each of them is
+            # adjacent to the pattern, so every extension adds edges. The
+            # frontier is ordered (not a set) so that ties between equal
+            # scores break the same way in every process.
+            pattern_nodes = set(pattern.nodes)
+            frontier = {}
+            for node in pattern.nodes:
+                frontier.update((n, None) for n in graph.neighbors(node)
+                    if n not in pattern_nodes)
+            
+            for node in frontier:
+                signature = utils.wl_signature(graph, list(pattern_nodes) +
+                    [node], anchor=seed_node if self.node_anchored else None)
+                if signature not in unique:
+                    unique[signature] = (entry_idx, node)
+                candidates.append((signature, entry_idx, node))
         
         if not candidates:
-            # Fallback to random node
-            return graph_idx, random.choice(list(graph.nodes))
+            return []
         
-        # Choose node with largest 2-hop neighborhood
-        node = max(candidates, key=lambda x: x[1])[0]
-        return graph_idx, node
-    
-    def _grow_patterns(self, beam):
-        """Grow patterns in the current beam by one node."""
-        new_candidates = []
+        scores = dict(zip(unique, self._score_embeddings(
+            self._embed_extensions(beam, list(unique.values())))))
         
-        for score, pattern, graph_idx, seed_node in beam:
+        # Return top-k candidates
+        best = sorted(candidates, key=lambda x: scores[x[0]])[:self.beam_width]
+        new_beam = []
+        for signature, entry_idx, node in best:
+            _, pattern, graph_idx, seed_node = beam[entry_idx]
             graph = self.dataset[graph_idx]
+            new_pattern = graph.subgraph(list(pattern.nodes) + [node]).copy()
             
-            # Find nodes that can be added to the pattern
-            pattern_nodes = set(pattern.nodes)
-            frontier = set()
-            for node in pattern_nodes:
-                frontier.update(n for n in graph.neighbors(node) if n not in pattern_nodes)
-            
-            # Process frontier nodes in batches
-            for i in range(0, len(frontier), self.batch_size):
-                batch_nodes = list(frontier)[i:i+self.batch_size]
-                
-                for node in batch_nodes:
-                    # Create new pattern with added node
-                    new_pattern_nodes = list(pattern_nodes) + [node]
-                    new_pattern = graph.subgraph(new_pattern_nodes).copy()
-                    
-                    # Skip if no new edges were added
-                    if new_pattern.number_of_edges() <= pattern.number_of_edges():
-                        continue
-                        
-                    # Set anchor if needed
-                    if self.node_anchored:
-                        for v in new_pattern.nodes:
-                            new_pattern.nodes[v]["anchor"] = 1 if v == seed_node else 0
-                    
-                    # Compute pattern score
-                    new_score = self._compute_pattern_score(new_pattern, anchor=seed_node)
-                    
-                    # Add to candidates
-                    new_candidates.append((new_score, new_pattern, graph_idx, seed_node))
+            # Set anchor if needed
+            if self.node_anchored:
+                for v in new_pattern.nodes:
+                    new_pattern.nodes[v]["anchor"] = 1 if v == seed_node else 0
+            new_beam.append((scores[signature], new_pattern, graph_idx,
+                seed_node))
+        return new_beam
+    
+    def _embed_extensions(self, beam, extensions):
+        """Embeddings of the (beam entry index, added node) extensions."""
+        by_entry = defaultdict(list)
+        for i, (entry_idx, node) in enumerate(extensions):
+            by_entry[entry_idx].append((i, node))
         
-        # Return top-k candidates
-        return sorted(new_candidates, key=lambda x: x[0])[:self.beam_width]
+        embs = [None] * len(extensions)
+        graphs, anchors, positions = [], [], []
+        for entry_idx, items in by_entry.items():
+            _, pattern, graph_idx, seed_node = beam[entry_idx]
+            graph = self.dataset[graph_idx]
+            # Seed node first: it is the anchor of the extensions
+            neigh = [seed_node] + [v for v in pattern.nodes if v != seed_node]
+            nodes = [node for _, node in items]
+            pattern_state = self.engine.begin_pattern(graph, neigh)
+            if pattern_state is not None:
+                # incremental embedding works per pattern
+                for (i, _), emb in zip(items, self.engine.embed_extensions(
+                    graph, neigh, nodes, self.node_anchored, pattern_state)):
+                    embs[i] = emb
+                continue
+            for i, node in items:
+                graphs.append(graph.subgraph(neigh + [node]))
+                anchors.append(seed_node)
+                positions.append(i)
+        
+        # Batch the remaining extensions across beam entries
+        for i in range(0, len(graphs), self.batch_size):
+            batch_embs = self.engine.embed_graphs(graphs[i:i+self.batch_size],
+                anchors=anchors[i:i+self.batch_size] if self.node_anchored
+                else None)
+            for pos, emb in zip(positions[i:i+self.batch_size], batch_embs):
+                embs[pos] = emb
+        return torch.stack(embs)
     
-    def step(self):
-        """Execute one step of beam search."""
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+    def run_seed_beam(self, trial_idx):
+        """Grows a beam from one seed node up to max_pattern_size.
         
-        # Initialize beam if needed
-        if not self.pattern_beams[self.current_size]:
-            # Sample seed nodes and create initial patterns
-            initial_beam = []
-            num_seeds = min(self.beam_width * 2, self.n_trials - self.trials_completed)
-            
-            for _ in range(num_seeds):
-                graph_idx, seed_node = self._sample_seed_node()
-                graph = self.dataset[graph_idx]
-                
-                # Create pattern from seed node and its 1-hop neighbors
-                neighbors = list(graph.neighbors(seed_node))
-                if not neighbors:
-                    continue
-                    
-                # Start with seed node and its first neighbor
-                initial_nodes = [seed_node, neighbors[0]]
-                pattern = graph.subgraph(initial_nodes).copy()
-                
-                if pattern.number_of_edges() == 0:
-                    continue
-                    
-                # Set anchor if needed
-                if self.node_anchored:
-                    for v in pattern.nodes:
-                        pattern.nodes[v]["anchor"] = 1 if v == seed_node else 0
-                
-                # Grow pattern to minimum size
-                current_pattern = pattern
-                current_nodes = set(initial_nodes)
-                
-                while len(current_nodes) < self.min_pattern_size and neighbors:
-                    # Add next neighbor
-                    next_node = neighbors.pop(0)
-                    if next_node in current_nodes:
-                        continue
-                        
-                    current_nodes.add(next_node)
-                    current_pattern = graph.subgraph(list(current_nodes)).copy()
-                    
-                    # Set anchor if needed
-                    if self.node_anchored:
-                        for v in current_pattern.nodes:
-                            current_pattern.nodes[v]["anchor"] = 1 if v == seed_node else 0
-                
-                if len(current_pattern) < self.min_pattern_size:
-                    continue
-                    
-                # Compute pattern score
-                score = self._compute_pattern_score(current_pattern, anchor=seed_node)
-                initial_beam.append((score, current_pattern, graph_idx, seed_node))
-            
-            # Sort and keep top beam_width patterns
-            self.pattern_beams[self.current_size] = sorted(
-                initial_beam, key=lambda x: x[0])[:self.beam_width]
-            self.trials_completed += len(initial_beam)
+        Returns {size: [(score, pattern, WL hash)]} with the beam of every
+        size. The result only depends on (self.seed, trial_idx).
+        """
+        rng = np.random.default_rng([self.seed, trial_idx])
+        graph_idx, seed_node = self._sample_seed_node(rng)
+        graph = self.dataset[graph_idx]
         
-        # Grow patterns
-        current_beam = self.pattern_beams[self.current_size]
-        if current_beam and self.current_size < self.max_pattern_size:
-            next_beam = self._grow_patterns(current_beam)
-            
-            if next_beam:
-                self.pattern_beams[self.current_size + 1] = next_beam
+        # Create pattern from seed node and its 1-hop neighbors
+        neighbors = list(graph.neighbors(seed_node))
+        if not neighbors:
+            return {}
         
-        # Record patterns from current beam
-        for score, pattern, graph_idx, seed_node in current_beam:
-            # Add to candidate patterns
-            self.cand_patterns[len(pattern)].append((score, pattern))
-            
-            # Track pattern counts by WL hash
-            pattern_hash = utils.wl_hash(pattern, node_anchored=self.node_anchored)
-            self.pattern_counts[len(pattern)][pattern_hash].append(pattern)
-            
-            # Save embedding for analysis if needed
-            if self.analyze:
-                with torch.no_grad():
-                    anchors = [seed_node] if self.node_anchored else None
-                    emb = self.model.emb_model(utils.batch_nx_graphs(
-                        [pattern], anchors=anchors)).squeeze(0)
-                    self.analyze_embs.append(emb.detach().cpu().numpy())
+        # Grow pattern to minimum size with the first neighbors
+        current_nodes = [seed_node]
+        for next_node in neighbors:
+            if len(current_nodes) >= self.min_pattern_size:
+                break
+            if next_node not in current_nodes:
+                current_nodes.append(next_node)
+        if len(current_nodes) < self.min_pattern_size:
+            return {}
+        current_pattern = graph.subgraph(current_nodes).copy()
+        if current_pattern.number_of_edges() == 0:
+            return {}
+        
+        # Set anchor if needed
+        if self.node_anchored:
+            for v in current_pattern.nodes:
+                current_pattern.nodes[v]["anchor"] = 1 if v == seed_node else 0
         
-        # Move to next pattern size or wrap around
-        self.current_size += 1
-        if self.current_size > self.max_pattern_size:
-            self.current_size = self.min_pattern_size
+        # Compute pattern score
+        score = self._compute_pattern_score(current_pattern, anchor=seed_node)
+        beam = [(score, current_pattern, graph_idx, seed_node)]
+        beams = {}
+        while beam:
+            size = len(beam[0][1])
+            beams[size] = [(score, pattern, utils.wl_hash(pattern,
+                node_anchored=self.node_anchored))
+                for score, pattern, _, _ in beam]
+            if size >= self.max_pattern_size:
+                break
+            beam = self._grow_patterns(beam)
+        return beams
     
     def finish_search(self):
         """Finish search and return identified patterns."""
@@ -955,6 +1212,7 @@ class BeamSearchAgent(SearchAgent):
             # Create visualization
             analysis_data = np.array(self.analyze_embs)
             if len(analysis_data) > 0 and len(analysis_data[0]) >= 2:
+                import matplotlib.pyplot as plt
                 xs, ys = analysis_data[:, 0], analysis_data[:, 1]
                 plt.scatter(xs, ys, color="red", label="motif")
                 plt.legend()
@@ -962,6 +1220,7 @@ class BeamSearchAgent(SearchAgent):
                 plt.close()
         
         # Collect results
+        rng = random.Random(self.seed)
         cand_patterns_uniq = []
         for pattern_size in range(self.min_pattern_size, self.max_pattern_size + 1):
             pattern_counts = [(h, len(ps)) for h, ps in self.pattern_counts[pattern_size].items()]
@@ -970,7 +1229,7 @@ class BeamSearchAgent(SearchAgent):
             for wl_hash, count in sorted(pattern_counts, key=lambda x: x[1], reverse=True)[:self.out_batch_size]:
                 patterns = self.pattern_counts[pattern_size][wl_hash]
                 if patterns:
-                    cand_patterns_uniq.append(random.choice(patterns))
+                    cand_patterns_uniq.append(rng.choice(patterns))
                     print(f"- outputting {count} motifs of size {pattern_size}")
         
         return cand_patterns_uniq
\ No newline at end of file
@@ -0,0 +1,545 @@
+"""Long-lived mining service that keeps datasets, models and embeddings warm.
+
+    python3 -m subgraph_mining.service [decoder arguments]
+
+starts an HTTP server on --serve_address (host:port, or unix:PATH for a Unix
+socket). The decoder arguments it is started with are the defaults of every
+job, and their dataset, model and neighborhood embeddings are loaded at
+startup. Jobs are POSTed as JSON to /mine, /score or /count; "argv" (decoder
+command line arguments) and "args" (decoder arguments by name) override the
+defaults for the job, except that files they name (other than those of the
+defaults) must be inside --serve_dir. Jobs run one at a time, and the response streams one
+JSON object per line: the output of the job as "log" lines and "progress"
+(progress bar) updates, then a "result" or an "error". GET /status lists
+what is loaded. subgraph_mining/service_client.py submits jobs.
+
+Jobs can make the service read pickles and write files, so when
+--serve_token is set, every request must carry it ("Authorization: Bearer
+TOKEN"); it is required to listen on anything but a Unix socket or a
+loopback address.
+
+Every stage of a run is cached under the arguments it depends on: the
+dataset graphs and seed samplers, the model and inference engine, the
+sampled neighborhoods with their embeddings and dominance index, and the
+pool of greedy search processes. A job that only changes search settings
+(strategy, n_trials, pattern sizes, out_batch_size, ...) reuses all of them.
+Files are keyed by modification time, so a retrained checkpoint or a
+rewritten dataset is loaded again.
+
+Jobs:
+    mine    runs a search, writes the patterns to out_path ("plots": true also
+            draws them) and returns them ("seed" seeds greedy trials)
+    score   scores patterns against the neighborhood embeddings as the search
+            does (lower is more frequent)
+    count   counts the occurrences of patterns in the dataset graphs with
+            analyze/count_patterns.py ("count_args" overrides its arguments)
+Patterns are given as "patterns" (graphs in the format of graph_to_json) or
+"patterns_path" (a pickle of NetworkX graphs in --serve_dir, as written to
+out_path).
+"""
+import argparse
+from collections import OrderedDict
+from contextlib import redirect_stderr, redirect_stdout
+import copy
+import hmac
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import pickle
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import networkx as nx
+import torch
+import torch.multiprocessing as mp
+
+from analyze import count_patterns
+from common import graph_store
+from common.seed_sampler import SeedSampler
+from subgraph_matching.config import parse_encoder
+from subgraph_mining import decoder
+from subgraph_mining.config import parse_decoder
+from subgraph_mining.distributed import is_loopback
+from subgraph_mining.search_agents import SearchAgent, init_greedy_worker
+from subgraph_mining.service_client import JOBS, parse_service_address
+
+MAX_CACHED = 2            # entries kept per stage, least recently used dropped
+PROGRESS_INTERVAL = 0.5   # seconds between progress events of a job
+
+# arguments each stage depends on, besides the stages it is built from
+DATASET_ARGS = ("dataset", "graph_type")
+MODEL_ARGS = ("model_path", "method_type", "conv_type", "n_layers",
+    "hidden_dim", "skip", "dropout", "node_anchored", "precision",
+    "precision_tolerance")
+ENGINE_ARGS = ("inference_backend", "incremental_embedding",
+    "n_parity_graphs", "min_neighborhood_size", "max_neighborhood_size",
+    "batch_size")
+NEIGH_ARGS = ("use_whole_graphs", "sample_method", "n_neighborhoods",
+    "min_neighborhood_size", "max_neighborhood_size", "radius",
+    "subgraph_sample_size", "emb_index_leaf_size")
+SEED_ARGS = ("min_pattern_size", "seed_scheme")
+POOL_ARGS = ("n_workers", "n_threads")
+# arguments naming files that are read or written; jobs may only point them
+# inside --serve_dir
+PATH_ARGS = ("dataset", "model_path", "out_path", "instance_spill_path",
+    "autotune_cache", "precision_pairs_path", "journal_path",
+    "dist_cache_dir", "val_cache_dir", "graph_pkl_path")
+
+
+def graph_to_json(graph):
+    """A pattern as {"directed", "nodes": [{"id", ...attributes}], "edges":
+    [{"source", "target", ...attributes}]}."""
+    return {"directed": graph.is_directed(),
+        "nodes": [dict(attrs, id=node) for node, attrs in
+            graph.nodes(data=True)],
+        "edges": [dict(attrs, source=u, target=v) for u, v, attrs in
+            graph.edges(data=True)]}
+
+
+def graph_from_json(data):
+    graph = nx.DiGraph() if data.get("directed") else nx.Graph()
+    for node in data["nodes"]:
+        node = dict(node)
+        graph.add_node(node.pop("id"), **node)
+    for edge in data["edges"]:
+        edge = dict(edge)
+        graph.add_edge(edge.pop("source"), edge.pop("target"), **edge)
+    return graph
+
+
+def _anchor(pattern):
+    """The anchor node of a node-anchored pattern (its first node if none is
+    marked)."""
+    return next((v for v, a in pattern.nodes(data="anchor") if a == 1),
+        next(iter(pattern.nodes)))
+
+
+def _file_stamp(path):
+    return os.path.getmtime(path) if os.path.isfile(path) else None
+
+
+def _key(args, names):
+    return tuple(getattr(args, name, None) for name in names)
+
+
+class StageCache:
+    """ Least recently used entries of one stage of a run.
+
+    Args:
+        name: description of the stage, for the log.
+        size: number of entries kept.
+        close: called with the value of a dropped entry.
+    """
+    def __init__(self, name, size=MAX_CACHED, close=None):
+        self.name = name
+        self.size = size
+        self.close = close
+        self.entries = OrderedDict()
+
+    def get(self, key, build):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            print(f"Reusing {self.name}")
+            return self.entries[key]
+        start = time.time()
+        value = build()
+        print(f"Built {self.name} in {time.time() - start:.1f}s")
+        self.entries[key] = value
+        while len(self.entries) > self.size:
+            _, old = self.entries.popitem(last=False)
+            if self.close is not None:
+                self.close(old)
+        return value
+
+    def clear(self):
+        while self.entries:
+            _, old = self.entries.popitem(last=False)
+            if self.close is not None:
+                self.close(old)
+
+
+class _EventStream(io.TextIOBase):
+    """Text written by a job, sent as "log" events per line and, at most
+    every PROGRESS_INTERVAL seconds, "progress" events per carriage-return
+    terminated update (tqdm)."""
+    def __init__(self, send):
+        self.send = send
+        self.pending = ""
+        self.last_progress = 0.0
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.pending += text
+        while True:
+            ends = [i for i in (self.pending.find("\n"),
+                self.pending.find("\r")) if i >= 0]
+            if not ends:
+                break
+            end = min(ends)
+            line, sep = self.pending[:end], self.pending[end]
+            self.pending = self.pending[end+1:]
+            if not line.strip():
+                continue
+            if sep == "\n":
+                self.send({"event": "log", "text": line})
+            elif time.time() - self.last_progress >= PROGRESS_INTERVAL:
+                self.last_progress = time.time()
+                self.send({"event": "progress", "text": line})
+        return len(text)
+
+    def finish(self):
+        if self.pending.strip():
+            self.send({"event": "log", "text": self.pending})
+        self.pending = ""
+
+
+class MiningService:
+    """ Runs jobs on the cached stages of mining runs.
+
+    Args:
+        args: decoder arguments, the defaults of every job.
+        parser: the decoder argument parser, for the "argv" of jobs.
+    """
+    def __init__(self, args, parser):
+        self.args = args
+        self.parser = parser
+        self.root = os.path.realpath(args.serve_dir)
+        self.lock = threading.Lock()   # jobs run one at a time
+        self.n_jobs = 0
+        self.started = time.time()
+        self.datasets = StageCache("dataset graphs")
+        self.models = StageCache("model")
+        self.engines = StageCache("inference engine")
+        self.samplers = StageCache("neighborhood sampler")
+        self.seed_samplers = StageCache("seed sampler")
+        self.neighborhoods = StageCache("neighborhood embeddings")
+        self.pools = StageCache("search process pool", size=1,
+            close=lambda pool: pool.terminate())
+        self.caches = (self.datasets, self.models, self.engines,
+            self.samplers, self.seed_samplers, self.neighborhoods, self.pools)
+
+    def job_args(self, params):
+        """The decoder arguments of a job."""
+        args = copy.copy(self.args)
+        if params.get("argv"):
+            args, unknown = self.parser.parse_known_args(params["argv"],
+                namespace=args)
+            if unknown:
+                raise ValueError(f"unrecognized arguments: "
+                    f"{' '.join(unknown)}")
+        for name, value in params.get("args", {}).items():
+            if not hasattr(args, name):
+                raise ValueError(f"unknown argument {name!r}")
+            setattr(args, name, value)
+        for name in PATH_ARGS:
+            value = getattr(args, name, None)
+            if value == getattr(self.args, name, None):
+                continue
+            # benchmark dataset names are not paths
+            if name != "dataset" or os.path.exists(value) or \
+                os.path.dirname(value):
+                self.allowed_path(value, name)
+        if args.distributed:
+            raise ValueError("--distributed does not apply to service jobs")
+        if args.journal_path or args.resume:
+            print("WARNING: --journal_path/--resume are ignored by service "
+                "jobs")
+            args.journal_path, args.resume = None, False
+        return args
+
+    def allowed_path(self, path, name):
+        """path if it is inside the service's --serve_dir."""
+        if not isinstance(path, str) or os.path.commonpath([self.root,
+            os.path.realpath(path)]) != self.root:
+            raise ValueError(f"{name} must be inside --serve_dir "
+                f"{self.args.serve_dir}")
+        return path
+
+    def graphs(self, args):
+        """(graphs, key) of the dataset of args."""
+        # memory-efficient greedy tree search reads a graph store lazily
+        lazy = (args.dataset.endswith(graph_store.GRAPH_STORE_EXT) and
+            args.memory_efficient and args.search_strategy == "greedy" and
+            args.sample_method == "tree")
+        key = _key(args, DATASET_ARGS) + (lazy, _file_stamp(args.dataset))
+        return self.datasets.get(key, lambda: decoder.dataset_graphs(
+            *decoder.load_dataset(args))), key
+
+    def warm(self, args):
+        """The stages of a run with args, built if not cached: a dict with
+        graphs, model, engine, neigh_sampler, seed_sampler, neighs, anchors,
+        embs, emb_index and key (of the embeddings)."""
+        graphs, data_key = self.graphs(args)
+        model_key = _key(args, MODEL_ARGS) + (_file_stamp(args.model_path),)
+        model = self.models.get(model_key, lambda: decoder.load_model(args))
+        seed_sampler = self.seed_samplers.get(data_key + _key(args,
+            SEED_ARGS), lambda: SeedSampler(graphs,
+                min_reachable=args.min_pattern_size, scheme=args.seed_scheme))
+        neigh_sampler = self.samplers.get(data_key + _key(args, SEED_ARGS) +
+            (args.min_neighborhood_size,), lambda:
+            decoder.neighborhood_sampler(graphs, args, seed_sampler))
+        engine_key = data_key + model_key + _key(args, ENGINE_ARGS)
+        engine = self.engines.get(engine_key, lambda: decoder.build_engine(
+            model, graphs, args, neigh_sampler))
+
+        def embed():
+            neighs, anchors = decoder.sample_neighborhoods(graphs, args,
+                neigh_sampler)
+            embs = decoder.embed_neighborhoods(neighs, anchors, engine, args)
+            return {"neighs": neighs, "anchors": anchors, "embs": embs,
+                "emb_index": decoder.neighborhood_index(embs, args)}
+        neigh_key = engine_key + _key(args, NEIGH_ARGS)
+        state = dict(self.neighborhoods.get(neigh_key, embed), graphs=graphs,
+            model=model, engine=engine, neigh_sampler=neigh_sampler,
+            seed_sampler=seed_sampler, key=neigh_key)
+        return state
+
+    def pool(self, args, state):
+        """Warm pool of greedy search processes for the run of args."""
+        key = state["key"] + _key(args, SEED_ARGS + POOL_ARGS)
+        return self.pools.get(key, lambda: mp.Pool(processes=args.n_workers,
+            initializer=init_greedy_worker, initargs=(state["model"],
+                state["graphs"], state["embs"], args, state["engine"],
+                state["emb_index"], None, state["seed_sampler"])))
+
+    def prepare(self, args):
+        """Warm stages and, for greedy search, process pool of a run."""
+        state = self.warm(args)
+        decoder.configure_parallelism(args, state["model"], state["embs"],
+            state["engine"], state["emb_index"], state["seed_sampler"],
+            state["neigh_sampler"])
+        pool = None
+        if args.search_strategy == "greedy" and not args.memory_efficient:
+            pool = self.pool(args, state)
+        return state, pool
+
+    def patterns(self, params):
+        if "patterns" in params:
+            return [graph_from_json(data) for data in params["patterns"]]
+        if "patterns_path" in params:
+            with open(self.allowed_path(params["patterns_path"],
+                "patterns_path"), "rb") as f:
+                return pickle.load(f)
+        raise ValueError("the job needs patterns or patterns_path")
+
+    def mine(self, params):
+        args = self.job_args(params)
+        state, pool = self.prepare(args)
+        agent = decoder.make_agent(args, state["model"], state["graphs"],
+            state["embs"], state["engine"], state["emb_index"],
+            state["seed_sampler"], seed=params.get("seed"), pool=pool)
+        start = time.time()
+        out_graphs = agent.run_search(args.n_trials)
+        print(f"Searched in {time.time() - start:.1f}s")
+        if params.get("plots"):
+            os.makedirs("plots/cluster", exist_ok=True)
+        decoder.save_patterns(out_graphs, args, plots=params.get("plots",
+            False))
+        return {"out_path": args.out_path,
+            "patterns": [graph_to_json(g) for g in out_graphs]}
+
+    def score(self, params):
+        args = self.job_args(params)
+        patterns = self.patterns(params)
+        state = self.warm(args)
+        agent = SearchAgent(args.min_pattern_size, args.max_pattern_size,
+            state["model"], state["graphs"], state["embs"],
+            node_anchored=args.node_anchored, model_type=args.method_type,
+            engine=state["engine"], emb_index=state["emb_index"],
+            seed_sampler=state["seed_sampler"])
+        scores = []
+        for i in range(0, len(patterns), args.batch_size):
+            batch = patterns[i:i+args.batch_size]
+            with torch.no_grad():
+                embs = state["engine"].embed_graphs(batch, anchors=[
+                    _anchor(p) for p in batch] if args.node_anchored else
+                    None)
+            scores.extend(agent._score_embeddings(embs))
+        return {"scores": scores}
+
+    def count(self, params):
+        args = self.job_args(params)
+        # counting needs NetworkX graphs, not lazy views
+        args.memory_efficient = False
+        patterns = self.patterns(params)
+        graphs, _ = self.graphs(args)
+        count_args = count_patterns.arg_parse([])
+        count_args.node_anchored = args.node_anchored
+        count_args.n_workers = args.n_workers
+        for name, value in params.get("count_args", {}).items():
+            if not hasattr(count_args, name):
+                raise ValueError(f"unknown count argument {name!r}")
+            setattr(count_args, name, value)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # counts and skipped tasks of earlier jobs must not be resumed
+            count_args.checkpoint_file = os.path.join(tmp_dir,
+                "checkpoint.json")
+            count_args.problematic_tasks_file = os.path.join(tmp_dir,
+                "problematic_tasks.json")
+            counts = count_patterns.count_graphlets(patterns, graphs,
+                count_args)
+        return {"counts": counts}
+
+    def run_job(self, job, params, send):
+        """Runs a job, sending its output and result as events."""
+        if self.lock.locked():
+            send({"event": "queued"})
+        with self.lock:
+            start = time.time()
+            out = _EventStream(send)
+            try:
+                with redirect_stdout(out), redirect_stderr(out):
+                    result = getattr(self, job)(params)
+                out.finish()
+                send(dict(result, event="result",
+                    seconds=time.time() - start))
+                status = "done"
+            except (Exception, SystemExit) as e:   # argparse exits on errors
+                out.finish()
+                traceback.print_exc(file=sys.__stderr__)
+                send({"event": "error", "error": f"{type(e).__name__}: {e}"})
+                status = "failed"
+            self.n_jobs += 1
+        print(f"[{time.strftime('%H:%M:%S')}] {job} job {status} in "
+            f"{time.time() - start:.1f}s", file=sys.__stdout__, flush=True)
+
+    def status(self):
+        return {"uptime": time.time() - self.started, "jobs": self.n_jobs,
+            "busy": self.lock.locked(),
+            "cached": {cache.name: [repr(key) for key in cache.entries]
+                for cache in self.caches}}
+
+    def close(self):
+        for cache in self.caches:
+            cache.clear()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    def _authorized(self):
+        """Whether the request carries the service token, if there is one;
+        replies 401 if not."""
+        token = self.server.token
+        if token is None or hmac.compare_digest(self.headers.get(
+            "Authorization", "").encode(), f"Bearer {token}".encode()):
+            return True
+        self._reply(401, {"event": "error", "error": "missing or wrong "
+            "service token"})
+        return False
+
+    def _send(self, event):
+        try:
+            self.wfile.write(json.dumps(event, default=str).encode() + b"\n")
+            self.wfile.flush()
+        except OSError:   # the client went away; the job still completes
+            pass
+
+    def _reply(self, code, event):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        self._send(event)
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path.rstrip("/") == "/status":
+            self._reply(200, self.server.service.status())
+        else:
+            self._reply(404, {"event": "error",
+                "error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        job = self.path.strip("/")
+        if job not in JOBS:
+            self._reply(404, {"event": "error", "error": f"unknown job "
+                f"{job!r}, expected one of {JOBS}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._reply(400, {"event": "error", "error": f"bad job: {e}"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        self.server.service.run_job(job, params, self._send)
+
+    def log_message(self, format, *args):
+        # stderr is the output of the running job
+        print(f"[{time.strftime('%H:%M:%S')}] {format % args}",
+            file=sys.__stderr__)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+    socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def check_token(address, token):
+    """Raises ValueError if the service would listen on a non-loopback TCP
+    address without a token."""
+    kind, where = parse_service_address(address)
+    if kind == "tcp" and token is None and not is_loopback(where[0]):
+        raise ValueError(f"--serve_address {address} is not a loopback "
+            "address: set --serve_token, jobs can read and write files")
+
+
+def make_server(address, service, token=None):
+    """HTTP server of service on address; requests must carry token if it is
+    set (see check_token)."""
+    check_token(address, token)
+    kind, where = parse_service_address(address)
+    if kind == "unix":
+        if os.path.exists(where):   # left by a service that was killed
+            os.remove(where)
+        server = UnixHTTPServer(where, ServiceHandler)
+    else:
+        server = ThreadingHTTPServer(where, ServiceHandler)
+        server.daemon_threads = True
+    server.service = service
+    server.token = token
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mining service arguments')
+    parse_encoder(parser)
+    parse_decoder(parser)
+    args = parser.parse_args()
+
+    # fail before loading anything
+    check_token(args.serve_address, args.serve_token)
+    service = MiningService(args, parser)
+    try:
+        # the run the service was started with is warm for the first job
+        service.prepare(service.job_args({}))
+    except Exception:
+        traceback.print_exc()
+        print(f"WARNING: could not preload the run of {args.dataset}")
+    server = make_server(args.serve_address, service, args.serve_token)
+    print(f"Mining service listening on {args.serve_address}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Client of the mining service (subgraph_mining/service.py).
+
+Only uses the standard library, so submitting a job does not pay for the
+imports of the miner:
+
+    python3 -m subgraph_mining.service_client mine --n_trials 200 --max_pattern_size 6
+    python3 -m subgraph_mining.service_client score --patterns_path results/out-patterns.p
+    python3 -m subgraph_mining.service_client status
+
+Arguments the client does not know are decoder arguments; they override the
+arguments the service was started with for this job only.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+
+DEFAULT_ADDRESS = "localhost:8765"   # default of --serve_address
+TOKEN_ENV = "MINER_SERVICE_TOKEN"    # default of --token
+JOBS = ("mine", "score", "count")
+
+
+def parse_service_address(address):
+    """("unix", path) for "unix:PATH", else ("tcp", (host, port))."""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, port = address.rsplit(":", 1)
+    return "tcp", (host, int(port))
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def _connection(address):
+    kind, where = parse_service_address(address)
+    if kind == "unix":
+        return UnixHTTPConnection(where)
+    return http.client.HTTPConnection(*where)
+
+
+def _headers(token):
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+def status(address=DEFAULT_ADDRESS, token=None):
+    """What the service has loaded, as a dict."""
+    conn = _connection(address)
+    try:
+        conn.request("GET", "/status", headers=_headers(token))
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def submit(address, job, params, token=None):
+    """Yields the events of a job as the service streams them: dicts with an
+    "event" key, "queued", "log", "progress", then "result" or "error".
+
+    Args:
+        address: host:port or unix:PATH of the service.
+        job: one of JOBS.
+        params: the job as a dict; "argv" (decoder command line arguments)
+            and "args" (decoder arguments by name) override the service's
+            arguments, see subgraph_mining/service.py for the rest.
+        token: the service's --serve_token, if it has one.
+    """
+    conn = _connection(address)
+    try:
+        conn.request("POST", "/" + job, body=json.dumps(params),
+            headers=dict(_headers(token), **{"Content-Type":
+                "application/json"}))
+        for line in conn.getresponse():
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        conn.close()
+
+
+def print_events(events):
+    """Prints the output and result of a job; returns the exit status."""
+    in_progress = False   # a progress line is being overwritten
+    for event in events:
+        if in_progress and event["event"] != "progress":
+            print()
+        in_progress = event["event"] == "progress"
+        if event["event"] == "log":
+            print(event["text"], flush=True)
+        elif event["event"] == "progress":
+            print("\r" + event["text"], end="", flush=True)
+        elif event["event"] == "queued":
+            print("Waiting for the running job to finish...", flush=True)
+        elif event["event"] == "error":
+            print("Job failed: " + event["error"], file=sys.stderr)
+            return 1
+        elif event["event"] == "result":
+            result = {k: v for k, v in event.items() if k != "event"}
+            if "patterns" in result:
+                result["patterns"] = len(result["patterns"])
+            print(json.dumps(result))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit a job to the "
+        "mining service; other arguments are decoder arguments overriding "
+        "the service's", allow_abbrev=False)
+    parser.add_argument("job", choices=JOBS + ("status",))
+    parser.add_argument("--service", default=DEFAULT_ADDRESS,
+        help="host:port or unix:PATH of the service")
+    parser.add_argument("--token", default=os.environ.get(TOKEN_ENV),
+        help=f"the service's --serve_token (default: ${TOKEN_ENV})")
+    parser.add_argument("--patterns_path",
+        help="score, count: pickle of the patterns (as written to out_path) "
+        "in the service's --serve_dir")
+    parser.add_argument("--seed", type=int,
+        help="mine: seed of the greedy search trials")
+    parser.add_argument("--plots", action="store_true",
+        help="mine: also draw the patterns to plots/cluster")
+    args, argv = parser.parse_known_args()
+
+    if args.job == "status":
+        print(json.dumps(status(args.service, args.token), indent=2))
+        return 0
+    params = {"argv": argv}
+    for name in ("patterns_path", "seed"):
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+    if args.plots:
+        params["plots"] = True
+    return print_events(submit(args.service, args.job, params, args.token))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
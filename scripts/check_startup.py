@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Startup-time budget of the miner's entry points.
+
+Every check runs in a fresh interpreter, like a spawned search worker or a
+CLI call, and fails if it takes longer than its budget. Also fails if
+importing the mining path (what every spawned worker imports) loads a
+module only needed for plots, training data or analysis.
+
+    python3 scripts/check_startup.py
+    python3 scripts/check_startup.py --import_budget 4 --help_budget 0.5
+"""
+import argparse, json, os, pathlib, subprocess, sys, time
+
+REPO = pathlib.Path(__file__).resolve().parent.parent / "neural-subgraph-matcher-miner"
+
+# (name, python arguments, budget): "help" commands must not import torch,
+# "import" ones pay for torch and torch_geometric only
+CHECKS = [
+    ("decoder --help", ["-m", "subgraph_mining.decoder", "--help"], "help"),
+    ("count_patterns --help", ["-m", "analyze.count_patterns", "--help"], "help"),
+    ("service_client --help", ["-m", "subgraph_mining.service_client", "--help"], "help"),
+    ("import decoder", ["-c", "import subgraph_mining.decoder"], "import"),
+    ("import search_agents (worker)", ["-c", "import subgraph_mining.search_agents"], "import"),
+]
+
+MINING_PATH = ["subgraph_mining.decoder", "subgraph_mining.search_agents",
+    "analyze.count_patterns"]
+# must stay behind the code paths that use them
+DEFERRED = ["matplotlib", "sklearn", "scipy.io", "scipy.stats", "common.data",
+    "common.combined_syn", "subgraph_matching.test", "visualizer"]
+
+def run(python_args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO), env.get("PYTHONPATH")]))
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable] + python_args, cwd=REPO, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - start, proc
+
+def deferred_loaded():
+    code = ("import importlib, json, sys\n"
+        f"for m in {MINING_PATH!r}: importlib.import_module(m)\n"
+        f"print(json.dumps(sorted(m for m in sys.modules if any("
+        f"m == d or m.startswith(d + '.') for d in {DEFERRED!r}))))")
+    _, proc = run(["-c", code])
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the startup time of "
+        "the miner's entry points")
+    parser.add_argument("--help_budget", type=float, default=1.0,
+        help="seconds allowed for a --help call")
+    parser.add_argument("--import_budget", type=float, default=8.0,
+        help="seconds allowed for importing a mining module (torch included)")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="runs of each check; the fastest counts")
+    args = parser.parse_args()
+    budgets = {"help": args.help_budget, "import": args.import_budget}
+
+    failed = 0
+    for name, python_args, kind in CHECKS:
+        times = []
+        for _ in range(args.repeat):
+            seconds, proc = run(python_args)
+            if proc.returncode != 0:
+                print(f"FAIL {name}: exit status {proc.returncode}\n{proc.stderr}")
+                failed += 1
+                break
+            times.append(seconds)
+        else:
+            ok = min(times) <= budgets[kind]
+            failed += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {name}: {min(times):.2f}s "
+                f"(budget {budgets[kind]:.2f}s)")
+
+    loaded = deferred_loaded()
+    if loaded:
+        failed += 1
+        print("FAIL the mining path imports deferred modules:", ", ".join(loaded))
+    else:
+        print("ok   the mining path imports no deferred module")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
-import json, random, pathlib, networkx as nx
+import json, random, pathlib, sys, networkx as nx
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "neural-subgraph-matcher-miner"))
+from common import edgelist
 
 BASE = pathlib.Path.home() / "galaxy-mining"
 DATA = BASE / "data"
@@ -26,8 +29,9 @@ def load_tools():
 def load_graph(tools):
     G = nx.DiGraph()
     if EDGE_LIST.exists():
-        # read weighted edgelist u v weight
-        G = nx.read_weighted_edgelist(EDGE_LIST, create_using=nx.DiGraph, nodetype=str)
+        # read weighted edgelist u v weight (vectorized, string node names)
+        G = edgelist.load_edgelist(str(EDGE_LIST), directed=True, weight_col=2,
+                                   node_type=str).to_networkx("directed")
         # Ensure all tools present as nodes (even isolated)
         for t in tools:
             G.add_node(t)
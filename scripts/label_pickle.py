@@ -1,8 +1,12 @@
-import pickle, pathlib, networkx as nx
+import pickle, pathlib, sys, networkx as nx
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "neural-subgraph-matcher-miner"))
+from common import graph_store
 
 base = pathlib.Path.home()/ "galaxy-mining" / "data"
 src  = base / "aura_tool_graph_attr.pkl"          # from previous step
 dst  = base / "aura_tool_graph_attr_weighted.pkl" # new file with edge_weight
+dst_store = dst.with_suffix(graph_store.GRAPH_STORE_EXT)  # memory-mapped copy for the miner
 
 G = pickle.loads(src.read_bytes())
 if not isinstance(G, (nx.Graph, nx.DiGraph)):
@@ -27,4 +31,8 @@ for n in G.nodes():
     G.nodes[n].setdefault("id", str(n))
 
 dst.write_bytes(pickle.dumps(G, protocol=pickle.HIGHEST_PROTOCOL))
-print(f"[OK] wrote {dst} | nodes={G.number_of_nodes()} edges={G.number_of_edges()}")
\ No newline at end of file
+print(f"[OK] wrote {dst} | nodes={G.number_of_nodes()} edges={G.number_of_edges()}")
+
+# Memory-mapped store: the miner loads this in milliseconds instead of unpickling
+graph_store.CompactGraph.from_networkx(G).save(str(dst_store))
+print(f"[OK] wrote {dst_store}")
\ No newline at end of file
@@ -40,6 +40,9 @@ def build_argv(profile="FAST"):
     BASE   = pathlib.Path.home() / "galaxy-mining"
     CKPT   = BASE / "neural-subgraph-matcher-miner" / "ckpt" / "model.pt"
     PICKLE = BASE / "data" / "aura_tool_graph_attr_weighted.pkl"
+    if os.environ.get("MINER_GSTORE"):
+        # memory-mapped copy written by scripts/label_pickle.py
+        PICKLE = PICKLE.with_suffix(".gstore")
     OUT    = BASE / "results" / ("mined_patterns_fast.pkl" if profile=="FAST" else "mined_patterns.pkl")
 
     common = [
@@ -51,6 +54,10 @@ def build_argv(profile="FAST"):
         "--min_pattern_size", "3",
         "--max_pattern_size", "8",
         "--out_path", str(OUT),
+        # completed trials survive preemption; MINER_RESUME=1 picks up from here
+        "--journal_path", str(OUT.with_suffix(".journal")),
+        # workers x threads x batch size measured once per host (cached)
+        "--autotune",
     ]
 
     if profile == "FAST":
@@ -72,17 +79,42 @@ def build_argv(profile="FAST"):
             "--subgraph_sample_size", "256",
             "--radius", "2",
             "--batch_size", "16",
-            "--n_trials", "1000",
+            "--n_trials", "1000",           # upper bound:
+            "--adaptive_trials",            # stops once the ranking is stable
             "--out_batch_size", "10"
         ]
     return common
 
+def submit_run(address, argv):
+    """Runs the search as a job of a mining service that keeps the dataset,
+    model and embeddings loaded (subgraph_mining/service.py)."""
+    from subgraph_mining.service_client import TOKEN_ENV, print_events, submit
+    return print_events(submit(address, "mine", {"argv": argv},
+        token=os.environ.get(TOKEN_ENV)))
+
 def main():
+    profile = os.environ.get("MINER_PROFILE", "FAST").upper()  # FAST or FULL
+    argv = build_argv(profile)
+    if os.environ.get("MINER_RESUME"):
+        # only after an interruption: the journal is checked against the
+        # settings, dataset and checkpoint, and a finished run starts over
+        argv.append("--resume")
+    if os.environ.get("MINER_SERVICE"):
+        # e.g. MINER_SERVICE=localhost:8765, a service started with MINER_SERVE=1
+        print(f"Submitting to the mining service at {os.environ['MINER_SERVICE']}")
+        return submit_run(os.environ["MINER_SERVICE"], argv[1:])
+    if os.environ.get("MINER_SERVE"):
+        # stay up with this run's dataset, model and embeddings loaded
+        argv[0] = "subgraph_mining.service"
+        if os.environ.get("MINER_SERVICE_TOKEN"):
+            argv += ["--serve_token", os.environ["MINER_SERVICE_TOKEN"]]
+
     # Safer multiprocessing
     try:
         mp.set_start_method("fork", force=True)
     except RuntimeError:
         pass
+    # search processes set their own thread count (--autotune, --n_threads)
     os.environ.setdefault("OMP_NUM_THREADS", "1")
     os.environ.setdefault("MKL_NUM_THREADS", "1")
 
@@ -90,17 +122,14 @@ def main():
     patch_numpy_visible_deprecation()
     patch_sageconv_edge_weight()
 
-    profile = os.environ.get("MINER_PROFILE", "FAST").upper()  # FAST or FULL
-    argv = build_argv(profile)
-
-    print("Running decoder with args:\n  ", " ".join(argv[1:]))
+    print("Running {} with args:\n  ".format(argv[0]), " ".join(argv[1:]))
 
     _old_argv = sys.argv[:]
     try:
         sys.argv = argv
-        runpy.run_module("subgraph_mining.decoder", run_name="__main__")
+        runpy.run_module(argv[0], run_name="__main__")
     finally:
         sys.argv = _old_argv
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file